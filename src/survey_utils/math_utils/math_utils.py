@@ -1,5 +1,50 @@
 
+import bisect
+from collections import OrderedDict, namedtuple
+import json
+import multiprocessing
+import numbers
+from multiprocessing.pool import ThreadPool
+import warnings
+
 import numpy as np
+import pandas as pd
+
+try:
+    import scipy.sparse as sp
+except ImportError:
+    # Sparse matrices are then not supported:
+    sp = None
+
+try:
+    # Paths of .npy files may be unicode in Python 2:
+    STRING_TYPES = (str, unicode)
+except NameError:
+    STRING_TYPES = (str,)
+
+# Largest number of array cells that blockwise 
+# missing-value replacement holds in memory at 
+# a time:
+DEFAULT_BLOCK_SIZE = 2**24
+
+# Default bound on the rank error of quantiles
+# estimated by QuantileSketch, as a fraction of 
+# the number of values:
+DEFAULT_SKETCH_ERROR = 0.01
+
+# Ways of turning replacement values into integers
+# when they are written into integer arrays:
+INT_ROUNDINGS = ['truncate', 'round', 'floor', 'ceil']
+
+# Metrics of respondent_distances(), and the
+# largest number of cells it compares at a time;
+# small enough for the processor caches:
+DISTANCE_METRICS = ['euclidean', 'hamming', 'gower']
+DEFAULT_DISTANCE_BLOCK_SIZE = 2**18
+
+# Number of respondents in each mini-batch of the
+# first stage of ward_linkage(..., n_clusters=k):
+DEFAULT_PRECLUSTER_BATCH_SIZE = 1024
 
 #-------------------------
 # replacZerosNparray()
@@ -7,7 +52,15 @@ import numpy as np
 def replaceMissingValsNparray(nxmNparray, 
                         direction='column',
                         replacement='median',
-                        missing_value=np.nan):
+                        missing_value=None,
+                        block_size=None,
+                        sketch_error=DEFAULT_SKETCH_ERROR,
+                        n_jobs=1,
+                        mask=None,
+                        return_mask=False,
+                        preserve_dtype=False,
+                        scratch=False,
+                        int_rounding='truncate'):
     '''
     Given nxm nparray, replace every zero
     with the median/mean of either the cell's row 
@@ -41,49 +94,162 @@ def replaceMissingValsNparray(nxmNparray,
                
     Analogously with the mean.
     
-    :param nxmNparray: a two-dimensional numpy ndarray
-    :type nxmNparray: numpby.ndarray 
+    With replacement='approx_median', the median of
+    each vector is estimated by a QuantileSketch, which
+    does not need the whole vector in memory, nor sorts
+    it. The estimate's rank is within sketch_error * n 
+    of the true median's rank.
+    
+    Arrays too large for memory can be passed as an 
+    numpy.memmap, or as the path to an .npy file, which 
+    is then memory-mapped. They are processed in blocks 
+    of whole columns (or rows) of at most block_size 
+    cells: a first pass computes the median/mean of each
+    vector, and a second pass fills the missing values
+    in place.
+    
+    With n_jobs > 1, the columns (or rows) are split into
+    blocks, which a pool of threads processes in parallel.
+    NumPy releases the GIL while sorting and reducing, so
+    the threads share the CPUs. Each block is written by
+    one thread. Results equal those of the serial 
+    computation, up to rounding in the last bits of
+    means.
+    
+    Medians and means are computed in float64 working
+    copies, unless preserve_dtype is True. Float32 arrays
+    are then processed in float32 throughout, halving the
+    memory for the copies. With scratch=True and a 
+    block_size, one buffer of the working dtype is 
+    allocated, and reused for every block of vectors; 
+    the vectors are sorted in place there, rather than 
+    in temporaries made by numpy.nanmedian(). Missing 
+    values are filled without building index arrays.
+    Without a block_size, such a buffer would be as
+    large as the whole array, so scratch is ignored.
+    
+    A scipy.sparse matrix is handed to replaceMissingValsSparse(),
+    and the result returned as a new, dense ndarray; the
+    matrix itself is not changed. With missing_value None,
+    its unstored entries are the missing values. Sparse 
+    matrices are imputed in one pass, so block_size, n_jobs, 
+    mask, preserve_dtype, scratch, and int_rounding cannot
+    be given with them.
+    
+    Replacement values written into integer arrays are
+    truncated by default. Set int_rounding to 'round'
+    (to the nearest integer, halves to even), 'floor', 
+    or 'ceil' for other behavior.
+    
+    :param nxmNparray: a two-dimensional numpy ndarray, numpy.memmap, 
+        or path to an .npy file
+    :type nxmNparray: {numpby.ndarray | numpy.memmap | string} 
     :param direction=: direction along which the median or mean
         is computed for replacing missing values. Options are
         'column' and 'row'
     :type directions=: string
     :param replacement=: whether to compute median or mean of
         the chosen direction (row/column) to replace missing
-        values. Options are 'median' and 'mean'
+        values. Options are 'median', 'approx_median', and 'mean'
     :type replacement=: string
     :param missing_value: the value that stands for 'value missing'. May be
-        zero, numpy.nan, numpy.inf, or any other value.
+        zero, numpy.nan, numpy.inf, or any other value, or a list, tuple,
+        or set of such values, such as [0, -99, numpy.nan]. None stands
+        for numpy.nan, or for the unstored entries of sparse matrices.
     :type missing_value: ANY
-    :returns new ndarray with zeros replaced.    
-    :rtype: numpay.ndarray
+    :param block_size: largest number of cells processed at a time.
+        If None, arrays are processed all at once, and memory-mapped
+        arrays in blocks of DEFAULT_BLOCK_SIZE cells.
+    :type block_size: {None | int}
+    :param sketch_error: rank error bound for replacement='approx_median'
+    :type sketch_error: float
+    :param n_jobs: number of threads. If less than 1, one thread per CPU.
+    :type n_jobs: int
+    :param mask: boolean array of nxmNparray's shape that is True where
+        values are missing, as returned with return_mask=True. If given,
+        missing_value is ignored, and the data is not scanned for it.
+    :type mask: {None | numpy.ndarray}
+    :param return_mask: if True, return the mask of missing values
+        along with the array, for use in later calls on the same
+        data. For memory-mapped arrays, the mask is held in memory.
+    :type return_mask: bool
+    :param preserve_dtype: if True, float arrays are not upcast to 
+        float64 for computing medians and means
+    :type preserve_dtype: bool
+    :param scratch: if True, reuse one working buffer for all blocks,
+        instead of allocating temporaries per block. Ignored if n_jobs
+        is not 1, or block_size is None.
+    :type scratch: bool
+    :param int_rounding: how replacement values are made integers for
+        integer arrays: 'truncate', 'round', 'floor', or 'ceil'
+    :type int_rounding: string
+    :returns new ndarray with zeros replaced, or a tuple of that 
+        ndarray and the mask if return_mask is True.
+    :rtype: {numpay.ndarray | (numpy.ndarray, numpy.ndarray)}
     '''
-    if direction == 'column':
-        vecSize = nxmNparray.shape[1]
-    else:
-        vecSize = nxmNparray.shape[0]
+    if isinstance(nxmNparray, STRING_TYPES):
+        nxmNparray = np.load(nxmNparray, mmap_mode='r+')
+    if sp is not None and sp.issparse(nxmNparray):
+        if block_size is not None or n_jobs != 1 or mask is not None or preserve_dtype or scratch or \
+           int_rounding != 'truncate':
+            raise ValueError('Sparse matrices are imputed without block_size, n_jobs, mask, '
+                             'preserve_dtype, scratch, or int_rounding')
+        imputation = replaceMissingValsSparse(nxmNparray, direction, replacement, missing_value, densify=False)
+        if return_mask:
+            return (imputation.toarray(), imputation.missing_mask())
+        return imputation.toarray()
+    if missing_value is None:
+        missing_value = np.nan
+    if block_size is None and isinstance(nxmNparray, np.memmap):
+        block_size = DEFAULT_BLOCK_SIZE
     
-    # For each column or row vector, replace
-    # all missing values with the median/mean 
-    # of that vector, calculated without those
-    # missing values:
+    if int_rounding not in INT_ROUNDINGS:
+        raise ValueError('Integer rounding must be one of %s; was %s' % (INT_ROUNDINGS, int_rounding))
     
-    for indx in range(vecSize):
-
-        if direction == 'column':
-            vec = nxmNparray[:,indx]
-        else:
-            vec = nxmNparray[indx,:]
-        
-        # Compute the median/mean for cells
-        # of the vector that are missing values:
-        if replacement == 'median':
-            replacement_value = np.median(non_matches(vec, missing_value))
-        else:
-            replacement_value = np.mean(non_matches(vec, missing_value))
-        
-        # Replace the missing value(s) (in the original data):
-        replace_matches(vec, missing_value, replacement_value)
-        
+    axis = 0 if direction == 'column' else 1
+    work_dtype = work_dtype_for(nxmNparray, preserve_dtype)
+    
+    if mask is None and return_mask:
+        mask = match_mask(nxmNparray, missing_value)
+    
+    if n_jobs != 1:
+        parallel_impute(nxmNparray, axis, replacement, missing_value, block_size, sketch_error, n_jobs, mask,
+                        work_dtype, int_rounding)
+        if isinstance(nxmNparray, np.memmap):
+            nxmNparray.flush()
+    elif replacement == 'approx_median':
+        # Sketches are fed in chunks of at most block_size
+        # cells, so memory is bounded even without blocks:
+        sketches = build_sketches(nxmNparray, direction, missing_value, 
+                                  error=sketch_error, 
+                                  block_size=block_size or DEFAULT_BLOCK_SIZE,
+                                  mask=mask)
+        replacement_values = np.array([sketch.median() for sketch in sketches])
+        blockwise_fill(nxmNparray, missing_value, 
+                       round_values(replacement_values, nxmNparray.dtype, int_rounding), 
+                       axis, block_size or DEFAULT_BLOCK_SIZE, mask)
+        if isinstance(nxmNparray, np.memmap):
+            nxmNparray.flush()
+    elif block_size is None:
+        # All vectors are processed at once: one mask 
+        # of the missing values, one reduction along
+        # the direction for the medians/means, and one 
+        # assignment into the missing cells:
+        if mask is None:
+            mask = match_mask(nxmNparray, missing_value)
+        replacement_values = vector_stats(nxmNparray, mask, axis, replacement, work_dtype)
+        fill_mask(nxmNparray, mask, round_values(replacement_values, nxmNparray.dtype, int_rounding), axis)
+    else:
+        replacement_values = blockwise_stats(nxmNparray, missing_value, axis, replacement, block_size, mask,
+                                             work_dtype, scratch)
+        blockwise_fill(nxmNparray, missing_value, 
+                       round_values(replacement_values, nxmNparray.dtype, int_rounding), 
+                       axis, block_size, mask, scratch)
+        if isinstance(nxmNparray, np.memmap):
+            nxmNparray.flush()
+    
+    if return_mask:
+        return(nxmNparray, mask)
     return(nxmNparray)
 
 #-------------------------
@@ -94,7 +260,9 @@ def replaceMissingValsNparray(nxmNparray,
 def replaceMissingValsDataFrame(nxmDataFrame, 
                           direction='column',
                           replacement='median',
-                          missing_value=np.nan):
+                          missing_value=np.nan,
+                          preserve_dtype=False,
+                          int_rounding='truncate'):
     '''
     Given nxm pandas DataFrame, replace every zero
     with the median/mean of either the cell's row 
@@ -141,56 +309,287 @@ def replaceMissingValsDataFrame(nxmDataFrame,
     :param missing_value: the value that stands for 'value missing'. May be
         zero, numpy.nan, numpy.inf, or any other value.
     :type missing_value: ANY
+    :param preserve_dtype: if True, float32 columns are not upcast to 
+        float64 for computing medians and means
+    :type preserve_dtype: bool
+    :param int_rounding: how replacement values are made integers for
+        integer columns: 'truncate', 'round', 'floor', or 'ceil'
+    :type int_rounding: string
     :returns nxmDataFrame with zeros replaced. I.e. returns a *view*, 
-        not a copy.    
+        not a copy. Only numeric columns are considered. Replacement 
+        values written into integer columns are truncated, unless
+        int_rounding says otherwise.
     :rtype: pandas.DataFrame
     
     '''
+    # Rather than copying out and assigning back one
+    # column or row at a time, the numeric columns are 
+    # filled in the ndarrays in which pandas holds them,
+    # one per block of columns of equal dtype. Non-numeric
+    # columns are left alone:
+    
+    if int_rounding not in INT_ROUNDINGS:
+        raise ValueError('Integer rounding must be one of %s; was %s' % (INT_ROUNDINGS, int_rounding))
+    blocks = numeric_blocks(nxmDataFrame)
+    if len(blocks) == 0:
+        return(nxmDataFrame)
+        
     if direction == 'column':
-        vecSize = nxmDataFrame.shape[1]
+        # Columns are independent of each other, so
+        # each block can be filled by itself:
+        for (_col_positions, values) in blocks:
+            replaceMissingValsNparray(values, 
+                                      direction='column', 
+                                      replacement=replacement, 
+                                      missing_value=missing_value,
+                                      preserve_dtype=preserve_dtype,
+                                      int_rounding=int_rounding)
     else:
-        vecSize = nxmDataFrame.shape[0]    
+        # Row statistics need all numeric columns; they
+        # are gathered a bounded number of rows at a time.
+        # Each block is then filled with them, cast to 
+        # the block's dtype:
+        row_stats = frame_row_stats([values for (_col_positions, values) in blocks], 
+                                    replacement, missing_value, preserve_dtype)
+        for (_col_positions, values) in blocks:
+            fill_mask(values, match_mask(values, missing_value), 
+                      round_values(row_stats, values.dtype, int_rounding), 1)
+        
+    return(nxmDataFrame)
+
+#-------------------------
+# replaceMissingValsGroupedNparray()
+#----------------- 
 
-    # Get the column headers. They may be
-    # user-set, or automatically set to ints.
-    # We'll use them to grab columns:
+def replaceMissingValsGroupedNparray(nxmNparray,
+                                     groups,
+                                     replacement='median',
+                                     missing_value=np.nan):
+    '''
+    Given nxm nparray whose rows are respondents, and
+    one group label per row (e.g. cohort or country), 
+    replace missing values with the median/mean of the
+    cell's column, computed only over the rows of the 
+    cell's group, without the missing values. Replaces
+    in place, but also returns the nparray.
     
-    colNames = nxmDataFrame.columns
+    Ex: given groups ['a', 'a', 'b', 'b'], and
+        replacement='mean', the following input:
         
-    # For each column vector, replace
-    # all 0s with the median of that vector,
-    # calculated without those 0s:
-    
-    for indx in range(vecSize):
-        if direction == 'column':
-            # For data frames, ints or vecs of ints
-            # inside [] select columns:
-            vec = nxmDataFrame[colNames[indx]].copy()
-        else:
-            # For data frames, slices
-            # inside [] select rows. Must
-            # make a copy, else pandas gives
-            # warning when modified vector is
-            # later assigned as a row:
-            vec = nxmDataFrame.iloc[indx].copy()
-
-        # Compute the median, disregarding missing values:            
-        if replacement == 'median':
-            replacement_value = np.median(non_matches(vec, missing_value))
-        else:
-            replacement_value = np.mean(non_matches(vec, missing_value))
+        array([[ 1,  2],
+               [ 0,  4],
+               [10, 20],
+               [30,  0]])
+               
+        is turned into:
+        array([[ 1,  2],
+               [ 1,  4],
+               [10, 20],
+               [30, 20]])
+               
+    Statistics for all groups and columns are computed
+    together: rows are sorted by group once, and each 
+    column's values by group and value, so that group
+    segments can be reduced without a loop over groups.
+    Rows whose group label is None or NaN are left alone.
+    
+    :param nxmNparray: a two-dimensional numpy ndarray
+    :type nxmNparray: numpy.ndarray
+    :param groups: one group label per row
+    :type groups: {numpy.ndarray | pandas.Series | [ANY]}
+    :param replacement: 'median' or 'mean'
+    :type replacement: string
+    :param missing_value: the value that stands for 'value missing',
+        or a list, tuple, or set of such values
+    :type missing_value: ANY
+    :returns nxmNparray with missing values replaced
+    :rtype: numpy.ndarray
+    '''
+    (codes, num_groups) = group_codes(groups, nxmNparray.shape[0])
+    grouped_impute(nxmNparray, codes, num_groups, replacement, missing_value)
+    return(nxmNparray)
 
-        # Replace the missing value(s) (in the original data):
-        replace_matches(vec, missing_value, replacement_value)
+#-------------------------
+# replaceMissingValsGroupedDataFrame()
+#----------------- 
 
-        # Replace the row/column in the original(!)        
-        if direction == 'column':
-            nxmDataFrame[colNames[indx]] = vec
-        else:
-            nxmDataFrame.iloc[indx] = vec
-        
+def replaceMissingValsGroupedDataFrame(nxmDataFrame,
+                                       groups,
+                                       replacement='median',
+                                       missing_value=np.nan):
+    '''
+    Like replaceMissingValsGroupedNparray(), but for a 
+    pandas DataFrame. The groups may be given as the
+    name of one of the frame's columns, which is then
+    not imputed. Only numeric columns are considered.
+    Replaces in place, but also returns the data frame.
+    
+    :param nxmDataFrame: a two-dimensional pandas DataFrame 
+    :type nxmDataFrame: pandas.DataFrame
+    :param groups: name of the column holding the group labels,
+        or one group label per row
+    :type groups: {string | numpy.ndarray | pandas.Series | [ANY]}
+    :param replacement: 'median' or 'mean'
+    :type replacement: string
+    :param missing_value: the value that stands for 'value missing',
+        or a list, tuple, or set of such values
+    :type missing_value: ANY
+    :returns nxmDataFrame with missing values replaced
+    :rtype: pandas.DataFrame
+    '''
+    group_col_position = None
+    if not isinstance(groups, (list, np.ndarray, pd.Series)):
+        group_col_position = nxmDataFrame.columns.get_loc(groups)
+        groups = nxmDataFrame.iloc[:, group_col_position].values
+    (codes, num_groups) = group_codes(groups, nxmDataFrame.shape[0])
+    
+    # Filled in the frame's own ndarrays:
+    for (_col_positions, values) in numeric_blocks(nxmDataFrame, skip_position=group_col_position):
+        grouped_impute(values, codes, num_groups, replacement, missing_value)
     return(nxmDataFrame)
 
+#-------------------------
+# replaceMissingValsSparse()
+#----------------- 
+
+def replaceMissingValsSparse(nxmSparse,
+                             direction='column',
+                             replacement='median',
+                             missing_value=None,
+                             densify=True):
+    '''
+    Given nxm scipy.sparse matrix, replace missing values
+    with the median/mean of either the cell's column or 
+    row (direction), computed without the missing values.
+    
+    If missing_value is None, the entries that are not 
+    stored in the matrix are the missing values, as for 
+    an unfolded survey in which many questions were skipped.
+    Otherwise stored entries equal to missing_value are 
+    missing, while unstored entries count as zeros, unless
+    missing_value matches zero as well.
+    
+    Statistics are computed from the stored entries only,
+    plus a count of the unstored zeros where these are 
+    values; the matrix is never densified for them.
+    
+    With densify=True a dense ndarray of the matrix' dtype 
+    is returned, with the missing values replaced. Else a
+    SparseImputation is returned, which holds the present
+    values, the missing cells, and the per-vector statistics, 
+    and which can be densified later with toarray().
+    
+    :param nxmSparse: two-dimensional sparse matrix in any scipy.sparse format
+    :type nxmSparse: scipy.sparse.spmatrix
+    :param direction: 'column' or 'row'
+    :type direction: string
+    :param replacement: 'median' or 'mean'
+    :type replacement: string
+    :param missing_value: None for unstored entries being missing, 
+        or the stored value that stands for 'value missing', 
+        or a list, tuple, or set of such values
+    :type missing_value: ANY
+    :param densify: whether to return a dense result
+    :type densify: bool
+    :returns dense ndarray with missing values replaced, or 
+        a SparseImputation
+    :rtype: {numpy.ndarray | SparseImputation}
+    '''
+    if sp is None:
+        raise ValueError('Sparse matrices require scipy to be installed.')
+    if replacement not in ['median', 'mean']:
+        raise ValueError("Replacement must be 'median' or 'mean'; was %s" % replacement)
+    
+    # Compressed along the direction, each column (or row)
+    # is one contiguous segment of the stored data:
+    matrix = nxmSparse.tocsc() if direction == 'column' else nxmSparse.tocsr()
+    if not matrix.has_canonical_format:
+        # Duplicate entries of a cell would count twice:
+        matrix = matrix.copy()
+        matrix.sum_duplicates()
+    num_vectors = len(matrix.indptr) - 1
+    vector_len  = matrix.shape[0] if direction == 'column' else matrix.shape[1]
+    stored_counts = np.diff(matrix.indptr)
+    vector_ids = np.repeat(np.arange(num_vectors), stored_counts)
+    
+    if missing_value is None:
+        present = np.ones(matrix.nnz, dtype=bool)
+        implicit_missing = True
+    else:
+        present = np.logical_not(match_mask(matrix.data, missing_value))
+        implicit_missing = bool(match_mask(np.zeros(1), missing_value)[0])
+    # Unstored zeros that are values, not missing:
+    implicit_zeros = np.zeros(num_vectors, dtype=int) if implicit_missing else vector_len - stored_counts
+    
+    statistics = sparse_vector_stats(matrix.data[present], vector_ids[present], num_vectors, 
+                                     implicit_zeros, replacement)
+    
+    matrix_class = type(matrix)
+    values = matrix_class((matrix.data[present], matrix.indices[present], 
+                           segment_indptr(vector_ids[present], num_vectors)), 
+                          shape=matrix.shape)
+    missing = None
+    if not implicit_missing:
+        absent = np.logical_not(present)
+        missing = matrix_class((np.ones(np.count_nonzero(absent), dtype=bool), matrix.indices[absent], 
+                                segment_indptr(vector_ids[absent], num_vectors)),
+                               shape=matrix.shape)
+    imputation = SparseImputation(values, missing, statistics, direction)
+    if densify:
+        return imputation.toarray()
+    return imputation
+
+#-------------------------
+# SparseImputation
+#----------------- 
+
+class SparseImputation(namedtuple('SparseImputation', ['values', 'missing', 'statistics', 'direction'])):
+    '''
+    Compact result of replaceMissingValsSparse(): 
+    
+       values:     sparse matrix of the present values
+       missing:    sparse boolean matrix that is True at the
+                   missing cells, or None if all cells not
+                   stored in values are missing
+       statistics: median or mean of each column or row
+       direction:  'column' or 'row'
+    '''
+    __slots__ = ()
+    
+    def toarray(self):
+        '''
+        Return the dense ndarray with the missing values
+        replaced by their column's (or row's) statistic.
+        '''
+        axis = 0 if self.direction == 'column' else 1
+        if self.missing is None:
+            # Every cell starts out missing, and the 
+            # present values are written over them:
+            dense = np.empty(self.values.shape, dtype=self.values.dtype)
+            if axis == 0:
+                np.copyto(dense, self.statistics, casting='unsafe')
+            else:
+                np.copyto(dense, self.statistics[:, np.newaxis], casting='unsafe')
+            present = self.values.tocoo()
+            dense[present.row, present.col] = present.data
+        else:
+            dense = self.values.toarray()
+            missing = self.missing.tocoo()
+            dense[missing.row, missing.col] = self.statistics[missing.col if axis == 0 else missing.row]
+        return dense
+    
+    def missing_mask(self):
+        '''
+        Return a dense boolean ndarray that is True
+        at the missing cells.
+        '''
+        if self.missing is None:
+            mask = np.ones(self.values.shape, dtype=bool)
+            present = self.values.tocoo()
+            mask[present.row, present.col] = False
+            return mask
+        return self.missing.toarray().astype(bool)
+
 #-------------------------
 # get_closest
 #----------------- 
@@ -211,102 +610,2244 @@ def get_nearest(ssorted, num, pick='larger'):
     :return tuple of nearest number, and its index in the series.
     :rtype (float, int)
     '''
-    indx = ssorted.searchsorted(num)
-    # Exact hit?
-    if ssorted[indx].iloc[0] == num:
-        return (num, indx[0])
-    if indx == 0:
-        return (ssorted.iloc[0], indx[0])
-    elif indx == len(ssorted):
-        return (ssorted.iloc[-1], indx[0]-1)
+    (nearest_nums, indexes) = get_nearest_many(ssorted, [num], pick)
+    return (nearest_nums[0], indexes[0])
+
+#-------------------------
+# get_nearest_many
+#----------------- 
+
+def get_nearest_many(ssorted, nums, pick='larger'):
+    '''
+    Like get_nearest(), but for an array of numbers at once.
+    All numbers are located with a single searchsorted() call.
+    Returns an array of the nearest numbers in the series,
+    and an array of their indexes, both of the shape of nums.
+    
+    A number equal to a series member yields that member. 
+    Numbers below the series' first member yield the first
+    member, numbers above its last member the last member. 
+    Others yield the next larger member, or the next smaller 
+    one if pick is 'smaller'.
+    
+    :param ssorted: sorted Pandas Series instance of numbers, or
+        sorted one-dimensional numpy array
+    :type ssorted: {pandas.Series | numpy.ndarray}
+    :param nums: numbers for which the nearest series members are to be found
+    :type nums: {numpy.ndarray | pandas.Series | [float]}
+    :param pick: either 'smaller' or 'larger'. Default is 'larger'
+    :type pick: str
+    :return tuple of array of nearest numbers, and array of their indexes.
+    :rtype (numpy.ndarray, numpy.ndarray)
+    '''
+    sorted_nums = np.asarray(ssorted)
+    if len(sorted_nums) == 0:
+        raise ValueError('Cannot find nearest numbers in an empty series.')
+    nums = np.asarray(nums)
+    
+    indexes = np.searchsorted(sorted_nums, nums)
+    # Numbers beyond the last member are nearest to it:
+    larger_indexes = np.minimum(indexes, len(sorted_nums) - 1)
+    if pick == 'larger':
+        nearest_indexes = larger_indexes
     else:
-        indx = indx if pick == 'larger' else indx-1
-        return (ssorted[indx].iloc[0], indx[0])
+        exact_hits = sorted_nums[larger_indexes] == nums
+        nearest_indexes = np.where(exact_hits, indexes, np.maximum(indexes - 1, 0))
+    return (sorted_nums[nearest_indexes], nearest_indexes)
+
+#-------------------------
+# NearestIndex
+#----------------- 
+
+class NearestIndex(object):
+    '''
+    Answers repeated nearest-value queries over one 
+    set of numbers. The numbers need not be sorted: 
+    they are sorted once into a contiguous array, and
+    a position map leads from each sorted number back
+    to its position in the original data. NaN values
+    are left out.
+    
+        index = NearestIndex(reference_scores)
+        index.nearest(11)              # (value, position)
+        index.nearest_many(scores)     # (values, positions)
+        index.k_nearest(11, 3)
+        index.within(11, 0.5)
+        
+    nearest() and nearest_many() follow get_nearest(): 
+    numbers equal to a member yield that member, numbers
+    beyond either end the member at that end, and others
+    the next larger member, or the next smaller one if 
+    pick is 'smaller'. Positions index the original data,
+    not the sorted numbers.
+    
+    Scalar nearest() queries bisect a Python list copy 
+    of the sorted numbers, which costs less per query 
+    than numpy.searchsorted(). Their results are kept 
+    in a small LRU cache.
+    '''
+    
+    # Number of scalar query results kept:
+    DEFAULT_CACHE_SIZE = 1024
+    
+    #-------------------------
+    # __init__
+    #----------------- 
+
+    def __init__(self, data, cache_size=DEFAULT_CACHE_SIZE):
+        '''
+        :param data: numbers in any order
+        :type data: {numpy.ndarray | pandas.Series | [float]}
+        :param cache_size: number of scalar query results kept;
+            0 turns off the cache
+        :type cache_size: int
+        '''
+        values = np.asarray(data, dtype=float).ravel()
+        original_positions = np.flatnonzero(np.logical_not(np.isnan(values)))
+        if len(original_positions) == 0:
+            raise ValueError('Cannot build a NearestIndex without numbers.')
+        order = np.argsort(values[original_positions], kind='mergesort')
+        self.sorted_values = np.ascontiguousarray(values[original_positions[order]])
+        self.positions = original_positions[order]
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.sorted_list = self.sorted_values.tolist()
+        self.position_list = self.positions.tolist()
+        
+    #-------------------------
+    # nearest
+    #----------------- 
+
+    def nearest(self, num, pick='larger'):
+        '''
+        Return the member nearest to num, and its 
+        position in the original data.
+        
+        :param num: number whose nearest member is to be found
+        :type num: {float | int}
+        :param pick: either 'smaller' or 'larger'. Default is 'larger'
+        :type pick: str
+        :return tuple of nearest number, and its original position
+        :rtype (float, int)
+        '''
+        key = (num, pick)
+        try:
+            result = self.cache.pop(key)
+            self.cache_hits += 1
+        except KeyError:
+            indx = bisect.bisect_left(self.sorted_list, num)
+            last = len(self.sorted_list) - 1
+            if pick == 'larger':
+                indx = min(indx, last)
+            elif indx > last or self.sorted_list[indx] != num:
+                indx = max(indx - 1, 0)
+            result = (self.sorted_list[indx], self.position_list[indx])
+        if self.cache_size > 0:
+            # Most recently used entries are last:
+            self.cache[key] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+    
+    #-------------------------
+    # nearest_many
+    #----------------- 
+
+    def nearest_many(self, nums, pick='larger'):
+        '''
+        Like nearest(), but for an array of numbers, as
+        get_nearest_many() does. Returns an array of nearest
+        members, and an array of their original positions.
+        '''
+        (nearest_nums, indexes) = get_nearest_many(self.sorted_values, nums, pick)
+        return (nearest_nums, self.positions[indexes])
+    
+    #-------------------------
+    # k_nearest
+    #----------------- 
+
+    def k_nearest(self, nums, k):
+        '''
+        Return the k members closest to each of the
+        given numbers, ordered by their distance to the 
+        number; of equally distant members the smaller 
+        comes first. Also returns the members' original 
+        positions. For a single number, both arrays have 
+        k elements; for an array of numbers, they have 
+        the numbers' shape plus a last dimension of k. 
+        If there are fewer than k members, all are returned.
+        
+        :param nums: number or array of numbers
+        :type nums: {float | numpy.ndarray | [float]}
+        :param k: number of members to return per number
+        :type k: int
+        :return tuple of array of members, and array of their positions
+        :rtype (numpy.ndarray, numpy.ndarray)
+        '''
+        if k < 1:
+            raise ValueError('Number of nearest members must be at least 1; was %s' % k)
+        num_members = len(self.sorted_values)
+        k = min(k, num_members)
+        nums = np.asarray(nums, dtype=float)
+        # The k nearest members form a run of sorted members 
+        # that lies within a window of 2k members around the 
+        # number's insertion point:
+        window_len = min(2 * k, num_members)
+        starts = np.clip(np.searchsorted(self.sorted_values, nums) - k, 0, num_members - window_len)
+        windows = starts[..., np.newaxis] + np.arange(window_len)
+        distances = np.abs(self.sorted_values[windows] - nums[..., np.newaxis])
+        by_distance = np.argsort(distances, axis=-1, kind='mergesort')[..., :k]
+        indexes = np.take_along_axis(windows, by_distance, axis=-1)
+        return (self.sorted_values[indexes], self.positions[indexes])
+    
+    #-------------------------
+    # within
+    #----------------- 
+
+    def within(self, nums, tolerance):
+        '''
+        Return the members that differ from a number by
+        at most tolerance, in ascending order, together 
+        with their original positions. For an array of 
+        numbers, return a list with one such tuple per
+        number; all are located with two searchsorted() 
+        calls.
+        
+        :param nums: number or array of numbers
+        :type nums: {float | numpy.ndarray | [float]}
+        :param tolerance: largest allowed distance
+        :type tolerance: float
+        :return tuple of array of members, and array of their positions,
+            or list of such tuples
+        :rtype {(numpy.ndarray, numpy.ndarray) | [(numpy.ndarray, numpy.ndarray)]}
+        '''
+        nums = np.asarray(nums, dtype=float)
+        starts = np.searchsorted(self.sorted_values, nums - tolerance, side='left')
+        ends   = np.searchsorted(self.sorted_values, nums + tolerance, side='right')
+        if nums.ndim == 0:
+            return (self.sorted_values[starts:ends], self.positions[starts:ends])
+        return [(self.sorted_values[start:end], self.positions[start:end])
+                for (start, end) in zip(starts.ravel(), ends.ravel())]
+    
+    #-------------------------
+    # __len__
+    #----------------- 
+
+    def __len__(self):
+        return len(self.sorted_values)
+
+#-------------------------
+# QuantileSketch
+#----------------- 
+
+class QuantileSketch(object):
+    '''
+    Mergeable summary of a stream of numbers from which
+    quantiles, such as the median, can be estimated.
+    Follows the KLL sketch (Karnin, Lang, Liberty, 2016):
+    values are kept in a hierarchy of compactors. When 
+    a compactor overflows, it is sorted, and every other 
+    value, starting at a random offset, moves up to the 
+    next compactor, where each value stands for twice 
+    as many original values. Lower compactors hold fewer
+    values than higher ones.
+    
+    The rank of an estimated quantile is within about 
+    error * n of the true quantile's rank, with high
+    probability. Memory is O(1/error) values, independent
+    of n. Until the first compaction the sketch is exact.
+    
+    Sketches can be updated in chunks, and sketches built
+    by different workers over different parts of the data
+    can be merged:
+    
+        sketch1 = QuantileSketch().update(chunk1)
+        sketch2 = QuantileSketch().update(chunk2)
+        sketch1.merge(sketch2).median()
+    '''
+    
+    # Rank error of a KLL sketch with top capacity k
+    # is about ERROR_CONSTANT / k:
+    ERROR_CONSTANT = 1.7
+    
+    # Ratio of the capacities of adjacent compactors:
+    CAPACITY_DECAY = 2. / 3.
+    
+    #-------------------------
+    # __init__
+    #----------------- 
+
+    def __init__(self, error=DEFAULT_SKETCH_ERROR, seed=None):
+        '''
+        :param error: bound on the rank error of quantile
+            estimates, as a fraction of the number of values
+        :type error: float
+        :param seed: seed for the choice of values that are
+            kept during compaction. Equal seeds and inputs 
+            yield equal estimates.
+        :type seed: {None | int}
+        '''
+        if not 0 < error < 1:
+            raise ValueError('Sketch error must be between 0 and 1, was %s' % error)
+        self.error = error
+        self.k = max(8, int(np.ceil(QuantileSketch.ERROR_CONSTANT / error)))
+        self.compactors = [np.empty(0)]
+        self.count = 0
+        self.random = np.random.RandomState(seed)
+        
+    #-------------------------
+    # update
+    #----------------- 
+
+    def update(self, values):
+        '''
+        Add values to the sketch. Returns the sketch.
+        
+        :param values: numbers to add
+        :type values: {numpy.ndarray | [float]}
+        '''
+        values = np.asarray(values, dtype=float).ravel()
+        if len(values) == 0:
+            return self
+        self.compactors[0] = np.concatenate((self.compactors[0], values))
+        self.count += len(values)
+        self.compress()
+        return self
+    
+    #-------------------------
+    # merge
+    #----------------- 
+
+    def merge(self, other):
+        '''
+        Add the values summarized by another sketch
+        to this sketch. Returns this sketch.
+        
+        :param other: sketch to merge into this one
+        :type other: QuantileSketch
+        '''
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append(np.empty(0))
+        for (level, items) in enumerate(other.compactors):
+            self.compactors[level] = np.concatenate((self.compactors[level], items))
+        self.count += other.count
+        self.compress()
+        return self
+    
+    #-------------------------
+    # quantile
+    #----------------- 
+
+    def quantile(self, q):
+        '''
+        Return an estimate of the q-quantile, i.e. the
+        smallest summarized value with at least q * n 
+        values less or equal to it. Returns numpy.nan 
+        if the sketch is empty.
+        
+        :param q: quantile between 0 and 1; 0.5 is the median
+        :type q: float
+        '''
+        if self.count == 0:
+            return np.nan
+        items = np.concatenate(self.compactors)
+        weights = np.concatenate([np.full(len(level_items), 2**level) 
+                                  for (level, level_items) in enumerate(self.compactors)])
+        order = np.argsort(items, kind='mergesort')
+        cum_weights = np.cumsum(weights[order])
+        indx = np.searchsorted(cum_weights, q * cum_weights[-1])
+        return items[order[min(indx, len(items) - 1)]]
+    
+    #-------------------------
+    # median
+    #----------------- 
+
+    def median(self):
+        '''
+        Return an estimate of the median. While no values
+        have been compacted yet, the exact median.
+        '''
+        if len(self.compactors) == 1:
+            return np.median(self.compactors[0]) if self.count > 0 else np.nan
+        return self.quantile(0.5)
+    
+    #-------------------------
+    # __len__
+    #----------------- 
+
+    def __len__(self):
+        # Number of values summarized:
+        return self.count
+    
+    #-------------------------
+    # to_dict
+    #----------------- 
+
+    def to_dict(self):
+        '''
+        Return the sketch's state, including its random
+        generator, as a JSON-compatible dict.
+        '''
+        (algorithm, keys, pos, has_gauss, cached_gaussian) = self.random.get_state()
+        return {'error'        : self.error,
+                'count'        : self.count,
+                'compactors'   : [items.tolist() for items in self.compactors],
+                'random_state' : [algorithm, keys.tolist(), pos, has_gauss, cached_gaussian]
+                }
+    
+    #-------------------------
+    # from_dict
+    #----------------- 
+
+    @classmethod
+    def from_dict(cls, sketch_dict):
+        '''
+        Create a sketch from the dict made by to_dict().
+        '''
+        sketch = cls(error=sketch_dict['error'])
+        sketch.count = sketch_dict['count']
+        sketch.compactors = [np.array(items, dtype=float) for items in sketch_dict['compactors']]
+        (algorithm, keys, pos, has_gauss, cached_gaussian) = sketch_dict['random_state']
+        sketch.random.set_state((str(algorithm), np.array(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian))
+        return sketch
+    
+    # ---------------------------------- Private Methods ---------------------
+    
+    #-------------------------
+    # capacity
+    #----------------- 
+
+    def capacity(self, level):
+        # The top compactor holds k values, each
+        # one below holds CAPACITY_DECAY times as many:
+        height = len(self.compactors)
+        return max(2, int(np.ceil(self.k * QuantileSketch.CAPACITY_DECAY ** (height - level - 1))))
+    
+    #-------------------------
+    # compress
+    #----------------- 
+
+    def compress(self):
+        # Compact overflowing compactors from the 
+        # bottom up:
+        level = 0
+        while level < len(self.compactors):
+            items = self.compactors[level]
+            if len(items) > self.capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append(np.empty(0))
+                items = np.sort(items)
+                # Of an odd number of values, one stays:
+                if len(items) % 2 == 1:
+                    self.compactors[level] = items[-1:]
+                    items = items[:-1]
+                else:
+                    self.compactors[level] = np.empty(0)
+                promoted = items[self.random.randint(2)::2]
+                self.compactors[level + 1] = np.concatenate((self.compactors[level + 1], promoted))
+            level += 1
+
+#-------------------------
+# build_sketches
+#----------------- 
+
+def build_sketches(nxmNparray, 
+                   direction='column', 
+                   missing_value=np.nan, 
+                   error=DEFAULT_SKETCH_ERROR, 
+                   block_size=DEFAULT_BLOCK_SIZE,
+                   seed_offset=0,
+                   mask=None):
+    '''
+    Return one QuantileSketch for each column or row 
+    (direction) of a 2D array, built from the vector's 
+    values other than missing_value. The array is read
+    in chunks of at most block_size cells, each chunk 
+    holding part of every vector. Works with 
+    numpy.memmap arrays. 
+    
+    Sketches built over different row ranges (for 
+    direction='column') can be merged vector by vector:
+    
+        sketches = build_sketches(arr[:1000])
+        for (sketch, other) in zip(sketches, build_sketches(arr[1000:])):
+            sketch.merge(other)
+    
+    :param nxmNparray: a two-dimensional numpy ndarray or numpy.memmap
+    :type nxmNparray: {numpy.ndarray | numpy.memmap}
+    :param direction: 'column' or 'row'
+    :type direction: string
+    :param missing_value: the value that stands for 'value missing'
+    :type missing_value: ANY
+    :param error: rank error bound of the sketches
+    :type error: float
+    :param block_size: largest number of cells read at a time
+    :type block_size: int
+    :param seed_offset: added to each vector's index to seed its
+        sketch. When sketching a slice of vectors, passing the 
+        slice's start yields the sketches of the whole array.
+    :type seed_offset: int
+    :param mask: if given, True where values are missing; 
+        missing_value is then ignored
+    :type mask: {None | numpy.ndarray}
+    :return: one sketch per vector
+    :rtype: [QuantileSketch]
+    '''
+    axis = 0 if direction == 'column' else 1
+    num_vectors = nxmNparray.shape[1 - axis]
+    # Seeding by vector index makes results repeatable:
+    sketches = [QuantileSketch(error=error, seed=seed_offset + indx) for indx in range(num_vectors)]
+    # Chunks are blocks of whole rows for column sketches,
+    # and of whole columns for row sketches:
+    for (start, end) in vector_blocks(nxmNparray, 1 - axis, block_size):
+        chunk = vector_block(nxmNparray, 1 - axis, start, end)
+        present = np.logical_not(block_match_mask(chunk, missing_value, mask, 1 - axis, start, end))
+        for indx in range(num_vectors):
+            if axis == 0:
+                sketches[indx].update(chunk[:, indx][present[:, indx]])
+            else:
+                sketches[indx].update(chunk[indx, :][present[indx, :]])
+    return sketches
+
+#-------------------------
+# MissingValsImputer
+#----------------- 
+
+class MissingValsImputer(object):
+    '''
+    Replaces missing values in batches of data with
+    the per-column median/mean of earlier data. Where
+    replaceMissingValsNparray() and replaceMissingValsDataFrame()
+    compute the statistics anew with each call, an imputer
+    computes them once with fit(), and then fills any 
+    number of batches with transform():
+    
+        imputer = MissingValsImputer(replacement='median', missing_value=0)
+        imputer.fit(reference_arr)
+        imputer.transform(todays_arr)
+        
+    Statistics can also be accumulated batch by batch 
+    with partial_fit(). Means are then exact. Medians 
+    are estimated with one QuantileSketch per column, 
+    as for replacement='approx_median'.
+    
+    Fitted statistics are saved with save(), and
+    restored with MissingValsImputer.load(). The 
+    state of partial_fit() is saved as well, so that
+    a restored imputer takes further batches.
+    
+    Batches may be numpy ndarrays, numpy.memmap arrays, 
+    or pandas DataFrames. DataFrame columns are matched 
+    by name, and only numeric columns are considered.
+    '''
+    
+    #-------------------------
+    # __init__
+    #----------------- 
+
+    def __init__(self, 
+                 replacement='median', 
+                 missing_value=np.nan, 
+                 sketch_error=DEFAULT_SKETCH_ERROR,
+                 block_size=None,
+                 preserve_dtype=False,
+                 int_rounding='truncate'):
+        '''
+        As with replaceMissingValsNparray(), statistics are 
+        computed in float64 unless preserve_dtype is True,
+        and values written into integer columns are rounded
+        as int_rounding says. Sums of partial_fit() are
+        always float64.
+        
+        :param replacement: 'median', 'approx_median', or 'mean'
+        :type replacement: string
+        :param missing_value: the value that stands for 'value missing'
+        :type missing_value: ANY
+        :param sketch_error: rank error bound of median estimates
+        :type sketch_error: float
+        :param block_size: largest number of cells processed at a time.
+            If None, ndarrays are processed all at once, and memory-mapped
+            arrays in blocks of DEFAULT_BLOCK_SIZE cells.
+        :type block_size: {None | int}
+        :param preserve_dtype: if True, float arrays are not upcast to 
+            float64 for computing medians and means by fit()
+        :type preserve_dtype: bool
+        :param int_rounding: how replacement values are made integers for
+            integer columns: 'truncate', 'round', 'floor', or 'ceil'
+        :type int_rounding: string
+        '''
+        if replacement not in ['median', 'approx_median', 'mean']:
+            raise ValueError("Replacement must be 'median', 'approx_median', or 'mean'; was %s" % replacement)
+        if int_rounding not in INT_ROUNDINGS:
+            raise ValueError('Integer rounding must be one of %s; was %s' % (INT_ROUNDINGS, int_rounding))
+        self.replacement = replacement
+        self.missing_value = missing_value
+        self.sketch_error = sketch_error
+        self.block_size = block_size
+        self.preserve_dtype = preserve_dtype
+        self.int_rounding = int_rounding
+        self.reset()
+        
+    #-------------------------
+    # reset
+    #----------------- 
+
+    def reset(self):
+        '''
+        Forget all fitted statistics.
+        '''
+        # Per-column replacement values:
+        self.statistics = None
+        # Names of DataFrame columns the statistics 
+        # belong to, or None for arrays:
+        self.columns = None
+        # State of partial_fit():
+        self.sums = None
+        self.counts = None
+        self.sketches = None
+        
+    #-------------------------
+    # fit
+    #----------------- 
+
+    def fit(self, data):
+        '''
+        Compute and remember the median/mean of each 
+        column of data, disregarding missing values.
+        Returns the imputer.
+        
+        :param data: two-dimensional data
+        :type data: {numpy.ndarray | numpy.memmap | pandas.DataFrame}
+        '''
+        self.reset()
+        (arr, self.columns) = self.as_array(data)
+        block_size = self.array_block_size(arr)
+        if self.replacement == 'approx_median':
+            sketches = build_sketches(arr, 'column', self.missing_value, 
+                                      self.sketch_error, block_size or DEFAULT_BLOCK_SIZE)
+            self.statistics = np.array([sketch.median() for sketch in sketches])
+        elif block_size is None:
+            self.statistics = vector_stats(arr, match_mask(arr, self.missing_value), 0, self.replacement,
+                                           work_dtype_for(arr, self.preserve_dtype))
+        else:
+            self.statistics = blockwise_stats(arr, self.missing_value, 0, self.replacement, block_size,
+                                              work_dtype=work_dtype_for(arr, self.preserve_dtype))
+        return self
+    
+    #-------------------------
+    # partial_fit
+    #----------------- 
+
+    def partial_fit(self, data):
+        '''
+        Update the remembered statistics with one more 
+        batch of data. The first call after construction,
+        fit(), or reset() starts new statistics. Returns 
+        the imputer.
+        
+        :param data: two-dimensional data
+        :type data: {numpy.ndarray | numpy.memmap | pandas.DataFrame}
+        '''
+        if self.statistics is not None and self.sums is None and self.sketches is None:
+            # Statistics came from fit() or load(), and
+            # cannot be extended:
+            self.reset()
+        (arr, columns) = self.as_array(data, self.columns)
+        if self.statistics is None:
+            self.columns = columns
+        elif arr.shape[1] != len(self.statistics):
+            raise ValueError('Batch has %s columns, but earlier batches had %s' % (arr.shape[1], len(self.statistics)))
+        block_size = self.array_block_size(arr) or DEFAULT_BLOCK_SIZE
+        
+        if self.replacement == 'mean':
+            if self.sums is None:
+                self.sums = np.zeros(arr.shape[1])
+                self.counts = np.zeros(arr.shape[1], dtype=int)
+            # Rows are read in blocks, and each block's 
+            # sums and counts are added up:
+            for (start, end) in vector_blocks(arr, 1, block_size):
+                block = vector_block(arr, 1, start, end)
+                mask = match_mask(block, self.missing_value)
+                self.sums += np.where(mask, 0, block).sum(axis=0)
+                self.counts += np.logical_not(mask).sum(axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self.statistics = self.sums / self.counts
+        else:
+            sketches = build_sketches(arr, 'column', self.missing_value, self.sketch_error, block_size)
+            if self.sketches is None:
+                self.sketches = sketches
+            else:
+                for (sketch, batch_sketch) in zip(self.sketches, sketches):
+                    sketch.merge(batch_sketch)
+            self.statistics = np.array([sketch.median() for sketch in self.sketches])
+        return self
+    
+    #-------------------------
+    # transform
+    #----------------- 
+
+    def transform(self, data):
+        '''
+        Replace missing values in data with the fitted 
+        statistics of their columns. Replaces in place,
+        but also returns data.
+        
+        :param data: two-dimensional data, or path to an .npy file
+        :type data: {numpy.ndarray | numpy.memmap | pandas.DataFrame | string}
+        '''
+        if self.statistics is None:
+            raise ValueError('Imputer must be fitted before transform().')
+        if isinstance(data, pd.DataFrame):
+            if self.columns is None:
+                raise ValueError('Imputer was fitted on an array; cannot transform a DataFrame.')
+            stats_by_col = dict(zip(self.columns, self.statistics))
+            # Filled in the frame's own ndarrays:
+            for (col_positions, values) in numeric_blocks(data):
+                try:
+                    col_stats = np.array([stats_by_col[data.columns[position]] for position in col_positions])
+                except KeyError as e:
+                    raise ValueError('Column %s was not fitted.' % e.args[0])
+                fill_mask(values, match_mask(values, self.missing_value), 
+                          round_values(col_stats, values.dtype, self.int_rounding), 0)
+            return data
+        
+        if isinstance(data, STRING_TYPES):
+            data = np.load(data, mmap_mode='r+')
+        if data.shape[1] != len(self.statistics):
+            raise ValueError('Data has %s columns, but imputer was fitted on %s' % (data.shape[1], len(self.statistics)))
+        block_size = self.array_block_size(data)
+        statistics = round_values(self.statistics, data.dtype, self.int_rounding)
+        if block_size is None:
+            fill_mask(data, match_mask(data, self.missing_value), statistics, 0)
+        else:
+            blockwise_fill(data, self.missing_value, statistics, 0, block_size)
+            if isinstance(data, np.memmap):
+                data.flush()
+        return data
+    
+    #-------------------------
+    # fit_transform
+    #----------------- 
+
+    def fit_transform(self, data):
+        return self.fit(data).transform(data)
+    
+    #-------------------------
+    # to_dict
+    #----------------- 
+
+    def to_dict(self):
+        '''
+        Return the imputer's settings, fitted statistics,
+        and partial_fit() state as a JSON-compatible dict.
+        Numpy scalars become Python numbers, and tuples
+        (such as MultiIndex column names) become lists.
+        '''
+        return {'replacement'   : self.replacement,
+                'missing_value' : json_compatible(self.missing_value),
+                'sketch_error'  : json_compatible(self.sketch_error),
+                'block_size'    : json_compatible(self.block_size),
+                'preserve_dtype': self.preserve_dtype,
+                'int_rounding'  : self.int_rounding,
+                'columns'       : None if self.columns is None else json_compatible(self.columns),
+                'statistics'    : None if self.statistics is None else self.statistics.tolist(),
+                'sums'          : None if self.sums is None else self.sums.tolist(),
+                'counts'        : None if self.counts is None else self.counts.tolist(),
+                'sketches'      : None if self.sketches is None else [sketch.to_dict() for sketch in self.sketches]
+                }
+    
+    #-------------------------
+    # from_dict
+    #----------------- 
+
+    @classmethod
+    def from_dict(cls, imputer_dict):
+        '''
+        Create an imputer from the dict made by to_dict().
+        '''
+        imputer = cls(replacement=imputer_dict['replacement'],
+                      missing_value=imputer_dict['missing_value'],
+                      sketch_error=imputer_dict['sketch_error'],
+                      block_size=imputer_dict['block_size'],
+                      # Absent from dicts saved by earlier versions:
+                      preserve_dtype=imputer_dict.get('preserve_dtype', False),
+                      int_rounding=imputer_dict.get('int_rounding', 'truncate'))
+        if imputer_dict['columns'] is not None:
+            # Column names cannot be lists, so lists
+            # were tuples:
+            imputer.columns = [tuple(col) if isinstance(col, list) else col 
+                               for col in imputer_dict['columns']]
+        if imputer_dict['statistics'] is not None:
+            imputer.statistics = np.array(imputer_dict['statistics'], dtype=float)
+        # Dicts saved before partial_fit() state was
+        # included lack these:
+        if imputer_dict.get('sums') is not None:
+            imputer.sums = np.array(imputer_dict['sums'], dtype=float)
+            imputer.counts = np.array(imputer_dict['counts'], dtype=int)
+        if imputer_dict.get('sketches') is not None:
+            imputer.sketches = [QuantileSketch.from_dict(sketch_dict) for sketch_dict in imputer_dict['sketches']]
+        return imputer
+    
+    #-------------------------
+    # save
+    #----------------- 
+
+    def save(self, path):
+        '''
+        Write settings and fitted statistics to a JSON file.
+        '''
+        with open(path, 'w') as fd:
+            json.dump(self.to_dict(), fd)
+            
+    #-------------------------
+    # load
+    #----------------- 
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Create an imputer from a JSON file written by save().
+        '''
+        with open(path, 'r') as fd:
+            return cls.from_dict(json.load(fd))
+
+    # ---------------------------------- Private Methods ---------------------
+    
+    #-------------------------
+    # as_array
+    #----------------- 
+
+    def as_array(self, data, columns=None):
+        # Return a 2D array and column names for data. For
+        # DataFrames, the array holds the numeric columns, 
+        # or the given columns in the given order:
+        if isinstance(data, pd.DataFrame):
+            if columns is None:
+                positions = sorted(position for col_positions in numeric_col_groups(data).values() 
+                                            for position in col_positions)
+                columns = [data.columns[position] for position in positions]
+            return (data[columns].values, columns)
+        if isinstance(data, STRING_TYPES):
+            data = np.load(data, mmap_mode='r')
+        return (data, None)
+    
+    #-------------------------
+    # array_block_size
+    #----------------- 
 
+    def array_block_size(self, arr):
+        if self.block_size is None and isinstance(arr, np.memmap):
+            return DEFAULT_BLOCK_SIZE
+        return self.block_size
 
 # ----------------------------- Private Utility Functions -------------
         
 #-------------------------
-# non_matches
+# json_compatible
+#----------------
+
+def json_compatible(value):
+    '''
+    Return value with numpy scalars turned into 
+    Python numbers, and tuples and sets into lists, 
+    recursively, so that json can write it.
+    '''
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [json_compatible(element) for element in value]
+    return value
+
+#-------------------------
+# match_mask
 #----------------
 
-def non_matches(arr, val):
+def match_mask(arr, val, out=None):
     '''
     Given a ndarray and an arbitrary 
     value, including np.nan, np.inf, etc.,
-    return an ndarray that contains 
-    only elements that are *not* equal 
-    to val.  
+    return a boolean ndarray of the same shape
+    that is True where arr's elements equal val.
+    If val is a list, tuple, or set of values,
+    the mask is True where arr's elements equal
+    any of them.
     
     :param arr: n-dimensional numpy array
     :type arr: numpy.ndarray
-    :param val: value, including special values numpy.nan, numpy.inf, numpy.neginf, etc.
+    :param val: value, including special values numpy.nan, numpy.inf, numpy.neginf, etc.,
+        or collection of such values
     :type val: ANY.
+    :param out: if given, boolean array of arr's shape into
+        which the mask is written, and which is returned
+    :type out: {None | numpy.ndarray}
     '''
     
+    # Several values?
+    if isinstance(val, (list, tuple, set, frozenset, np.ndarray)):
+        if out is None:
+            out = np.zeros(arr.shape, dtype=bool)
+        else:
+            out[...] = False
+        for one_val in val:
+            out |= match_mask(arr, one_val)
+        return out
+    
+    if arr.dtype.kind == 'O':
+        # Object arrays, such as those of DataFrames with
+        # mixed column types, may hold numbers and strings
+        # alike; NaN and None are found with pandas.isnull():
+        if val is None or (isinstance(val, numbers.Real) and val != val):
+            matches = pd.isnull(arr)
+        else:
+            matches = np.asarray(arr == val, dtype=bool).reshape(arr.shape)
+        if out is None:
+            return matches
+        out[...] = matches
+        return out
+    
+    try:
+        is_finite = np.isfinite(val)
+    except TypeError:
+        # Non-numeric value, such as 'refused', 
+        # which numeric arrays cannot contain:
+        if out is None:
+            out = np.zeros(arr.shape, dtype=bool)
+        if arr.dtype.kind in 'SU':
+            out[...] = arr == val
+        else:
+            out[...] = False
+        return out
+    
     # Special value?
-    if np.isfinite(val):
+    if is_finite:
         # No, just normal value:
-        return arr[arr != val]
-    # Is special value, such as numpy.nan.
-    # Create ndarray with True/False entries
-    # that reflect which entries are not equal
-    # to val:
+        return np.equal(arr, val, out=out)
+    # Is special value, such as numpy.nan:
     elif np.isnan(val):
-        cond = np.logical_not(np.isnan(arr))
+        return np.isnan(arr, out=out)
     elif np.isinf(val):
-        cond = np.logical_not(np.isinf(arr))
+        return np.isinf(arr, out=out)
     elif np.isneginf(val):
-        cond = np.logical_not(np.isneginf(arr))
+        return np.isneginf(arr, out=out)
     elif np.isposinf(val):
-        cond = np.logical_not(np.isposinf(arr))
-        
+        return np.isposinf(arr, out=out)
+
+#-------------------------
+# non_matches
+#----------------
+
+def non_matches(arr, val, mask=None):
+    '''
+    Given a ndarray and an arbitrary 
+    value, including np.nan, np.inf, etc.,
+    return an ndarray that contains 
+    only elements that are *not* equal 
+    to val.  
+    
+    :param arr: n-dimensional numpy array
+    :type arr: numpy.ndarray
+    :param val: value, including special values numpy.nan, numpy.inf, numpy.neginf, etc.,
+        or collection of such values
+    :type val: ANY.
+    :param mask: if given, the result of match_mask(arr, val),
+        which is then not recomputed
+    :type mask: {None | numpy.ndarray}
+    '''
+    if mask is None:
+        mask = match_mask(arr, val)
     # Use the True/False ndarray as a mask
     # over arr:
-    return arr[cond]
+    return arr[np.logical_not(mask)]
         
 #-------------------------
 # replace_matches
 #----------------
     
-def replace_matches(arr, old_val, new_val):
+def replace_matches(arr, old_val, new_val, mask=None):
     
-    # Special value?
-    if np.isfinite(old_val):
-        # No, just normal value:
-        arr[arr == old_val] = new_val
-        return arr
-    # Is special value, such as numpy.nan.
-    # Create ndarray with True/False entries
-    # that reflect which entries are not equal
-    # to val:
-    elif np.isnan(old_val):
-        arr[np.isnan(arr)] = new_val
-        return arr
-    elif np.isinf(old_val):
-        arr[np.isinf(arr)] = new_val
-        return arr
-    elif np.isneginf(old_val):
-        arr[np.isneginf(arr)] = new_val
-        return arr
-    elif np.isposinf(old_val):
-        arr[np.isposinf(arr)] = new_val
-        return arr
-
-
+    # A mask from match_mask(arr, old_val) may
+    # be passed in to save recomputing it:
+    if mask is None:
+        mask = match_mask(arr, old_val)
+    arr[mask] = new_val
+    return arr
 
 #-------------------------
-# perc_eq_val 
-#----------------- 
+# vector_stats
+#----------------
 
-def perc_eq_val(series, val):
+def vector_stats(arr, mask, axis, replacement, work_dtype=np.float64, scratch=None):
     '''
-    Return percentage of <val> in <series>
+    Return the median or mean of each column (axis=0)
+    or row (axis=1) of 2D arr, computed without the 
+    cells where mask is True. Vectors with only missing
+    values yield numpy.nan.
     
-    :param series: series to examine
+    :param arr: two-dimensional numpy array
+    :type arr: numpy.ndarray
+    :param mask: True where arr's values are missing
+    :type mask: numpy.ndarray
+    :param axis: 0 for per-column, 1 for per-row statistics
+    :type axis: int
+    :param replacement: 'median' or 'mean'
+    :type replacement: string
+    :param work_dtype: float dtype of the working copy and result
+    :type work_dtype: numpy.dtype
+    :param scratch: if given, one-dimensional array of work_dtype 
+        with at least arr.size elements, used as working copy
+    :type scratch: {None | numpy.ndarray}
+    :rtype: numpy.ndarray
+    '''
+    if scratch is not None:
+        if arr.dtype.kind == 'O':
+            # Missing values may be strings, such as 'refused':
+            arr = np.where(mask, np.nan, arr)
+        return scratch_vector_stats(arr, mask, axis, replacement, scratch)
+    if arr.dtype.kind == 'f' and np.array_equal(mask, np.isnan(arr)):
+        # Missing values are already NaN, which the
+        # nan-functions below disregard:
+        work_arr = arr
+    else:
+        work_arr = masked_float_copy(arr, mask, work_dtype)
+    with warnings.catch_warnings():
+        # All-missing vectors warn, and yield NaN,
+        # as np.median() of an empty array would:
+        warnings.simplefilter('ignore', RuntimeWarning)
+        if replacement == 'median':
+            return np.nanmedian(work_arr, axis=axis)
+        else:
+            return np.nanmean(work_arr, axis=axis)
+
+#-------------------------
+# masked_float_copy
+#----------------
+
+def masked_float_copy(arr, mask, work_dtype=np.float64):
+    '''
+    Return a copy of arr of float work_dtype, with NaN
+    where mask is True. In object arrays, the masked 
+    cells may hold strings, such as 'refused', so they
+    are set to NaN before the conversion.
+    '''
+    if arr.dtype.kind == 'O':
+        return np.where(mask, np.nan, arr).astype(work_dtype)
+    work_arr = arr.astype(work_dtype)
+    work_arr[mask] = np.nan
+    return work_arr
+
+#-------------------------
+# scratch_vector_stats
+#----------------
+
+def scratch_vector_stats(arr, mask, axis, replacement, scratch):
+    '''
+    Like vector_stats(), but the vectors are copied 
+    into the given scratch buffer, one vector per row,
+    and sorted or summed there. The result has the
+    scratch buffer's dtype.
+    '''
+    num_vectors = arr.shape[1 - axis]
+    vector_len  = arr.shape[axis]
+    work_arr = scratch[:num_vectors * vector_len].reshape(num_vectors, vector_len)
+    vector_mask = mask.T if axis == 0 else mask
+    np.copyto(work_arr, arr.T if axis == 0 else arr, casting='unsafe')
+    counts = vector_len - np.count_nonzero(mask, axis=axis)
+    
+    if replacement == 'median':
+        # Missing values sort to the end of each vector,
+        # so the middle of the present values is found
+        # from their count:
+        np.copyto(work_arr, np.nan, where=vector_mask)
+        work_arr.sort(axis=1)
+        vector_indexes = np.arange(num_vectors)
+        lower = work_arr[vector_indexes, np.maximum(counts - 1, 0) // 2]
+        upper = work_arr[vector_indexes, counts // 2]
+        stats = (lower + upper) / 2
+    else:
+        np.copyto(work_arr, 0, where=vector_mask)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stats = (work_arr.sum(axis=1) / counts).astype(scratch.dtype)
+    stats[counts == 0] = np.nan
+    return stats
+
+#-------------------------
+# fill_mask
+#----------------
+
+def fill_mask(arr, mask, vector_values, axis):
+    '''
+    In 2D arr, set each cell where mask is True 
+    to the value in vector_values for the cell's
+    column (axis=0) or row (axis=1). Modifies arr
+    in place.
+    
+    :param arr: two-dimensional numpy array
+    :type arr: numpy.ndarray
+    :param mask: True where arr's values are to be replaced
+    :type mask: numpy.ndarray
+    :param vector_values: one value per column or row
+    :type vector_values: numpy.ndarray
+    :param axis: 0 if vector_values are per column, 1 if per row
+    :type axis: int
+    '''
+    # Broadcasting the vector values against arr
+    # avoids index arrays for the missing cells:
+    if axis == 0:
+        np.copyto(arr, vector_values, casting='unsafe', where=mask)
+    else:
+        np.copyto(arr, vector_values[:, np.newaxis], casting='unsafe', where=mask)
+    return arr
+
+#-------------------------
+# numeric_blocks
+#----------------
+
+def numeric_blocks(frame, skip_position=None):
+    '''
+    Return a list of (col_positions, values) pairs, one 
+    for each block of numeric columns that pandas holds 
+    in one ndarray. values is a rows x columns view into
+    that ndarray, so writing into it changes the frame
+    without copies. The column at skip_position is left 
+    out; the rest of its block yields two views.
+    '''
+    # The block manager is _mgr from pandas 1.1 on:
+    manager = frame._mgr if hasattr(frame, '_mgr') else frame._data
+    blocks = []
+    for block in manager.blocks:
+        values = block.values
+        if not isinstance(values, np.ndarray) or values.ndim != 2 or values.dtype.kind not in 'iuf':
+            continue
+        # Blocks hold their columns as rows:
+        positions = list(block.mgr_locs.as_array)
+        if skip_position in positions:
+            skip = positions.index(skip_position)
+            runs = [(0, skip), (skip + 1, len(positions))]
+        else:
+            runs = [(0, len(positions))]
+        for (start, end) in runs:
+            if end > start:
+                blocks.append((positions[start:end], values[start:end].T))
+    return blocks
+
+#-------------------------
+# frame_row_stats
+#----------------
+
+def frame_row_stats(arrs, replacement, missing_value, preserve_dtype=False, block_size=DEFAULT_BLOCK_SIZE):
+    '''
+    Return the median or mean of each row across the
+    given 2D arrays of equal row count, such as the 
+    views made by numeric_blocks(). Rows are gathered 
+    into one working array at most block_size cells at
+    a time. Approximate medians are computed exactly.
+    '''
+    work_dtype = np.result_type(*[work_dtype_for(arr, preserve_dtype) for arr in arrs])
+    num_rows = arrs[0].shape[0]
+    num_cols = sum(arr.shape[1] for arr in arrs)
+    stats = np.empty(num_rows, dtype=work_dtype)
+    rows_per_block = max(1, block_size // max(1, num_cols))
+    for start in range(0, num_rows, rows_per_block):
+        end = min(start + rows_per_block, num_rows)
+        work_arr = np.empty((end - start, num_cols), dtype=work_dtype)
+        col = 0
+        for arr in arrs:
+            rows = arr[start:end]
+            work_arr[:, col:col + arr.shape[1]] = masked_float_copy(rows, match_mask(rows, missing_value), 
+                                                                    work_dtype)
+            col += arr.shape[1]
+        # Missing cells are NaN now, as are NaN cells
+        # that were not missing values, which the 
+        # nan-functions disregard anyway:
+        stats[start:end] = vector_stats(work_arr, np.isnan(work_arr), 1, 
+                                        'mean' if replacement == 'mean' else 'median', work_dtype)
+    return stats
+
+#-------------------------
+# numeric_col_groups
+#----------------
+
+def numeric_col_groups(frame):
+    '''
+    Return an OrderedDict mapping each numeric dtype
+    of the DataFrame's columns to the positions of
+    the columns of that dtype.
+    '''
+    col_positions_by_dtype = OrderedDict()
+    for (position, dtype) in enumerate(frame.dtypes):
+        if dtype.kind in 'iuf':
+            col_positions_by_dtype.setdefault(dtype, []).append(position)
+    return col_positions_by_dtype
+
+#-------------------------
+# vector_blocks
+#----------------
+
+def vector_blocks(arr, axis, block_size):
+    '''
+    Generator of (start, end) index ranges of blocks
+    of whole columns (axis=0) or rows (axis=1) of 2D
+    arr, each block holding at most block_size cells,
+    but at least one vector.
+    '''
+    num_vectors = arr.shape[1 - axis]
+    vector_len  = arr.shape[axis]
+    vectors_per_block = max(1, block_size // max(1, vector_len))
+    for start in range(0, num_vectors, vectors_per_block):
+        yield (start, min(start + vectors_per_block, num_vectors))
+
+#-------------------------
+# vector_block
+#----------------
+
+def vector_block(arr, axis, start, end):
+    # View of the columns (axis=0) or rows (axis=1)
+    # from start to end:
+    if axis == 0:
+        return arr[:, start:end]
+    else:
+        return arr[start:end, :]
+
+#-------------------------
+# block_match_mask
+#----------------
+
+def block_match_mask(block, missing_value, mask, axis, start, end, out=None):
+    # Mask of the missing values in a block made by
+    # vector_block(): the corresponding part of a 
+    # precomputed mask, or else computed afresh, 
+    # into out if given:
+    if mask is None:
+        if out is not None:
+            out = out[:block.size].reshape(block.shape)
+        return match_mask(block, missing_value, out=out)
+    return vector_block(mask, axis, start, end)
+
+#-------------------------
+# block_buffers
+#----------------
+
+def block_buffers(arr, axis, block_size, work_dtype, mask):
+    '''
+    Return a scratch buffer of work_dtype, and a boolean
+    buffer for masks (None if mask is given), each large 
+    enough for the largest block of vector_blocks().
+    '''
+    (start, end) = next(vector_blocks(arr, axis, block_size), (0, 0))
+    block_cells = (end - start) * arr.shape[axis]
+    return (np.empty(block_cells, dtype=work_dtype),
+            np.empty(block_cells, dtype=bool) if mask is None else None)
+
+#-------------------------
+# blockwise_stats
+#----------------
+
+def blockwise_stats(arr, missing_value, axis, replacement, block_size, mask=None,
+                    work_dtype=np.float64, scratch=False):
+    '''
+    Like vector_stats(), but reads arr in blocks of
+    at most block_size cells, so that memory for the 
+    mask and the working copy stays bounded. Returns
+    the median or mean of each column or row. With 
+    scratch=True, the working copy and mask buffers
+    are allocated once, and reused for all blocks.
+    
+    Means across the memory layout, such as column 
+    means of a C-order array, are accumulated over
+    contiguous blocks by blockwise_means(). Medians 
+    need whole vectors, so each of their blocks reads
+    across the layout; for memory-mapped arrays, a 
+    larger block_size means fewer passes over the file.
+    '''
+    if replacement == 'mean' and contiguous_axis(arr) != axis:
+        return blockwise_means(arr, missing_value, axis, block_size, mask, work_dtype, scratch)
+    (scratch_buf, mask_buf) = block_buffers(arr, axis, block_size, work_dtype, mask) if scratch else (None, None)
+    stats = np.empty(arr.shape[1 - axis], dtype=work_dtype)
+    for (start, end) in vector_blocks(arr, axis, block_size):
+        block = vector_block(arr, axis, start, end)
+        stats[start:end] = vector_stats(block, 
+                                        block_match_mask(block, missing_value, mask, axis, start, end, mask_buf), 
+                                        axis, replacement, work_dtype, scratch_buf)
+    return stats
+
+#-------------------------
+# blockwise_fill
+#----------------
+
+def blockwise_fill(arr, missing_value, vector_values, axis, block_size, mask=None, scratch=False):
+    '''
+    Like fill_mask(), but processes arr in blocks 
+    of at most block_size cells, so that memory for 
+    the mask stays bounded. Modifies arr in place.
+    With scratch=True, one mask buffer is reused for
+    all blocks.
+    '''
+    # Filling needs no whole vectors, so the blocks
+    # follow the memory layout:
+    block_axis = contiguous_axis(arr)
+    mask_buf = None
+    if scratch and mask is None:
+        mask_buf = block_buffers(arr, block_axis, block_size, bool, mask)[1]
+    for (start, end) in vector_blocks(arr, block_axis, block_size):
+        block = vector_block(arr, block_axis, start, end)
+        fill_mask(block, 
+                  block_match_mask(block, missing_value, mask, block_axis, start, end, mask_buf), 
+                  vector_values[start:end] if block_axis == axis else vector_values, axis)
+    return arr
+
+#-------------------------
+# blockwise_means
+#----------------
+
+def blockwise_means(arr, missing_value, axis, block_size, mask=None, 
+                    work_dtype=np.float64, scratch=False):
+    '''
+    Return the mean of each column (axis=0) or row 
+    (axis=1) of arr, from sums and counts accumulated 
+    over blocks of the other direction. Each block is
+    contiguous in memory, so a memory-mapped file is
+    read once, front to back. Vectors with only missing
+    values yield numpy.nan.
+    '''
+    block_axis = 1 - axis
+    (scratch_buf, mask_buf) = block_buffers(arr, block_axis, block_size, work_dtype, mask) \
+                              if scratch else (None, None)
+    sums   = np.zeros(arr.shape[block_axis], dtype=work_dtype)
+    counts = np.zeros(arr.shape[block_axis], dtype=np.int64)
+    for (start, end) in vector_blocks(arr, block_axis, block_size):
+        block = vector_block(arr, block_axis, start, end)
+        block_mask = block_match_mask(block, missing_value, mask, block_axis, start, end, mask_buf)
+        if block.dtype.kind == 'O':
+            # Missing values may be strings, such as 'refused':
+            block = np.where(block_mask, np.nan, block)
+        if scratch_buf is not None:
+            work_arr = scratch_buf[:block.size].reshape(block.shape)
+            np.copyto(work_arr, block, casting='unsafe')
+        else:
+            work_arr = block.astype(work_dtype)
+        # NaN cells that are not missing values are
+        # disregarded, as by numpy.nanmean():
+        block_mask = block_mask | np.isnan(work_arr)
+        np.copyto(work_arr, 0, where=block_mask)
+        sums   += work_arr.sum(axis=axis)
+        counts += block_mask.shape[axis] - np.count_nonzero(block_mask, axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums / counts).astype(work_dtype)
+
+#-------------------------
+# contiguous_axis
+#----------------
+
+def contiguous_axis(arr):
+    '''
+    Return the axis argument of vector_block() whose 
+    blocks are contiguous in arr's memory: 1 (blocks
+    of rows) for C-order arrays, 0 (blocks of columns)
+    for Fortran-order ones.
+    '''
+    return 0 if arr.flags.f_contiguous and not arr.flags.c_contiguous else 1
+
+#-------------------------
+# sparse_vector_stats
+#----------------
+
+def sparse_vector_stats(data, vector_ids, num_vectors, implicit_zeros, replacement):
+    '''
+    Return the median or mean of each of num_vectors
+    vectors, given the present stored values in data,
+    the vector to which each belongs, and the number of
+    additional zeros in each vector. Vectors without 
+    any values yield numpy.nan.
+    '''
+    counts = np.bincount(vector_ids, minlength=num_vectors) + implicit_zeros
+    if replacement == 'mean':
+        sums = np.bincount(vector_ids, weights=data, minlength=num_vectors)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stats = sums / counts
+    else:
+        # Sorted by vector, then by value. In each vector, 
+        # the implicit zeros rank after the negative values,
+        # before the others:
+        order = np.lexsort((data, vector_ids))
+        # Padded, so that indexes computed for empty
+        # vectors stay in range:
+        sorted_data = np.append(data[order], 0).astype(float)
+        stored_counts = counts - implicit_zeros
+        starts = np.cumsum(stored_counts) - stored_counts
+        num_negative = np.bincount(vector_ids[data < 0], minlength=num_vectors)
+        
+        def value_at_rank(rank):
+            stored_rank = np.where(rank < num_negative, rank, rank - implicit_zeros)
+            stored_value = sorted_data[np.clip(starts + stored_rank, 0, len(data))]
+            is_zero = np.logical_and(rank >= num_negative, rank < num_negative + implicit_zeros)
+            return np.where(is_zero, 0., stored_value)
+        
+        stats = (value_at_rank(np.maximum(counts - 1, 0) // 2) + value_at_rank(counts // 2)) / 2.
+    stats = stats.astype(float)
+    stats[counts == 0] = np.nan
+    return stats
+
+#-------------------------
+# segment_indptr
+#----------------
+
+def segment_indptr(vector_ids, num_vectors):
+    # Index pointer array of a compressed sparse matrix
+    # whose stored entries belong to the given, ascending
+    # vector_ids:
+    return np.concatenate(([0], np.cumsum(np.bincount(vector_ids, minlength=num_vectors))))
+
+#-------------------------
+# distance_features
+#----------------
+
+def distance_features(data, metric, missing_value, respondents, categorical):
+    '''
+    Return the answers of each respondent (rows) as 
+    a float array with NaN for missing answers, and 
+    as an array of integer category codes per question
+    with -1 for missing answers. Either is None if no
+    question is treated that way by the metric.
+    '''
+    arr = data.values if isinstance(data, pd.DataFrame) else np.asarray(data)
+    missing = match_mask(arr, missing_value)
+    if respondents == 'columns':
+        (arr, missing) = (arr.T, missing.T)
+    
+    if metric == 'euclidean':
+        is_categorical = np.zeros(arr.shape[1], dtype=bool)
+    elif metric == 'hamming':
+        is_categorical = np.ones(arr.shape[1], dtype=bool)
+    elif categorical is not None:
+        is_categorical = np.zeros(arr.shape[1], dtype=bool)
+        is_categorical[np.asarray(categorical)] = True
+    elif arr.dtype.kind in 'iuf':
+        is_categorical = np.zeros(arr.shape[1], dtype=bool)
+    elif arr.dtype.kind != 'O':
+        is_categorical = np.ones(arr.shape[1], dtype=bool)
+    else:
+        # Mixed answers, as from a DataFrame: questions
+        # with any answer that is no number are categorical:
+        is_categorical = np.array([any(isinstance(answer, bool) or not isinstance(answer, numbers.Number)
+                                       for answer in arr[np.logical_not(missing[:, question]), question])
+                                   for question in range(arr.shape[1])], dtype=bool)
+    
+    numeric = None
+    codes = None
+    if not is_categorical.all():
+        numeric = masked_float_copy(arr[:, np.logical_not(is_categorical)], 
+                                    missing[:, np.logical_not(is_categorical)])
+    if is_categorical.any():
+        categorical_cols = np.flatnonzero(is_categorical)
+        codes = np.empty((arr.shape[0], len(categorical_cols)), dtype=int)
+        for (code_col, col) in enumerate(categorical_cols):
+            codes[:, code_col] = pd.factorize(arr[:, col])[0]
+            codes[missing[:, col], code_col] = -1
+    return (numeric, codes)
+
+#-------------------------
+# euclidean_block
+#----------------
+
+def euclidean_block(zeroed1, squared1, present1, zeroed2, squared2, present2, num_questions):
+    '''
+    Return the euclidean distances between the rows of
+    two blocks of respondents over their common answers,
+    scaled to num_questions. Missing answers are zero in
+    the zeroed and squared arrays, and 0 in present. The
+    sum over common answers of (a - b)^2 expands into 
+    matrix products.
+    '''
+    sum_squares = np.dot(squared1, present2.T) + np.dot(present1, squared2.T) - 2 * np.dot(zeroed1, zeroed2.T)
+    num_common = np.dot(present1, present2.T)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.sqrt(np.maximum(sum_squares, 0) * num_questions / num_common)
+
+#-------------------------
+# mismatch_block
+#----------------
+
+def mismatch_block(numeric1, codes1, numeric2, codes2, ranges):
+    '''
+    Return the mean dissimilarity over common answers
+    between the rows of two blocks of respondents: range
+    normalized absolute differences for numeric answers,
+    and 0 or 1 for category codes.
+    '''
+    dissimilarity = 0.
+    num_common = 0
+    if numeric1 is not None:
+        differences = np.abs(numeric1[:, np.newaxis, :] - numeric2[np.newaxis, :, :]) / ranges
+        common = np.logical_not(np.isnan(differences))
+        dissimilarity = dissimilarity + np.where(common, differences, 0.).sum(axis=2)
+        num_common = num_common + np.count_nonzero(common, axis=2)
+    if codes1 is not None:
+        (codes1, codes2) = (codes1[:, np.newaxis, :], codes2[np.newaxis, :, :])
+        common = np.logical_and(codes1 >= 0, codes2 >= 0)
+        dissimilarity = dissimilarity + np.count_nonzero(np.logical_and(common, codes1 != codes2), axis=2)
+        num_common = num_common + np.count_nonzero(common, axis=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return dissimilarity / num_common
+
+#-------------------------
+# condensed_block_write
+#----------------
+
+def condensed_block_write(distances, num_respondents, rows1, rows2, block):
+    '''
+    Write the distances of a block of respondent pairs 
+    (rows1 x rows2) into the condensed distance vector;
+    pairs not above the diagonal are skipped.
+    '''
+    (pair_rows, pair_cols) = np.nonzero(np.arange(rows2.start, rows2.stop)[np.newaxis, :] >
+                                        np.arange(rows1.start, rows1.stop)[:, np.newaxis])
+    i = rows1.start + pair_rows
+    j = rows2.start + pair_cols
+    distances[num_respondents * i - i * (i + 1) // 2 + (j - i - 1)] = block[pair_rows, pair_cols]
+
+#-------------------------
+# nn_chain_ward
+#----------------
+
+def nn_chain_ward(centroids, weights):
+    '''
+    Return the Ward linkage matrix of clusters with the
+    given centroids (rows) and weights, merged by the 
+    nearest-neighbor chain algorithm. The Ward distance
+    of clusters a and b is 
+    
+        sqrt(2 * wa * wb / (wa + wb)) * ||ca - cb||
+    
+    which is the euclidean distance for single respondents.
+    Active clusters are kept in the first num_active rows
+    of the working arrays.
+    '''
+    num_leaves = len(centroids)
+    centroids = np.array(centroids, dtype=float)
+    weights = np.array(weights, dtype=float)
+    # Leaf that stands for each active cluster, and 
+    # each leaf's row in the working arrays:
+    leaf_of_row = np.arange(num_leaves)
+    row_of_leaf = np.arange(num_leaves)
+    num_active = num_leaves
+    merges = np.empty((num_leaves - 1, 4))
+    num_merges = 0
+    chain = []
+    while num_active > 1:
+        if len(chain) == 0:
+            chain.append(leaf_of_row[0])
+        row = row_of_leaf[chain[-1]]
+        diffs = centroids[:num_active] - centroids[row]
+        active_weights = weights[:num_active]
+        costs = np.einsum('ij,ij->i', diffs, diffs) * (2. * weights[row] * active_weights / (weights[row] + active_weights))
+        costs[row] = np.inf
+        nearest = int(np.argmin(costs))
+        # On ties, the previous cluster of the chain wins,
+        # so that the chain ends:
+        if len(chain) > 1 and costs[row_of_leaf[chain[-2]]] <= costs[nearest]:
+            nearest = row_of_leaf[chain[-2]]
+        if len(chain) < 2 or nearest != row_of_leaf[chain[-2]]:
+            chain.append(leaf_of_row[nearest])
+            continue
+        
+        # Reciprocal nearest neighbors: merge them into
+        # the row of the first, and fill the row of the
+        # second with the last active cluster:
+        chain = chain[:-2]
+        (row1, row2) = (min(row, nearest), max(row, nearest))
+        total_weight = weights[row1] + weights[row2]
+        merges[num_merges] = [leaf_of_row[row1], leaf_of_row[row2], np.sqrt(costs[nearest]), total_weight]
+        num_merges += 1
+        centroids[row1] = (weights[row1] * centroids[row1] + weights[row2] * centroids[row2]) / total_weight
+        weights[row1] = total_weight
+        last = num_active - 1
+        centroids[row2] = centroids[last]
+        weights[row2] = weights[last]
+        leaf_of_row[row2] = leaf_of_row[last]
+        row_of_leaf[leaf_of_row[row2]] = row2
+        num_active -= 1
+    return relabel_merges(merges)
+
+#-------------------------
+# relabel_merges
+#----------------
+
+def relabel_merges(merges):
+    '''
+    Turn merges of clusters, each given by one of its
+    leaves, into a linkage matrix: merges are sorted by 
+    distance, stably, and the cluster formed by the i-th
+    merge is named num_leaves + i, as by linkage().
+    '''
+    num_leaves = len(merges) + 1
+    Z = merges[np.argsort(merges[:, 2], kind='mergesort')]
+    # Union-find over leaves and merged clusters:
+    parent = np.arange(2 * num_leaves - 1)
+    def find(cluster):
+        root = cluster
+        while parent[root] != root:
+            root = parent[root]
+        while parent[cluster] != root:
+            (parent[cluster], cluster) = (root, parent[cluster])
+        return root
+    for merge_num in range(len(Z)):
+        (root1, root2) = (find(int(Z[merge_num, 0])), find(int(Z[merge_num, 1])))
+        Z[merge_num, :2] = (min(root1, root2), max(root1, root2))
+        parent[root1] = parent[root2] = num_leaves + merge_num
+    return Z
+
+#-------------------------
+# minibatch_centroids
+#----------------
+
+def minibatch_centroids(answers, n_clusters, batch_size, max_iter, rand):
+    '''
+    Cluster respondents by mini-batch k-means. Each center
+    moves towards the mean of the batch respondents nearest
+    to it, at a rate that falls with the number of 
+    respondents it has seen. Returns the mean answers of 
+    the respondents nearest to each center, their number, 
+    and each respondent's cluster; clusters without 
+    respondents are dropped.
+    '''
+    num_respondents = len(answers)
+    centers = answers[rand.choice(num_respondents, n_clusters, replace=False)].astype(float)
+    seen = np.zeros(n_clusters)
+    for _iteration in range(max_iter):
+        batch = answers[rand.randint(0, num_respondents, min(batch_size, num_respondents))]
+        nearest = nearest_centroids(batch, centers)
+        batch_counts = np.bincount(nearest, minlength=n_clusters).astype(float)
+        batch_sums = np.zeros(centers.shape)
+        np.add.at(batch_sums, nearest, batch)
+        seen += batch_counts
+        hit = batch_counts > 0
+        centers[hit] += (batch_sums[hit] - batch_counts[hit, np.newaxis] * centers[hit]) / seen[hit, np.newaxis]
+    
+    # Final assignment of all respondents, in blocks:
+    assignments = np.empty(num_respondents, dtype=int)
+    sums = np.zeros(centers.shape)
+    rows_per_block = max(1, DEFAULT_DISTANCE_BLOCK_SIZE // max(1, n_clusters))
+    for start in range(0, num_respondents, rows_per_block):
+        block = answers[start:start + rows_per_block]
+        assignments[start:start + len(block)] = nearest_centroids(block, centers)
+        np.add.at(sums, assignments[start:start + len(block)], block)
+    counts = np.bincount(assignments, minlength=n_clusters)
+    used = np.flatnonzero(counts)
+    renumbered = np.full(n_clusters, -1, dtype=int)
+    renumbered[used] = np.arange(len(used))
+    return (sums[used] / counts[used, np.newaxis], counts[used].astype(float), renumbered[assignments])
+
+#-------------------------
+# nearest_centroids
+#----------------
+
+def nearest_centroids(rows, centers):
+    # Index of each row's nearest center; the rows' own
+    # squared lengths do not change the order:
+    costs = (centers ** 2).sum(axis=1)[np.newaxis, :] - 2. * rows.dot(centers.T)
+    return np.argmin(costs, axis=1)
+
+#-------------------------
+# work_dtype_for
+#----------------
+
+def work_dtype_for(arr, preserve_dtype):
+    # Float dtype in which statistics of arr are
+    # computed: arr's own if it is a float array
+    # whose dtype is to be preserved:
+    if preserve_dtype and arr.dtype.kind == 'f':
+        return arr.dtype
+    return np.dtype(np.float64)
+
+#-------------------------
+# round_values
+#----------------
+
+def round_values(vector_values, dtype, int_rounding):
+    '''
+    Return the vector_values rounded as int_rounding
+    requests if they are to be written into an array
+    of integer dtype; otherwise return them unchanged.
+    Truncation is left to the assignment.
+    '''
+    if np.dtype(dtype).kind not in 'iu' or int_rounding == 'truncate':
+        return vector_values
+    if int_rounding == 'round':
+        return np.round(vector_values)
+    elif int_rounding == 'floor':
+        return np.floor(vector_values)
+    else:
+        return np.ceil(vector_values)
+
+#-------------------------
+# group_codes
+#----------------
+
+def group_codes(groups, num_rows):
+    '''
+    Return an integer code from 0 to num_groups - 1
+    for each group label, -1 for None or NaN labels,
+    and the number of groups.
+    '''
+    if len(groups) != num_rows:
+        raise ValueError('Need one group label per row (%s), but got %s' % (num_rows, len(groups)))
+    (codes, uniques) = pd.factorize(np.asarray(groups))
+    return (codes, len(uniques))
+
+#-------------------------
+# group_stats
+#----------------
+
+def group_stats(arr, mask, codes, num_groups, replacement):
+    '''
+    Return a num_groups x m array with the median or 
+    mean of each column of 2D arr over the rows of 
+    each group, disregarding cells where mask is True.
+    All rows must have a group code from 0 to
+    num_groups - 1, and each group must have rows.
+    '''
+    work_arr = masked_float_copy(arr, mask)
+    # First row of each group once rows are sorted by group:
+    group_sizes = np.bincount(codes, minlength=num_groups)
+    group_starts = np.cumsum(group_sizes) - group_sizes
+    
+    if replacement == 'median':
+        # Order each column by value, missing values last,
+        # then stably by group. Each group's values then
+        # form a sorted segment of the column, with its 
+        # missing values at the segment's end:
+        by_value = np.argsort(work_arr, axis=0, kind='mergesort')
+        by_group = np.argsort(codes[by_value], axis=0, kind='mergesort')
+        sorted_arr = np.take_along_axis(work_arr, np.take_along_axis(by_value, by_group, axis=0), axis=0)
+        present = np.logical_not(np.isnan(sorted_arr))
+        counts = np.add.reduceat(present, group_starts, axis=0)
+        col_indexes = np.arange(arr.shape[1])
+        lower = group_starts[:, np.newaxis] + np.maximum(counts - 1, 0) // 2
+        upper = group_starts[:, np.newaxis] + counts // 2
+        stats = (sorted_arr[lower, col_indexes] + sorted_arr[upper, col_indexes]) / 2.
+    else:
+        sorted_arr = work_arr[np.argsort(codes, kind='mergesort')]
+        present = np.logical_not(np.isnan(sorted_arr))
+        counts = np.add.reduceat(present, group_starts, axis=0)
+        sums = np.add.reduceat(np.where(present, sorted_arr, 0), group_starts, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stats = sums / counts
+    stats[counts == 0] = np.nan
+    return stats
+
+#-------------------------
+# grouped_impute
+#----------------
+
+def grouped_impute(arr, codes, num_groups, replacement, missing_value):
+    '''
+    Replace missing values of 2D arr in place with
+    per-group column statistics. Rows with group 
+    code -1 are neither used nor filled.
+    '''
+    if replacement not in ['median', 'mean']:
+        raise ValueError("Replacement must be 'median' or 'mean'; was %s" % replacement)
+    if num_groups == 0:
+        return arr
+    mask = match_mask(arr, missing_value)
+    grouped_rows = codes >= 0
+    if grouped_rows.all():
+        stats = group_stats(arr, mask, codes, num_groups, replacement)
+    else:
+        stats = group_stats(arr[grouped_rows], mask[grouped_rows], codes[grouped_rows], 
+                            num_groups, replacement)
+    (rows, cols) = np.nonzero(mask & grouped_rows[:, np.newaxis])
+    arr[rows, cols] = stats[codes[rows], cols]
+    return arr
+
+#-------------------------
+# parallel_impute
+#----------------
+
+def parallel_impute(arr, axis, replacement, missing_value, block_size, sketch_error, n_jobs, mask=None,
+                    work_dtype=np.float64, int_rounding='truncate'):
+    '''
+    Replace missing values of 2D arr in place, with
+    blocks of whole columns (axis=0) or rows (axis=1)
+    processed by a pool of n_jobs threads. Each block's
+    statistics are computed and filled in one go, since 
+    a block holds its vectors entirely.
+    '''
+    if n_jobs < 1:
+        n_jobs = multiprocessing.cpu_count()
+    num_vectors = arr.shape[1 - axis]
+    if block_size is None:
+        # A few blocks per thread, to even out the load:
+        vectors_per_block = max(1, int(np.ceil(num_vectors / (4. * n_jobs))))
+        block_ranges = [(start, min(start + vectors_per_block, num_vectors)) 
+                        for start in range(0, num_vectors, vectors_per_block)]
+    else:
+        block_ranges = list(vector_blocks(arr, axis, block_size))
+    # Sketches must be fed in chunks of the same number
+    # of values as in the serial computation, or their
+    # estimates would differ:
+    cells_per_chunk_vector = max(1, (block_size or DEFAULT_BLOCK_SIZE) // max(1, num_vectors))
+        
+    def impute_block(block_range):
+        (start, end) = block_range
+        block = vector_block(arr, axis, start, end)
+        block_mask = block_match_mask(block, missing_value, mask, axis, start, end)
+        if replacement == 'approx_median':
+            sketches = build_sketches(block, 'column' if axis == 0 else 'row', missing_value,
+                                      error=sketch_error,
+                                      block_size=cells_per_chunk_vector * (end - start),
+                                      seed_offset=start,
+                                      mask=block_mask)
+            vector_values = np.array([sketch.median() for sketch in sketches])
+        else:
+            vector_values = vector_stats(block, block_mask, axis, replacement, work_dtype)
+        fill_mask(block, block_mask, round_values(vector_values, block.dtype, int_rounding), axis)
+            
+    pool = ThreadPool(n_jobs)
+    try:
+        pool.map(impute_block, block_ranges)
+    finally:
+        pool.close()
+        pool.join()
+    return arr
+
+#-------------------------
+# perc_eq_val 
+#----------------- 
+
+def perc_eq_val(series, val):
+    '''
+    Return percentage of <val> in <series>
+    
+    :param series: series to examine
     :type series: pandas.Series
     :param val: value to be counted
     :type val: <any>
     '''
   
     return(100*series[series==val].count()/len(series))
+
+#-------------------------
+# perc_eq_vals 
+#----------------- 
+
+def perc_eq_vals(data, values=None, sparse=False):
+    '''
+    Return the percentage of each distinct value in 
+    each column of data, as a DataFrame with one row
+    per value and one column per data column. Where
+    perc_eq_val() scans a series once per value, all 
+    values of all columns are counted at once: the 
+    cells are factorized into integer codes, and the 
+    codes counted per column with one bincount().
+    
+    Missing values (NaN or None) are counted as one
+    more value, labeled NaN. If values is given, only
+    those values are counted, and values that do not 
+    occur get zero.
+    
+    With many distinct values, such as in continuous 
+    data, a dense table of values by columns can be 
+    far larger than data. With sparse=True, each 
+    column's codes are counted with numpy.unique() 
+    instead, and the columns of the table are pandas 
+    SparseArrays, whose zeros are not stored. Index,
+    columns, and values are the same either way.
+    
+    :param data: matrix or series to examine
+    :type data: {pandas.DataFrame | pandas.Series | numpy.ndarray}
+    :param values: values to be counted; default: all
+    :type values: {None | [<any>]}
+    :param sparse: if True, return a DataFrame of sparse columns
+    :type sparse: bool
+    :return percentages of values (rows) in columns (columns)
+    :rtype: pandas.DataFrame
+    '''
+    if isinstance(data, pd.Series):
+        data = data.to_frame()
+    if isinstance(data, pd.DataFrame):
+        columns = data.columns
+        arr = data.values
+    else:
+        arr = np.asarray(data)
+        if arr.ndim == 1:
+            arr = arr[:, np.newaxis]
+        columns = range(arr.shape[1])
+    (num_rows, num_cols) = arr.shape
+    
+    # Column by column, so that cell i belongs 
+    # to column i // num_rows:
+    cells = arr.ravel(order='F')
+    if values is None:
+        try:
+            (codes, uniques) = pd.factorize(cells, sort=True)
+        except TypeError:
+            # Values of types that cannot be compared:
+            (codes, uniques) = pd.factorize(cells)
+        uniques = list(uniques)
+        if (codes < 0).any():
+            codes[codes < 0] = len(uniques)
+            uniques.append(np.nan)
+        if sparse:
+            return sparse_value_percentages(codes, uniques, num_rows, columns)
+        col_ids = np.repeat(np.arange(num_cols), num_rows)
+    else:
+        uniques = list(values)
+        codes = pd.Index(uniques).get_indexer(cells)
+        if sparse:
+            return sparse_value_percentages(codes, uniques, num_rows, columns)
+        requested = codes >= 0
+        codes = codes[requested]
+        col_ids = np.repeat(np.arange(num_cols), num_rows)[requested]
+    
+    counts = np.bincount(col_ids * len(uniques) + codes, 
+                         minlength=num_cols * len(uniques)).reshape(num_cols, len(uniques))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percentages = 100. * counts.T / num_rows
+    return pd.DataFrame(percentages, index=uniques, columns=columns)
+
+#-------------------------
+# sparse_value_percentages
+#----------------- 
+
+def sparse_value_percentages(codes, uniques, num_rows, columns):
+    '''
+    Like the end of perc_eq_vals(), but the codes of 
+    each column, stored one column after the other, 
+    are counted separately, and each column of the 
+    returned DataFrame is a SparseArray. Negative 
+    codes are not counted.
+    '''
+    sparse_cols = OrderedDict()
+    for col_num in range(len(columns)):
+        col_codes = codes[col_num * num_rows : (col_num + 1) * num_rows]
+        (col_codes, col_counts) = np.unique(col_codes[col_codes >= 0], return_counts=True)
+        # One column at a time is dense:
+        percentages = np.zeros(len(uniques))
+        percentages[col_codes] = 100. * col_counts / num_rows
+        sparse_cols[col_num] = pd.arrays.SparseArray(percentages, fill_value=0.)
+    frame = pd.DataFrame(sparse_cols, index=uniques)
+    frame.columns = columns
+    return frame
+
+#-------------------------
+# perc_answered 
+#----------------- 
+
+def perc_answered(data, 
+                  missing_value=np.nan, 
+                  respondents='columns', 
+                  block_size=None):
+    '''
+    Return the percentage of questions each respondent
+    answered, and the percentage of respondents who
+    answered each question. A cell counts as answered
+    unless it holds a missing value.
+    
+    Tables made by TableShaper.unfold() hold one column
+    per respondent, and one row per question. For tables
+    with one row per respondent, pass respondents='rows'.
+    
+    Answers are counted in one vectorized pass. With a 
+    block_size, the data is read in blocks of whole rows
+    of at most block_size cells, so that the mask of 
+    missing values stays small. Memory-mapped arrays are
+    read in blocks of DEFAULT_BLOCK_SIZE cells by default.
+    
+    :param data: the table, or path to an .npy file
+    :type data: {numpy.ndarray | numpy.memmap | pandas.DataFrame | string}
+    :param missing_value: the value that stands for 'value missing',
+        or a list, tuple, or set of such values
+    :type missing_value: ANY
+    :param respondents: 'columns' or 'rows'
+    :type respondents: string
+    :param block_size: largest number of cells examined at a time
+    :type block_size: {None | int}
+    :return tuple of percentages per respondent, and percentages
+        per question
+    :rtype (numpy.ndarray, numpy.ndarray)
+    '''
+    if respondents not in ['columns', 'rows']:
+        raise ValueError("Respondents must be 'columns' or 'rows'; was %s" % respondents)
+    if isinstance(data, STRING_TYPES):
+        data = np.load(data, mmap_mode='r')
+    if isinstance(data, pd.DataFrame):
+        data = data.values
+    if block_size is None and isinstance(data, np.memmap):
+        block_size = DEFAULT_BLOCK_SIZE
+    
+    (num_rows, num_cols) = data.shape
+    row_counts = np.empty(num_rows, dtype=int)
+    col_counts = np.zeros(num_cols, dtype=int)
+    for (start, end) in vector_blocks(data, 1, block_size or max(1, data.size)):
+        answered = np.logical_not(match_mask(data[start:end], missing_value))
+        row_counts[start:end] = np.count_nonzero(answered, axis=1)
+        col_counts += np.count_nonzero(answered, axis=0)
+    
+    with np.errstate(invalid='ignore', divide='ignore'):
+        row_percs = 100. * row_counts / num_cols
+        col_percs = 100. * col_counts / num_rows
+    if respondents == 'columns':
+        return (col_percs, row_percs)
+    return (row_percs, col_percs)
+
+#-------------------------
+# select_respondents 
+#----------------- 
+
+def select_respondents(data, 
+                       min_perc_answered, 
+                       missing_value=np.nan, 
+                       respondents='columns',
+                       block_size=None,
+                       mask_only=False):
+    '''
+    Remove the respondents who answered fewer than 
+    min_perc_answered percent of the questions. Returns
+    the remaining table, or with mask_only=True, a 
+    boolean array that is True for each respondent to 
+    keep. See perc_answered() for the arguments.
+    
+    DataFrames yield DataFrames; arrays and memory-mapped
+    arrays yield in-memory arrays.
+    
+    :param data: the table, or path to an .npy file
+    :type data: {numpy.ndarray | numpy.memmap | pandas.DataFrame | string}
+    :param min_perc_answered: lowest percentage of answered 
+        questions for a respondent to be kept
+    :type min_perc_answered: float
+    :param mask_only: if True, return only the keep-mask
+    :type mask_only: bool
+    :return the table without the removed respondents, or the keep-mask
+    :rtype {numpy.ndarray | pandas.DataFrame}
+    '''
+    if isinstance(data, STRING_TYPES):
+        data = np.load(data, mmap_mode='r')
+    (respondent_percs, _question_percs) = perc_answered(data, missing_value, respondents, block_size)
+    keep = respondent_percs >= min_perc_answered
+    if mask_only:
+        return keep
+    if isinstance(data, pd.DataFrame):
+        return data.iloc[:, keep] if respondents == 'columns' else data.iloc[keep]
+    if respondents == 'columns':
+        return np.asarray(data[:, keep])
+    return np.asarray(data[keep])
+
+#-------------------------
+# respondent_distances 
+#----------------- 
+
+def respondent_distances(data,
+                         metric='euclidean',
+                         missing_value=np.nan,
+                         respondents='columns',
+                         categorical=None,
+                         block_size=DEFAULT_DISTANCE_BLOCK_SIZE,
+                         n_jobs=1,
+                         no_common_distance=None):
+    '''
+    Return the pairwise distances between respondents as 
+    the condensed vector that scipy.spatial.distance.pdist()
+    produces, and scipy.cluster.hierarchy.linkage() expects:
+    the distance between respondents i < j is at position
+    n*i - i*(i+1)/2 + (j-i-1). Each distance only considers 
+    the questions both respondents answered. Metrics are:
+    
+       'euclidean': euclidean distance over the common answers,
+                    scaled by sqrt(num questions / num common answers),
+                    so that it is comparable between pairs with 
+                    more or fewer common answers
+       'hamming':   fraction of common answers that differ; 
+                    answers are compared as categories
+       'gower':     mean over common answers of |a - b| / range 
+                    for numeric questions, and of 0 (same) or 
+                    1 (different) for categorical questions
+    
+    Pairs without common answers get no_common_distance.
+    By default, that is the largest distance: 1 for 'hamming'
+    and 'gower', and the largest distance between other 
+    pairs for 'euclidean'. scipy.cluster.hierarchy.linkage()
+    rejects NaN, so pass numpy.nan only to find such pairs.
+    
+    For 'gower', categorical gives the categorical questions, 
+    as a boolean array or a list of question indexes. By 
+    default, questions with any answer that is not a number
+    are categorical.
+    
+    Respondents are processed in blocks of rows, so that
+    no n x n intermediate is built. Euclidean blocks are
+    computed with matrix products, the others with block 
+    comparisons of at most block_size cells. With n_jobs 
+    > 1, a pool of threads computes the blocks; results 
+    are the same as with n_jobs=1.
+    
+    :param data: the table
+    :type data: {numpy.ndarray | numpy.memmap | pandas.DataFrame}
+    :param metric: 'euclidean', 'hamming', or 'gower'
+    :type metric: string
+    :param missing_value: the value that stands for 'value missing',
+        or a list, tuple, or set of such values
+    :type missing_value: ANY
+    :param respondents: 'columns' (as in unfold() output) or 'rows'
+    :type respondents: string
+    :param categorical: categorical questions for metric 'gower'
+    :type categorical: {None | numpy.ndarray | [bool] | [int]}
+    :param block_size: largest number of cells compared at a time
+    :type block_size: int
+    :param n_jobs: number of threads. If less than 1, one thread per CPU.
+    :type n_jobs: int
+    :param no_common_distance: distance of pairs without common answers
+    :type no_common_distance: {None | float}
+    :return condensed distance vector of length n*(n-1)/2
+    :rtype numpy.ndarray
+    '''
+    if metric not in DISTANCE_METRICS:
+        raise ValueError('Metric must be one of %s; was %s' % (DISTANCE_METRICS, metric))
+    if respondents not in ['columns', 'rows']:
+        raise ValueError("Respondents must be 'columns' or 'rows'; was %s" % respondents)
+    
+    (numeric, codes) = distance_features(data, metric, missing_value, respondents, categorical)
+    num_respondents = (numeric if numeric is not None else codes).shape[0]
+    num_questions = sum(features.shape[1] for features in (numeric, codes) if features is not None)
+    distances = np.empty(num_respondents * (num_respondents - 1) // 2)
+    
+    if metric == 'euclidean':
+        present = np.logical_not(np.isnan(numeric)).astype(float)
+        zeroed  = np.where(present, numeric, 0.)
+        squared = zeroed ** 2
+        def block_distances(rows1, rows2):
+            return euclidean_block(zeroed[rows1], squared[rows1], present[rows1],
+                                   zeroed[rows2], squared[rows2], present[rows2],
+                                   num_questions)
+    else:
+        ranges = None
+        if numeric is not None:
+            with warnings.catch_warnings():
+                # Questions nobody answered:
+                warnings.simplefilter('ignore', RuntimeWarning)
+                ranges = np.nanmax(numeric, axis=0) - np.nanmin(numeric, axis=0)
+            # Constant questions contribute no distance:
+            ranges[np.logical_not(ranges > 0)] = 1.
+        def block_distances(rows1, rows2):
+            return mismatch_block(None if numeric is None else numeric[rows1], 
+                                  None if codes is None else codes[rows1],
+                                  None if numeric is None else numeric[rows2], 
+                                  None if codes is None else codes[rows2],
+                                  ranges)
+    
+    rows_per_block = max(1, int(np.sqrt(block_size / max(1., num_questions))))
+    blocks = [slice(start, min(start + rows_per_block, num_respondents)) 
+              for start in range(0, num_respondents, rows_per_block)]
+    block_pairs = [(rows1, rows2) for (block_num, rows1) in enumerate(blocks) for rows2 in blocks[block_num:]]
+    
+    def fill_block(block_pair):
+        (rows1, rows2) = block_pair
+        condensed_block_write(distances, num_respondents, rows1, rows2, block_distances(rows1, rows2))
+    
+    if n_jobs == 1:
+        for block_pair in block_pairs:
+            fill_block(block_pair)
+    else:
+        # Each block pair writes its own part of the
+        # condensed vector:
+        pool = ThreadPool(n_jobs if n_jobs >= 1 else multiprocessing.cpu_count())
+        try:
+            pool.map(fill_block, block_pairs)
+        finally:
+            pool.close()
+            pool.join()
+    
+    no_common = np.isnan(distances)
+    if no_common.any():
+        if no_common_distance is None:
+            if metric != 'euclidean':
+                no_common_distance = 1.
+            elif no_common.all():
+                no_common_distance = 0.
+            else:
+                no_common_distance = distances[np.logical_not(no_common)].max()
+        distances[no_common] = no_common_distance
+    return distances
+
+#-------------------------
+# ward_linkage()
+#----------------- 
+
+def ward_linkage(data,
+                 respondents='columns',
+                 n_clusters=None,
+                 batch_size=DEFAULT_PRECLUSTER_BATCH_SIZE,
+                 max_iter=100,
+                 seed=None,
+                 return_assignments=False):
+    '''
+    Cluster respondents hierarchically with Ward's method, 
+    and return the linkage matrix in the form that 
+    scipy.cluster.hierarchy.linkage(X, 'ward') returns, 
+    ready for fancy_dendrogram(). Unlike linkage(), no
+    condensed distance matrix of n*(n-1)/2 distances is 
+    built: clusters are merged by the nearest-neighbor 
+    chain algorithm, which only keeps the centroids and
+    sizes of the current clusters. Memory is linear in
+    the number of respondents; time is quadratic.
+    
+    For still larger respondent sets, n_clusters turns
+    on two stages. Respondents are first grouped into 
+    n_clusters clusters by mini-batch k-means, using 
+    max_iter random batches of batch_size respondents.
+    The clusters are then merged by Ward's method, 
+    each weighted by its number of respondents. The 
+    leaves of the returned linkage matrix are those 
+    clusters, and its fourth column counts respondents,
+    so that contracted leaves of truncated dendrograms 
+    are labeled with their number of respondents.
+    
+    Answers must be numeric and complete; impute 
+    missing values first, e.g. with replaceMissingValsNparray().
+    
+        Z = ward_linkage(unfolded)
+        (Z, leaves) = ward_linkage(unfolded, n_clusters=2000, return_assignments=True)
+        fancy_dendrogram(Z, truncate_mode='lastp', p=30)
+    
+    :param data: the table
+    :type data: {numpy.ndarray | numpy.memmap | pandas.DataFrame}
+    :param respondents: 'columns' (as in unfold() output) or 'rows'
+    :type respondents: string
+    :param n_clusters: if given, number of clusters of the first stage
+    :type n_clusters: {None | int}
+    :param batch_size: respondents per mini-batch of the first stage
+    :type batch_size: int
+    :param max_iter: number of mini-batches of the first stage
+    :type max_iter: int
+    :param seed: seed of the first stage's random number generator
+    :type seed: {None | int}
+    :param return_assignments: if True, also return each 
+        respondent's leaf in the linkage matrix
+    :type return_assignments: bool
+    :return linkage matrix, or linkage matrix and leaf of each respondent
+    :rtype {numpy.ndarray | (numpy.ndarray, numpy.ndarray)}
+    '''
+    if respondents not in ['columns', 'rows']:
+        raise ValueError("Respondents must be 'columns' or 'rows'; was %s" % respondents)
+    if n_clusters is not None and n_clusters < 2:
+        raise ValueError('Need at least 2 clusters; was %s' % n_clusters)
+    
+    (answers, _codes) = distance_features(data, 'euclidean', np.nan, respondents, None)
+    if answers is None or len(answers) < 2:
+        raise ValueError('Need at least 2 respondents with answers to cluster')
+    if np.isnan(answers).any():
+        raise ValueError('Ward linkage needs complete answers; replace missing values first')
+    
+    if n_clusters is None or n_clusters >= len(answers):
+        assignments = np.arange(len(answers))
+        Z = nn_chain_ward(answers, np.ones(len(answers)))
+    else:
+        (centroids, weights, assignments) = minibatch_centroids(answers, n_clusters, batch_size, 
+                                                                max_iter, np.random.RandomState(seed))
+        if len(centroids) < 2:
+            raise ValueError('All respondents fell into one cluster; ward_linkage() needs at least 2')
+        Z = nn_chain_ward(centroids, weights)
+    if return_assignments:
+        return (Z, assignments)
+    return Z
@@ -3,18 +3,71 @@ Created on May 22, 2016
 
 @author: paepcke
 '''
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 from unittest import skipIf
 
 import numpy as np
 import pandas as pn
 
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    # Windows:
+    resource = None
+try:
+    from scipy import sparse
+    from scipy.cluster import hierarchy
+    from scipy.spatial import distance
+except ImportError:
+    sparse = None
+    distance = None
+
 from survey_utils.math_utils.math_utils import replaceMissingValsNparray, replaceMissingValsDataFrame
-from survey_utils.math_utils.math_utils import replace_matches, non_matches
+from survey_utils.math_utils.math_utils import replace_matches, non_matches, match_mask
+from survey_utils.math_utils.math_utils import QuantileSketch, build_sketches
+from survey_utils.math_utils.math_utils import MissingValsImputer
 from survey_utils.math_utils import math_utils
 
 DO_ALL = True
 
+# Run by test_nparray_memory() in a child process; prints
+# how far the call raised the process' peak resident set.
+# ru_maxrss starts out at the parent's peak, so on Linux 
+# VmHWM, which starts afresh, is read instead:
+MEMORY_PROBE = '''
+import resource
+import numpy as np
+from survey_utils.math_utils.math_utils import replaceMissingValsNparray
+
+def peak_rss():
+    try:
+        with open('/proc/self/status') as fd:
+            return int([line for line in fd if line.startswith('VmHWM:')][0].split()[1])
+    except (IOError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+np.random.seed(4711)
+# Filled row by row, so that no full-size temporaries
+# raise the peak before the call:
+arr = np.empty((4000, 2000), dtype=np.float32)
+for row in arr:
+    row[:] = np.random.randint(1, 100, size=len(row))
+    row[np.random.random(len(row)) < 0.1] = 0
+before = peak_rss()
+replaceMissingValsNparray(arr, missing_value=0, **%r)
+print(peak_rss() - before)
+'''
+
 class TestMathUtils(unittest.TestCase):
 
 
@@ -113,6 +166,301 @@ class TestMathUtils(unittest.TestCase):
                                         missing_value=0)
         self.assertTrue(np.array_equal(self.arr_mean_by_row, res))
         
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_nparray_replace_matches_per_vector(self):
+        # Compare with replacing one vector at a time:
+        np.random.seed(4711)
+        arr = np.random.randint(0, 5, size=(50, 30)).astype(float)
+        # An all-missing column:
+        arr[:,7] = 0
+        for direction in ['column', 'row']:
+            for replacement in ['median', 'mean']:
+                expected = arr.copy()
+                vectors = expected.T if direction == 'column' else expected
+                for vec in vectors:
+                    if replacement == 'median':
+                        replacement_value = np.median(non_matches(vec, 0)) if np.any(vec != 0) else np.nan
+                    else:
+                        replacement_value = np.mean(non_matches(vec, 0)) if np.any(vec != 0) else np.nan
+                    replace_matches(vec, 0, replacement_value)
+                res = replaceMissingValsNparray(arr.copy(), 
+                                                direction=direction,
+                                                replacement=replacement,
+                                                missing_value=0)
+                self.assertTrue(np.allclose(expected, res, equal_nan=True))
+                
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_nparray_replace_in_place(self):
+        res = replaceMissingValsNparray(self.arr_nan, direction='column')
+        self.assertTrue(res is self.arr_nan)
+        self.assertTrue(np.array_equal(self.arr_median_by_col, self.arr_nan))
+        
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_nparray_several_missing_values(self):
+        arr = np.array([[ 1,   2,  3, 13],
+                        [ 4,   0,  6, 14],
+                        [-99,  8,  9, 15],
+                        [10,  11, np.nan, 16]])
+        expected = np.array([[ 1,   2,  3, 13],
+                             [ 4,   8,  6, 14],
+                             [ 4,   8,  9, 15],
+                             [10,  11,  6, 16]])
+        res = replaceMissingValsNparray(arr.copy(), 
+                                        direction='column',
+                                        replacement='median',
+                                        missing_value=[0, -99, np.nan, 'refused'])
+        self.assertTrue(np.array_equal(expected, res))
+        
+        # Mask returned by one call is reused by the next:
+        (res, mask) = replaceMissingValsNparray(arr.copy(), 
+                                                missing_value=(0, -99, np.nan),
+                                                return_mask=True)
+        self.assertTrue(np.array_equal(expected, res))
+        self.assertEqual(3, mask.sum())
+        res = replaceMissingValsNparray(arr.copy(), replacement='mean', mask=mask, block_size=4)
+        self.assertTrue(np.array_equal([7, 5, 6], res[mask]))
+        
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_nparray_preserve_dtype(self):
+        np.random.seed(4711)
+        arr = np.random.randint(1, 100, size=(200, 6)).astype(np.float32)
+        arr[np.random.random(arr.shape) < 0.2] = 0
+        for replacement in ['median', 'mean']:
+            for direction in ['column', 'row']:
+                expected = replaceMissingValsNparray(arr.astype(float), direction=direction, 
+                                                     replacement=replacement, missing_value=0)
+                res = replaceMissingValsNparray(arr.copy(), direction=direction, replacement=replacement, 
+                                                missing_value=0, preserve_dtype=True)
+                self.assertEqual(np.float32, res.dtype)
+                self.assertTrue(np.allclose(expected, res))
+        stats = math_utils.vector_stats(arr, arr == 0, 0, 'mean', arr.dtype)
+        self.assertEqual(np.float32, stats.dtype)
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_nparray_scratch(self):
+        np.random.seed(4711)
+        arr = np.random.randint(1, 100, size=(301, 7)).astype(float)
+        arr[np.random.random(arr.shape) < 0.2] = np.nan
+        arr[:, 3] = np.nan
+        for replacement in ['median', 'mean']:
+            for direction in ['column', 'row']:
+                expected = replaceMissingValsNparray(arr.copy(), direction=direction, replacement=replacement)
+                for block_size in [None, 500]:
+                    res = replaceMissingValsNparray(arr.copy(), direction=direction, replacement=replacement,
+                                                    block_size=block_size, scratch=True)
+                    self.assertTrue(np.array_equal(np.isnan(expected), np.isnan(res)))
+                    self.assertTrue(np.array_equal(expected[~np.isnan(expected)], res[~np.isnan(res)]))
+        # Several missing values, and integers:
+        arr = self.arr.copy()
+        arr[2, 2] = -99
+        res = replaceMissingValsNparray(arr, missing_value=[0, -99], block_size=5, scratch=True)
+        self.assertTrue(np.array_equal([[1, 2, 3, 13], [4, 8, 6, 14], [4, 8, 6, 15], [10, 11, 12, 16]], res))
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_nparray_int_rounding(self):
+        arr = np.array([[ 1, -1],
+                        [ 0,  0],
+                        [ 2, -2],
+                        [ 2, -2]])
+        # Column means are 5/3 and -5/3:
+        for (int_rounding, expected) in [('truncate', [1, -1]),
+                                         ('round', [2, -2]),
+                                         ('floor', [1, -2]),
+                                         ('ceil', [2, -1])]:
+            for block_size in [None, 4]:
+                res = replaceMissingValsNparray(arr.copy(), replacement='mean', missing_value=0,
+                                                block_size=block_size, int_rounding=int_rounding)
+                self.assertEqual(expected, list(res[1]))
+            res = replaceMissingValsNparray(arr.copy(), replacement='mean', missing_value=0,
+                                            n_jobs=2, int_rounding=int_rounding)
+            self.assertEqual(expected, list(res[1]))
+        frm = pn.DataFrame(arr, columns=['a', 'b'])
+        replaceMissingValsDataFrame(frm, replacement='mean', missing_value=0, int_rounding='round')
+        self.assertEqual([2, -2], list(frm.iloc[1]))
+        with self.assertRaises(ValueError):
+            replaceMissingValsNparray(arr, int_rounding='nearest')
+
+    @skipIf(tracemalloc is None and resource is None, 'neither tracemalloc nor resource available.')
+    def test_nparray_memory(self):
+        
+        def peak_mem(**kwargs):
+            if tracemalloc is not None:
+                np.random.seed(4711)
+                arr = np.random.randint(1, 100, size=(1000, 500)).astype(np.float32)
+                arr[np.random.random(arr.shape) < 0.1] = 0
+                tracemalloc.start()
+                try:
+                    replaceMissingValsNparray(arr, missing_value=0, **kwargs)
+                    return tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+            # Without tracemalloc (Python 2), the growth of the peak 
+            # resident set is measured. That peak covers the whole 
+            # process, so each call runs in a fresh child process,
+            # on an array large enough to dwarf allocator noise:
+            env = dict(os.environ, 
+                       PYTHONPATH=os.path.join(os.path.dirname(math_utils.__file__), '..', '..'))
+            return int(subprocess.check_output([sys.executable, '-c', MEMORY_PROBE % kwargs], env=env))
+        
+        upcast_peak = peak_mem()
+        preserved_peak = peak_mem(preserve_dtype=True)
+        scratch_peak = peak_mem(preserve_dtype=True, scratch=True, block_size=50000)
+        # float32 copies take half the memory of float64 ones:
+        self.assertLess(preserved_peak, 0.6 * upcast_peak)
+        # Blocks of 100 columns share one buffer:
+        self.assertLess(scratch_peak, 0.2 * preserved_peak)
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_match_mask(self):
+        self.assertTrue(np.array_equal([[False, False], [True, True]], 
+                                       match_mask(np.array([[1, 2], [0, np.nan]]), {0, np.nan})))
+        # Non-numeric missing value in a numeric array:
+        self.assertFalse(match_mask(self.arr, 'refused').any())
+        # ... and in an object array:
+        self.assertTrue(np.array_equal([False, True], 
+                                       match_mask(np.array([1, 'refused'], dtype=object), 'refused')))
+        # ... together with NaN and None:
+        mixed = np.array([[1., 'refused'], [np.nan, None]], dtype=object)
+        self.assertTrue(np.array_equal([[False, True], [True, True]], 
+                                       match_mask(mixed, [np.nan, 'refused'])))
+        self.assertTrue(np.array_equal([[True, False], [False, False]], match_mask(mixed, 1)))
+        out = np.ones((2, 2), dtype=bool)
+        self.assertTrue(match_mask(mixed, 'refused', out=out) is out)
+        self.assertTrue(np.array_equal([[False, True], [False, False]], out))
+        
+        # Object tables with such missing values are imputed:
+        table = np.array([[1, 'refused', 3.],
+                          [np.nan, 4, 5.],
+                          [3, 8, 'refused']], dtype=object)
+        for (block_size, scratch) in [(None, False), (2, True)]:
+            res = replaceMissingValsNparray(table.copy(), replacement='mean', block_size=block_size,
+                                            missing_value=[np.nan, 'refused'], scratch=scratch)
+            self.assertTrue(np.array_equal([[1, 6, 3], [2, 4, 5], [3, 8, 4]], res.astype(float)))
+        
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_nparray_blockwise(self):
+        np.random.seed(4711)
+        arr = np.random.randint(0, 5, size=(40, 25)).astype(float)
+        # Blocks follow the memory layout where they can:
+        for order in ['C', 'F']:
+            for direction in ['column', 'row']:
+                for replacement in ['median', 'mean']:
+                    expected = replaceMissingValsNparray(arr.copy(), direction, replacement, missing_value=0)
+                    for scratch in [False, True]:
+                        # Blocks of three vectors:
+                        res = replaceMissingValsNparray(arr.copy(order), direction, replacement, 
+                                                        missing_value=0, block_size=3*40, scratch=scratch)
+                        self.assertTrue(np.array_equal(expected, res))
+                        # Block size smaller than one vector:
+                        res = replaceMissingValsNparray(arr.copy(order), direction, replacement, 
+                                                        missing_value=0, block_size=1, scratch=scratch)
+                        self.assertTrue(np.array_equal(expected, res))
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_nparray_parallel(self):
+        np.random.seed(4711)
+        arr = np.random.normal(size=(3000, 45))
+        arr[np.random.random(arr.shape) < 0.1] = np.nan
+        for direction in ['column', 'row']:
+            for replacement in ['median', 'mean', 'approx_median']:
+                for block_size in [None, 20000]:
+                    serial = replaceMissingValsNparray(arr.copy(), direction, replacement, 
+                                                       block_size=block_size, sketch_error=0.05)
+                    parallel = replaceMissingValsNparray(arr.copy(), direction, replacement, 
+                                                         block_size=block_size, sketch_error=0.05,
+                                                         n_jobs=3)
+                    # Sums over differently sized blocks may 
+                    # differ in their last bits:
+                    self.assertTrue(np.allclose(serial, parallel))
+        # One thread per CPU:
+        res = replaceMissingValsNparray(self.arr, missing_value=0, n_jobs=-1)
+        self.assertTrue(np.array_equal(self.arr_median_by_col, res))
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_nparray_memmap(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            npy_path = os.path.join(tmp_dir, 'arr.npy')
+            np.save(npy_path, self.arr_nan)
+            
+            # From a path:
+            res = replaceMissingValsNparray(npy_path, direction='column', block_size=8)
+            self.assertTrue(isinstance(res, np.memmap))
+            del res
+            self.assertTrue(np.array_equal(self.arr_median_by_col, np.load(npy_path)))
+            
+            # From an existing memmap:
+            np.save(npy_path, self.arr_nan)
+            mm = np.load(npy_path, mmap_mode='r+')
+            replaceMissingValsNparray(mm, direction='row', replacement='mean')
+            del mm
+            self.assertTrue(np.array_equal(self.arr_mean_by_row, np.load(npy_path)))
+            
+            # From a unicode path, with the column means 
+            # accumulated over blocks of two rows:
+            np.save(npy_path, self.arr_nan)
+            res = replaceMissingValsNparray(u'%s' % npy_path, direction='column', replacement='mean', 
+                                            block_size=8)
+            del res
+            self.assertTrue(np.array_equal(self.arr_mean_by_col, np.load(npy_path)))
+        finally:
+            shutil.rmtree(tmp_dir)
+        
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_nparray_approx_median(self):
+        # Small vectors are summarized exactly:
+        res = replaceMissingValsNparray(self.arr, 
+                                        direction='column',
+                                        replacement='approx_median',
+                                        missing_value=0)
+        self.assertTrue(np.array_equal(self.arr_median_by_col, res))
+        
+        np.random.seed(4711)
+        arr = np.random.normal(size=(20000, 3))
+        arr[np.random.random(arr.shape) < 0.1] = np.nan
+        exact = replaceMissingValsNparray(arr.copy(), replacement='median')
+        approx = replaceMissingValsNparray(arr.copy(), replacement='approx_median',
+                                           sketch_error=0.01, block_size=3000)
+        for col in range(3):
+            present = np.sort(arr[:,col][np.logical_not(np.isnan(arr[:,col]))])
+            median_pos = np.searchsorted(present, exact[np.isnan(arr[:,col]), col][0])
+            approx_pos = np.searchsorted(present, approx[np.isnan(arr[:,col]), col][0])
+            self.assertTrue(abs(median_pos - approx_pos) <= 0.01 * len(present))
+            
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_quantile_sketch(self):
+        np.random.seed(4711)
+        values = np.random.exponential(size=100000)
+        sorted_values = np.sort(values)
+        sketch = QuantileSketch(error=0.01, seed=1)
+        for chunk in np.array_split(values, 37):
+            sketch.update(chunk)
+        self.assertEqual(100000, len(sketch))
+        # Memory independent of number of values:
+        self.assertTrue(sum(len(items) for items in sketch.compactors) < 2000)
+        for q in [0.1, 0.5, 0.9]:
+            rank = np.searchsorted(sorted_values, sketch.quantile(q))
+            self.assertTrue(abs(rank - q * len(values)) <= 0.01 * len(values))
+            
+        # Merging sketches of two halves:
+        sketch1 = QuantileSketch(error=0.01, seed=2).update(values[:60000])
+        sketch2 = QuantileSketch(error=0.01, seed=3).update(values[60000:])
+        merged = sketch1.merge(sketch2)
+        self.assertEqual(100000, len(merged))
+        rank = np.searchsorted(sorted_values, merged.median())
+        self.assertTrue(abs(rank - 50000) <= 0.01 * len(values))
+        
+        self.assertTrue(np.isnan(QuantileSketch().median()))
+        with self.assertRaises(ValueError):
+            QuantileSketch(error=0)
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_build_sketches(self):
+        sketches = build_sketches(self.arr_nan, direction='row', block_size=2)
+        self.assertEqual(4, len(sketches))
+        self.assertEqual([2.5, 6., 8.5, 11.5], [sketch.median() for sketch in sketches])
+        self.assertEqual(3, len(sketches[1]))
+
     # ------------  TestMathUtils DataFrame Missing Values Replacement --------------
 
     @skipIf(DO_ALL != True, 'skip this one.')
@@ -154,6 +502,406 @@ class TestMathUtils(unittest.TestCase):
                                           replacement='mean')
         self.assertTrue(np.array_equal(self.arr_mean_by_row, res))
 
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_frame_mixed_dtypes(self):
+        frm = pn.DataFrame({'a' : [1, 4, 4, 10],
+                            'b' : [2., np.nan, 8., 11.],
+                            'c' : [3, 6, 9, 12],
+                            'name' : ['w', 'x', 'y', 'z']},
+                           columns=['a', 'b', 'c', 'name'])
+        res = replaceMissingValsDataFrame(frm, direction='column', replacement='median')
+        self.assertTrue(res is frm)
+        self.assertEqual(8., frm['b'][1])
+        self.assertEqual(['w', 'x', 'y', 'z'], list(frm['name']))
+        self.assertEqual(np.int64, frm['a'].dtype)
+        
+        frm.loc[1, 'b'] = np.nan
+        # Filled in the frame's own arrays, so views 
+        # taken before see the new values:
+        views = dict((tuple(col_positions), values) 
+                     for (col_positions, values) in math_utils.numeric_blocks(frm))
+        replaceMissingValsDataFrame(frm, direction='row', replacement='mean')
+        # Mean of 4 and 6 from the int columns:
+        self.assertEqual(5., frm['b'][1])
+        self.assertEqual(5., views[(1,)][1, 0])
+        self.assertEqual(np.int64, frm['c'].dtype)
+        self.assertEqual(['w', 'x', 'y', 'z'], list(frm['name']))
+
+    # ------------  TestMathUtils Grouped Replacement --------------
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_nparray_grouped_replace(self):
+        np.random.seed(4711)
+        arr = np.random.randint(1, 100, size=(300, 4)).astype(float)
+        arr[np.random.random(arr.shape) < 0.2] = np.nan
+        groups = np.random.choice(['a', 'b', 'c'], size=300)
+        for replacement in ['median', 'mean']:
+            res = math_utils.replaceMissingValsGroupedNparray(arr.copy(), groups, replacement=replacement)
+            for group in ['a', 'b', 'c']:
+                expected = replaceMissingValsNparray(arr[groups == group], replacement=replacement)
+                self.assertTrue(np.allclose(expected, res[groups == group]))
+                
+        # Example from the docstring, plus rows without group:
+        arr = np.array([[ 1,  2],
+                        [ 0,  4],
+                        [10, 20],
+                        [30,  0],
+                        [ 0,  0]])
+        res = math_utils.replaceMissingValsGroupedNparray(arr, ['a', 'a', 'b', 'b', None],
+                                                          replacement='mean', missing_value=0)
+        self.assertTrue(res is arr)
+        self.assertTrue(np.array_equal([[1, 2], [1, 4], [10, 20], [30, 20], [0, 0]], arr))
+        
+        # Group without any values in a column stays missing:
+        arr = np.array([[np.nan, 1.], [2., 3.], [4., np.nan]])
+        math_utils.replaceMissingValsGroupedNparray(arr, [1, 2, 2])
+        self.assertTrue(np.isnan(arr[0, 0]))
+        self.assertEqual(3., arr[2, 1])
+        
+        with self.assertRaises(ValueError):
+            math_utils.replaceMissingValsGroupedNparray(arr, [1, 2])
+        with self.assertRaises(ValueError):
+            math_utils.replaceMissingValsGroupedNparray(arr, [1, 2, 2], replacement='approx_median')
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_frame_grouped_replace(self):
+        frm = pn.DataFrame({'country' : ['us', 'us', 'us', 'de', 'de'],
+                            'age'     : [20, 0, 40, 0, 50],
+                            'score'   : [1., 3., np.nan, np.nan, 7.]},
+                           columns=['country', 'age', 'score'])
+        res = math_utils.replaceMissingValsGroupedDataFrame(frm, 'country', missing_value=[0, np.nan])
+        self.assertTrue(res is frm)
+        self.assertEqual([20, 30, 40, 50, 50], list(frm['age']))
+        self.assertEqual(np.int64, frm['age'].dtype)
+        self.assertEqual([1., 3., 2., 7., 7.], list(frm['score']))
+        self.assertEqual(['us', 'us', 'us', 'de', 'de'], list(frm['country']))
+        
+        # Numeric group column amid the int columns, 
+        # which pandas holds in one array:
+        frm = pn.DataFrame({'age'    : [20, 0, 40, 0, 50],
+                            'region' : [1, 1, 1, 2, 2],
+                            'size'   : [3, 5, 0, 2, 0]},
+                           columns=['age', 'region', 'size'])
+        math_utils.replaceMissingValsGroupedDataFrame(frm, 'region', replacement='mean', missing_value=0)
+        self.assertEqual([20, 30, 40, 50, 50], list(frm['age']))
+        self.assertEqual([1, 1, 1, 2, 2], list(frm['region']))
+        self.assertEqual([3, 5, 4, 2, 2], list(frm['size']))
+
+    # ------------  TestMathUtils Sparse --------------
+
+    @skipIf(DO_ALL != True or sparse is None, 'skip this one.')
+    def test_sparse_implicit_missing(self):
+        np.random.seed(4711)
+        dense = np.random.randint(-50, 50, size=(40, 9)).astype(float)
+        dense[np.random.random(dense.shape) < 0.6] = np.nan
+        dense[:, 4] = np.nan
+        dense[3, 2] = 0.
+        stored = np.logical_not(np.isnan(dense))
+        matrix = sparse.csr_matrix((dense[stored], np.nonzero(stored)), shape=dense.shape)
+        
+        for replacement in ['median', 'mean']:
+            for direction in ['column', 'row']:
+                expected = replaceMissingValsNparray(dense.copy(), direction=direction, replacement=replacement)
+                res = math_utils.replaceMissingValsSparse(matrix, direction=direction, replacement=replacement)
+                self.assertTrue(np.allclose(expected, res, equal_nan=True))
+                imputation = math_utils.replaceMissingValsSparse(matrix, direction=direction, 
+                                                                 replacement=replacement, densify=False)
+                self.assertEqual(matrix.nnz, imputation.values.nnz)
+                self.assertTrue(imputation.missing is None)
+                self.assertTrue(np.allclose(expected, imputation.toarray(), equal_nan=True))
+        
+        # Stored zero is a value, not missing:
+        self.assertEqual(0., math_utils.replaceMissingValsSparse(matrix)[3, 2])
+        
+    @skipIf(DO_ALL != True or sparse is None, 'skip this one.')
+    def test_sparse_sentinel(self):
+        np.random.seed(4711)
+        dense = np.random.randint(-5, 20, size=(30, 6)).astype(float)
+        dense[np.random.random(dense.shape) < 0.5] = 0
+        dense[np.random.random(dense.shape) < 0.2] = -99
+        matrix = sparse.csc_matrix(dense)
+        
+        for replacement in ['median', 'mean']:
+            for direction in ['column', 'row']:
+                for missing_value in [-99, [0, -99]]:
+                    expected = replaceMissingValsNparray(dense.copy(), direction=direction, 
+                                                         replacement=replacement, missing_value=missing_value)
+                    res = replaceMissingValsNparray(matrix, direction=direction, 
+                                                    replacement=replacement, missing_value=missing_value)
+                    self.assertTrue(np.allclose(expected, res, equal_nan=True))
+        
+        imputation = math_utils.replaceMissingValsSparse(matrix, missing_value=-99, densify=False)
+        self.assertEqual(np.count_nonzero(dense == -99), imputation.missing.nnz)
+        self.assertEqual(np.count_nonzero(np.logical_and(dense != 0, dense != -99)), imputation.values.nnz)
+        
+        # Integer matrix, median of [1, 0, 0]:
+        matrix = sparse.coo_matrix(np.array([[1, 2], [-1, 0], [0, 0], [0, 4]]))
+        res = math_utils.replaceMissingValsSparse(matrix, missing_value=-1)
+        self.assertTrue(np.array_equal([[1, 2], [0, 0], [0, 0], [0, 4]], res))
+        
+        with self.assertRaises(ValueError):
+            math_utils.replaceMissingValsSparse(matrix, replacement='approx_median')
+        
+        # Through replaceMissingValsNparray(), with the mask of missing values:
+        matrix = sparse.csr_matrix(np.array([[1., 0], [0, 4], [3, 2]]))
+        for (missing_value, expected_mask) in [(None, [[False, True], [True, False], [False, False]]),
+                                               (2, [[False, False], [False, False], [False, True]])]:
+            (res, mask) = replaceMissingValsNparray(matrix, missing_value=missing_value, return_mask=True)
+            self.assertTrue(np.array_equal(expected_mask, mask))
+            self.assertTrue(np.array_equal(replaceMissingValsNparray(matrix.toarray(), mask=mask), res))
+        for kwargs in [{'block_size' : 4}, {'n_jobs' : 2}, {'mask' : mask}, {'preserve_dtype' : True},
+                       {'scratch' : True}, {'int_rounding' : 'round'}]:
+            with self.assertRaises(ValueError):
+                replaceMissingValsNparray(matrix, **kwargs)
+
+    # ------------  TestMathUtils Distances --------------
+
+    def naive_distances(self, rows, metric, categorical=None):
+        # One pair at a time, for comparison:
+        num_questions = rows.shape[1]
+        if categorical is None:
+            categorical = [metric == 'hamming'] * num_questions
+        numeric_cols = [col for col in range(num_questions) if not categorical[col]]
+        ranges = {}
+        for col in numeric_cols:
+            values = [val for val in rows[:, col] if not pn.isnull(val)]
+            ranges[col] = (max(values) - min(values)) or 1.
+        distances = []
+        for i in range(len(rows)):
+            for j in range(i + 1, len(rows)):
+                common = [col for col in range(num_questions) 
+                          if not pn.isnull(rows[i, col]) and not pn.isnull(rows[j, col])]
+                if len(common) == 0:
+                    distances.append(np.nan)
+                elif metric == 'euclidean':
+                    sum_squares = sum((rows[i, col] - rows[j, col])**2 for col in common)
+                    distances.append(np.sqrt(sum_squares * num_questions / float(len(common))))
+                else:
+                    dissimilarity = sum(float(rows[i, col] != rows[j, col]) if categorical[col] 
+                                        else abs(rows[i, col] - rows[j, col]) / ranges[col]
+                                        for col in common)
+                    distances.append(dissimilarity / len(common))
+        return np.array(distances)
+
+    @skipIf(DO_ALL != True or distance is None, 'skip this one.')
+    def test_respondent_distances(self):
+        np.random.seed(4711)
+        # Five questions (rows) of 23 respondents (columns):
+        unfolded = np.random.randint(1, 6, size=(5, 23)).astype(float)
+        
+        # Without missing values, as scipy computes them:
+        for metric in ['euclidean', 'hamming']:
+            res = math_utils.respondent_distances(unfolded, metric=metric)
+            self.assertTrue(np.allclose(distance.pdist(unfolded.T, metric), res))
+        
+        unfolded[np.random.random(unfolded.shape) < 0.3] = np.nan
+        # Respondent without answers:
+        unfolded[:, 7] = np.nan
+        for metric in ['euclidean', 'hamming', 'gower']:
+            expected = self.naive_distances(unfolded.T, metric)
+            for (block_size, n_jobs) in [(math_utils.DEFAULT_DISTANCE_BLOCK_SIZE, 1), (20, 1), (45, 3)]:
+                res = math_utils.respondent_distances(unfolded, metric=metric, no_common_distance=np.nan,
+                                                      block_size=block_size, n_jobs=n_jobs)
+                self.assertEqual(23 * 22 // 2, len(res))
+                self.assertTrue(np.allclose(expected, res, equal_nan=True))
+            # Respondents as rows:
+            res = math_utils.respondent_distances(unfolded.T, metric=metric, respondents='rows', 
+                                                  no_common_distance=np.nan)
+            self.assertTrue(np.allclose(expected, res, equal_nan=True))
+            # By default, pairs without common answers are
+            # farthest apart, and the result can be clustered:
+            res = math_utils.respondent_distances(unfolded, metric=metric)
+            largest = 1. if metric != 'euclidean' else np.nanmax(expected)
+            self.assertTrue(np.allclose(np.where(np.isnan(expected), largest, expected), res))
+            self.assertEqual((22, 4), hierarchy.linkage(res, 'average').shape)
+            self.assertTrue(np.allclose(np.where(np.isnan(expected), 7., expected), 
+                                        math_utils.respondent_distances(unfolded, metric=metric, 
+                                                                        no_common_distance=7.)))
+        
+        with self.assertRaises(ValueError):
+            math_utils.respondent_distances(unfolded, metric='cosine')
+
+    @skipIf(DO_ALL != True or distance is None, 'skip this one.')
+    def test_respondent_distances_gower(self):
+        frm = pn.DataFrame({'age'    : [20, 30, np.nan, 60],
+                            'gender' : ['F', None, 'F', 'M'],
+                            'score'  : [1., 1., 3., -99]},
+                           columns=['age', 'gender', 'score'])
+        rows = frm.values.copy()
+        rows[3, 2] = np.nan
+        expected = self.naive_distances(rows, 'gower', categorical=[False, True, False])
+        res = math_utils.respondent_distances(frm, metric='gower', respondents='rows', 
+                                              missing_value=[np.nan, -99])
+        self.assertTrue(np.allclose(expected, res))
+        # Answers coded as numbers, declared categorical:
+        frm['gender'] = [1, np.nan, 1, 2]
+        res = math_utils.respondent_distances(frm, metric='gower', respondents='rows', 
+                                              missing_value=[np.nan, -99], categorical=[1])
+        self.assertTrue(np.allclose(expected, res))
+        # Numeric question with a string as missing value:
+        frm['score'] = pn.Series([1., 1., 3., 'refused'], dtype=object)
+        res = math_utils.respondent_distances(frm, metric='gower', respondents='rows', 
+                                              missing_value=[np.nan, 'refused'], categorical=[1])
+        self.assertTrue(np.allclose(expected, res))
+        # Usable for clustering:
+        self.assertEqual((3, 4), hierarchy.linkage(res, 'average').shape)
+
+    @skipIf(DO_ALL != True or distance is None, 'skip this one.')
+    def test_ward_linkage(self):
+        np.random.seed(4711)
+        # Four questions (rows) of 150 respondents (columns):
+        unfolded = np.random.random((4, 150))
+        expected = hierarchy.linkage(unfolded.T, 'ward')
+        for (data, respondents) in [(unfolded, 'columns'), 
+                                    (pn.DataFrame(unfolded.T), 'rows')]:
+            Z = math_utils.ward_linkage(data, respondents=respondents)
+            self.assertTrue((expected[:, [0, 1, 3]] == Z[:, [0, 1, 3]]).all())
+            self.assertTrue(np.allclose(expected[:, 2], Z[:, 2]))
+        # No fewer respondents than first-stage clusters:
+        (Z, leaves) = math_utils.ward_linkage(unfolded, n_clusters=500, return_assignments=True)
+        self.assertTrue(np.allclose(expected, Z))
+        self.assertTrue((np.arange(150) == leaves).all())
+        
+        # Two stages, on three groups of respondents:
+        respondents = np.concatenate([np.random.normal(center, 0.1, size=(1000, 3)) for center in range(3)])
+        (Z, leaves) = math_utils.ward_linkage(respondents, respondents='rows', n_clusters=50, 
+                                              batch_size=200, seed=4711, return_assignments=True)
+        self.assertTrue(hierarchy.is_valid_linkage(Z))
+        self.assertEqual(3000, len(leaves))
+        self.assertEqual(len(Z) + 1, len(np.unique(leaves)))
+        # Leaves are weighted by their number of respondents:
+        self.assertEqual(3000, Z[-1, 3])
+        groups = hierarchy.fcluster(Z, 3, 'maxclust')[leaves]
+        for group_start in [0, 1000, 2000]:
+            self.assertEqual(1, len(np.unique(groups[group_start:group_start + 1000])))
+        self.assertEqual(3, len(np.unique(groups)))
+        # Same seed, same clusters:
+        self.assertTrue(np.array_equal(Z, math_utils.ward_linkage(respondents, respondents='rows', n_clusters=50, 
+                                                                   batch_size=200, seed=4711)))
+        
+        unfolded[1, 7] = np.nan
+        with self.assertRaises(ValueError):
+            math_utils.ward_linkage(unfolded)
+        with self.assertRaises(ValueError):
+            math_utils.ward_linkage(respondents, respondents='questions')
+
+    # ------------  TestMathUtils Imputer --------------
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_imputer_fit_transform(self):
+        imputer = MissingValsImputer(replacement='median', missing_value=0)
+        imputer.fit(self.arr)
+        self.assertTrue(np.array_equal([4, 8, 7.5, 14.5], imputer.statistics))
+        batch = np.array([[0, 1, 0, 1],
+                          [1, 0, 1, 1]])
+        res = imputer.transform(batch)
+        self.assertTrue(res is batch)
+        self.assertTrue(np.array_equal([[4, 1, 7, 1],
+                                        [1, 8, 1, 1]], batch))
+        
+        imputer = MissingValsImputer(replacement='mean', missing_value=0)
+        res = imputer.fit_transform(self.arr)
+        self.assertTrue(np.array_equal(self.arr_mean_by_col, res))
+        
+        with self.assertRaises(ValueError):
+            imputer.transform(np.zeros((2, 3)))
+        with self.assertRaises(ValueError):
+            MissingValsImputer().transform(self.arr)
+        with self.assertRaises(ValueError):
+            MissingValsImputer(replacement='mode')
+        with self.assertRaises(ValueError):
+            MissingValsImputer(int_rounding='nearest')
+            
+        # Integer columns are filled as by the functions.
+        # Column means are 7/3 and 13/3:
+        arr = np.array([[1, 0], [2, 5], [0, 6], [4, 2]])
+        for int_rounding in ['truncate', 'round', 'floor', 'ceil']:
+            imputer = MissingValsImputer(replacement='mean', missing_value=0, int_rounding=int_rounding)
+            expected = replaceMissingValsNparray(arr.copy(), replacement='mean', missing_value=0, 
+                                                 int_rounding=int_rounding)
+            self.assertTrue(np.array_equal(expected, imputer.fit_transform(arr.copy())))
+            frm = pn.DataFrame(arr.copy())
+            self.assertTrue(np.array_equal(expected, imputer.fit_transform(frm).values))
+        self.assertEqual([3, 5], [expected[2, 0], expected[0, 1]])
+        
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_imputer_partial_fit(self):
+        np.random.seed(4711)
+        arr = np.random.randint(1, 100, size=(1000, 5)).astype(float)
+        arr[np.random.random(arr.shape) < 0.2] = np.nan
+        
+        imputer = MissingValsImputer(replacement='mean')
+        for batch in np.array_split(arr, 7):
+            imputer.partial_fit(batch)
+        self.assertTrue(np.allclose(np.nanmean(arr, axis=0), imputer.statistics))
+        
+        # Few enough values for exact medians:
+        imputer = MissingValsImputer(replacement='median')
+        for batch in np.array_split(arr[:50], 3):
+            imputer.partial_fit(batch)
+        self.assertTrue(np.array_equal(np.nanmedian(arr[:50], axis=0), imputer.statistics))
+        
+        with self.assertRaises(ValueError):
+            imputer.partial_fit(arr[:, :3])
+            
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_imputer_frame(self):
+        imputer = MissingValsImputer(replacement='median')
+        frm = self.frm_nan.copy()
+        frm['name'] = ['w', 'x', 'y', 'z']
+        imputer.fit(frm)
+        self.assertEqual([0, 1, 2, 3], imputer.columns)
+        # Columns in different order:
+        batch = pn.DataFrame({1 : [np.nan, 1.], 0 : [2., 3.]}, columns=[1, 0])
+        imputer.transform(batch)
+        self.assertEqual([8., 1.], list(batch[1]))
+        
+        with self.assertRaises(ValueError):
+            imputer.transform(pn.DataFrame({'foo' : [1., np.nan]}))
+            
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_imputer_save_load(self):
+        imputer = MissingValsImputer(replacement='mean', missing_value=0).fit(self.arr)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'imputer.json')
+            imputer.save(path)
+            restored = MissingValsImputer.load(path)
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEqual('mean', restored.replacement)
+        self.assertEqual(0, restored.missing_value)
+        self.assertTrue(np.allclose(imputer.statistics, restored.statistics))
+        self.assertTrue(np.array_equal(self.arr_mean_by_col, restored.transform(self.arr)))
+        
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_imputer_save_load_partial_fit(self):
+        np.random.seed(4711)
+        arr = np.random.randint(0, 100, size=(3000, 3)).astype(float)
+        # Numpy integer column labels, and tuple ones:
+        frames = [pn.DataFrame(arr, columns=np.array([10, 20, 30])),
+                  pn.DataFrame(arr, columns=pn.MultiIndex.from_tuples([('a', 1), ('a', 2), ('b', 1)]))]
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'imputer.json')
+            for frm in frames:
+                for replacement in ['mean', 'median']:
+                    # Missing value as a numpy scalar:
+                    imputer = MissingValsImputer(replacement=replacement, missing_value=np.int64(0))
+                    imputer.partial_fit(frm.iloc[:2000])
+                    imputer.save(path)
+                    restored = MissingValsImputer.load(path)
+                    self.assertEqual(list(frm.columns), restored.columns)
+                    self.assertEqual(0, restored.missing_value)
+                    # Both continue alike with the next batch:
+                    imputer.partial_fit(frm.iloc[2000:])
+                    restored.partial_fit(frm.iloc[2000:])
+                    self.assertTrue(np.array_equal(imputer.statistics, restored.statistics))
+                    batch = frm.iloc[:5].copy()
+                    self.assertTrue(restored.transform(batch).equals(imputer.transform(frm.iloc[:5].copy())))
+        finally:
+            shutil.rmtree(tmp_dir)
       
     #---------------------------- Array Element Extraction/Replacement Utils ----------------
     
@@ -177,6 +925,11 @@ class TestMathUtils(unittest.TestCase):
         new_arr = non_matches(self.arr_nan[1,:], np.nan)
         self.assertTrue(np.array_equal(new_arr, np.array([4,6,14])))
         
+        # With a precomputed mask:
+        mask = match_mask(self.arr[1,:], 0)
+        new_arr = non_matches(self.arr[1,:], 0, mask=mask)
+        self.assertTrue(np.array_equal(new_arr, np.array([4,6,14])))
+        
     @skipIf(DO_ALL != True, 'skip this one.')
     def test_get_nearest(self):
         rev = pn.Series([0,390.40,725.134,830.0])
@@ -187,6 +940,223 @@ class TestMathUtils(unittest.TestCase):
         self.assertEqual((390.4,1), math_utils.get_nearest(rev, 390.4))
         self.assertEqual((390.4,1), math_utils.get_nearest(rev, 390.4, pick='larger'))
         self.assertEqual((390.4,1), math_utils.get_nearest(rev, 390.4, pick='smaller'))                                
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_get_nearest_many(self):
+        rev = pn.Series([0,390.40,725.134,830.0])
+        nums = [11, 0, 840, 390.4, -5, 725.134, 800]
+
+        def nearest_index(members, num, pick):
+            # The documented rule, member by member:
+            if num in members:
+                return members.index(num)
+            if num < members[0]:
+                return 0
+            if num > members[-1]:
+                return len(members) - 1
+            if pick == 'larger':
+                return min(indx for (indx, member) in enumerate(members) if member > num)
+            return max(indx for (indx, member) in enumerate(members) if member < num)
+        
+        # Members with duplicates, and numbers between, on, 
+        # and beyond them:
+        np.random.seed(4711)
+        members = sorted(np.random.randint(0, 50, size=30).tolist())
+        many_nums = np.random.randint(-10, 60, size=200)
+        for pick in ['larger', 'smaller']:
+            (nearest_nums, indexes) = math_utils.get_nearest_many(members, many_nums, pick=pick)
+            expected = [nearest_index(members, num, pick) for num in many_nums]
+            self.assertEqual(expected, list(indexes))
+            self.assertEqual([members[indx] for indx in expected], list(nearest_nums))
+        (nearest_nums, indexes) = math_utils.get_nearest_many(rev, nums)
+        self.assertEqual([390.4, 0, 830., 390.4, 0, 725.134, 830.], list(nearest_nums))
+        self.assertEqual([1, 0, 3, 1, 0, 2, 3], list(indexes))
+        (nearest_nums, indexes) = math_utils.get_nearest_many(rev.values, nums, pick='smaller')
+        self.assertEqual([0, 0, 830., 390.4, 0, 725.134, 725.134], list(nearest_nums))
+        self.assertEqual([0, 0, 3, 1, 0, 2, 2], list(indexes))
+        
+        # Shape of the numbers is kept:
+        (nearest_nums, indexes) = math_utils.get_nearest_many(rev, np.array([[1, 500], [900, 0]]))
+        self.assertEqual((2, 2), indexes.shape)
+        self.assertTrue(np.array_equal([[1, 2], [3, 0]], indexes))
+        
+        with self.assertRaises(ValueError):
+            math_utils.get_nearest_many(np.array([]), nums)
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_perc_eq_vals(self):
+        frm = pn.DataFrame({'q1' : [1, 2, 2, 3, np.nan],
+                            'q2' : [2, 2, 2, 2, 2],
+                            'q3' : [3, np.nan, 1, 1, 5]},
+                           columns=['q1', 'q2', 'q3'])
+        res = math_utils.perc_eq_vals(frm)
+        self.assertEqual(['q1', 'q2', 'q3'], list(res.columns))
+        self.assertEqual(5, len(res))
+        for col in frm.columns:
+            for val in [1., 2., 3., 5.]:
+                self.assertAlmostEqual(100. * (frm[col] == val).sum() / len(frm), res.loc[val, col])
+        self.assertEqual([20., 0., 20.], list(res.iloc[-1]))
+        self.assertTrue(np.isnan(res.index[-1]))
+        self.assertTrue(np.allclose(100., res.sum()))
+        
+        # Requested values only, including one that does not occur:
+        res = math_utils.perc_eq_vals(self.arr, values=[4, 0, 99])
+        self.assertEqual([4, 0, 99], list(res.index))
+        self.assertEqual([0, 1, 2, 3], list(res.columns))
+        self.assertEqual([50., 0., 0., 0.], list(res.loc[4]))
+        self.assertEqual([0., 25., 0., 0.], list(res.loc[0]))
+        self.assertEqual([0., 0., 0., 0.], list(res.loc[99]))
+        
+        # Series, and strings:
+        res = math_utils.perc_eq_vals(pn.Series(['yes', 'no', 'yes', 'yes'], name='answer'))
+        self.assertEqual([25., 75.], list(res['answer']))
+        self.assertEqual(['no', 'yes'], list(res.index))
+        
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_perc_eq_vals_sparse(self):
+        # Nearly every value distinct:
+        np.random.seed(4711)
+        arr = np.round(np.random.normal(size=(300, 4)), 2)
+        arr[::7, 1] = np.nan
+        dense = math_utils.perc_eq_vals(arr)
+        self.assertTrue(all(dtype == np.float64 for dtype in dense.dtypes))
+        res = math_utils.perc_eq_vals(arr, sparse=True)
+        self.assertTrue(np.array_equal(dense.values, res.values))
+        uniques = np.unique(arr[~np.isnan(arr)])
+        self.assertEqual(len(uniques) + 1, len(res))
+        self.assertTrue(all(str(dtype).startswith('Sparse') for dtype in res.dtypes))
+        self.assertTrue(np.allclose(100., res.sum()))
+        for col_num in range(arr.shape[1]):
+            col = pn.Series(arr[:, col_num])
+            for (val, count) in col.value_counts().items():
+                self.assertAlmostEqual(100. * count / len(col), res.loc[val, col_num])
+            self.assertAlmostEqual(100. * col.isnull().sum() / len(col), res.iloc[-1, col_num])
+        
+        # Requested values only:
+        res = math_utils.perc_eq_vals(self.arr, values=[4, 0, 99], sparse=True)
+        self.assertTrue(np.array_equal(math_utils.perc_eq_vals(self.arr, values=[4, 0, 99]).values, res.values))
+        self.assertEqual([4, 0, 99], list(res.index))
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_perc_answered(self):
+        # Unfolded: one row per question, one column per respondent:
+        unfolded = np.array([[1., np.nan, 3., np.nan],
+                             [2., np.nan, 0., 5.],
+                             [1., np.nan, np.nan, 6.]])
+        (respondent_percs, question_percs) = math_utils.perc_answered(unfolded)
+        self.assertTrue(np.allclose([100., 0., 200./3, 200./3], respondent_percs))
+        self.assertEqual([50., 75., 50.], list(question_percs))
+        
+        (respondent_percs, question_percs) = math_utils.perc_answered(unfolded.T, missing_value=[0, np.nan], 
+                                                                      respondents='rows', block_size=5)
+        self.assertTrue(np.allclose([100., 0., 100./3, 200./3], respondent_percs))
+        self.assertEqual([50., 50., 50.], list(question_percs))
+        
+        # Blocks give the same result:
+        np.random.seed(4711)
+        arr = np.random.randint(0, 3, size=(97, 13))
+        expected = math_utils.perc_answered(arr, missing_value=0)
+        for block_size in [1, 13, 50, 1000]:
+            res = math_utils.perc_answered(arr, missing_value=0, block_size=block_size)
+            self.assertTrue(np.array_equal(expected[0], res[0]))
+            self.assertTrue(np.array_equal(expected[1], res[1]))
+        
+        # Mixed-type frame:
+        frm = pn.DataFrame({'r1' : ['yes', None, 'no'], 'r2' : [np.nan, 4, 'refused']})
+        (respondent_percs, question_percs) = math_utils.perc_answered(frm, missing_value=[np.nan, 'refused'])
+        self.assertTrue(np.allclose([200./3, 100./3], respondent_percs))
+        with self.assertRaises(ValueError):
+            math_utils.perc_answered(frm, respondents='cols')
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_select_respondents(self):
+        unfolded = np.array([[1., np.nan, 3., np.nan],
+                             [2., np.nan, 0., 5.],
+                             [1., np.nan, np.nan, 6.]])
+        res = math_utils.select_respondents(unfolded, 60)
+        self.assertEqual((3, 3), res.shape)
+        self.assertTrue(np.array_equal(np.isnan(unfolded[:, [0, 2, 3]]), np.isnan(res)))
+        self.assertEqual([True, False, True, True], list(math_utils.select_respondents(unfolded, 60, mask_only=True)))
+        self.assertEqual([True, False, False, False], 
+                         list(math_utils.select_respondents(unfolded, 70, mask_only=True)))
+        
+        res = math_utils.select_respondents(unfolded.T, 60, missing_value=[0, np.nan], respondents='rows')
+        self.assertEqual((2, 3), res.shape)
+        
+        frm = pn.DataFrame(unfolded, columns=['a', 'b', 'c', 'd'])
+        res = math_utils.select_respondents(frm, 60)
+        self.assertEqual(['a', 'c', 'd'], list(res.columns))
+        
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            npy_path = os.path.join(tmp_dir, 'unfolded.npy')
+            np.save(npy_path, unfolded)
+            res = math_utils.select_respondents(npy_path, 60, block_size=4)
+            self.assertFalse(isinstance(res, np.memmap))
+            self.assertEqual((3, 3), res.shape)
+            del res
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_nearest_index(self):
+        data = [830.0, np.nan, 390.40, 0, 725.134]
+        index = math_utils.NearestIndex(data)
+        self.assertEqual(4, len(index))
+        rev = pn.Series(sorted([830.0, 390.40, 0, 725.134]))
+        # Positions refer to the unsorted data:
+        original_positions = [3, 2, 4, 0]
+        nums = [11, 0, 840, 390.4, -5, 725.134, 800]
+        for pick in ['larger', 'smaller']:
+            (nearest_nums, positions) = index.nearest_many(nums, pick=pick)
+            for (num, nearest_num, position) in zip(nums, nearest_nums, positions):
+                (expected_num, indx) = math_utils.get_nearest(rev, num, pick=pick)
+                self.assertEqual((expected_num, original_positions[indx]), (nearest_num, position))
+                self.assertEqual((expected_num, original_positions[indx]), index.nearest(num, pick=pick))
+        
+        # Repeated queries come from the cache:
+        self.assertEqual(0, index.cache_hits)
+        self.assertEqual((390.4, 2), index.nearest(11))
+        self.assertEqual(1, index.cache_hits)
+        small_index = math_utils.NearestIndex(data, cache_size=2)
+        for num in [1, 2, 3, 1]:
+            small_index.nearest(num)
+        self.assertEqual(0, small_index.cache_hits)
+        self.assertEqual(2, len(small_index.cache))
+        
+        with self.assertRaises(ValueError):
+            math_utils.NearestIndex([np.nan])
+
+    @skipIf(DO_ALL != True, 'skip this one.')
+    def test_nearest_index_k_within(self):
+        index = math_utils.NearestIndex([5., 1., 3., 10., 7.])
+        (values, positions) = index.k_nearest(4, 3)
+        self.assertEqual([3., 5., 1.], list(values))
+        self.assertEqual([2, 0, 1], list(positions))
+        (values, positions) = index.k_nearest([0, 12], 2)
+        self.assertEqual([[1., 3.], [10., 7.]], values.tolist())
+        self.assertEqual([[1, 2], [3, 4]], positions.tolist())
+        (values, positions) = index.k_nearest(6, 10)
+        self.assertEqual([5., 7., 3., 10., 1.], list(values))
+        
+        np.random.seed(4711)
+        data = np.random.random(200)
+        index = math_utils.NearestIndex(data)
+        nums = np.random.random(50)
+        (values, positions) = index.k_nearest(nums, 4)
+        for (num, num_values, num_positions) in zip(nums, values, positions):
+            expected = np.argsort(np.abs(data - num), kind='mergesort')[:4]
+            self.assertEqual(list(expected), list(num_positions))
+            self.assertTrue(np.array_equal(data[expected], num_values))
+        
+        index = math_utils.NearestIndex([5., 1., 3., 10., 7.])
+        (values, positions) = index.within(4, 1)
+        self.assertEqual([3., 5.], list(values))
+        self.assertEqual([2, 0], list(positions))
+        res = index.within([0, 8.5], 1.5)
+        self.assertEqual([[1.], [7., 10.]], [list(values) for (values, _positions) in res])
+        with self.assertRaises(ValueError):
+            index.k_nearest(4, 0)
         
     #---------------------------- Main ----------------
             
@@ -4,9 +4,39 @@ Created on May 26, 2016
 @author: paepcke
 '''
 
+from collections import OrderedDict
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+
 from matplotlib import pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection, PathCollection
+from matplotlib.figure import Figure
+from matplotlib.textpath import TextPath
+from matplotlib.transforms import Affine2D
+import numpy as np
 from scipy.cluster.hierarchy import dendrogram
 
+# Keyword arguments of dendrogram() that determine the
+# layout of the tree, link colors included. Layouts 
+# computed with these alone are cached; labels, 
+# orientation, and fonts are applied when drawing:
+LAYOUT_KWARGS = ['p', 'truncate_mode', 'color_threshold', 'count_sort', 
+                 'distance_sort', 'show_leaf_counts', 'above_threshold_color']
+COSMETIC_KWARGS = ['orientation', 'labels', 'no_labels', 'leaf_font_size', 
+                   'leaf_rotation', 'leaf_label_func', 'get_leaves', 'no_plot', 'ax']
+# Parts of a layout that every version of dendrogram()
+# returns. Newer versions add 'leaves_color_list':
+LAYOUT_KEYS = ['icoord', 'dcoord', 'ivl', 'leaves', 'color_list']
+
+# Leaf label font sizes and rotations by number of 
+# leaves, as dendrogram() chooses them:
+LEAF_FONT_SIZES = [(20, 12), (30, 10), (50, 8), (85, 6), (np.inf, 5)]
+LEAF_ROTATIONS  = [(20, 0), (40, 45), (np.inf, 90)]
+
 #-------------------------
 # fancy_dendrogram()
 #----------------- 
@@ -19,7 +49,8 @@ def fancy_dendrogram(*args, **kwargs):
     intersects y-axis at a given distance.
     
     Keyword arguments are as per scipy.cluster.hierarchy.dendrogram,
-    plus the ones below.
+    plus the ones below. As with dendrogram(), the tree is drawn
+    into the axes given as ax=, or else into pyplot's current axes.
     
     :param max_d=: distance at which reference line is to be drawn
     :type max_d=: float
@@ -28,6 +59,25 @@ def fancy_dendrogram(*args, **kwargs):
         I.e. only the higher nodes are detailed. Bottom layers
         are summarized.
     :type annotate_above=: float
+    :param max_annotations=: if given, only the distances of this 
+        many of the highest detailed nodes are written out. All
+        detailed nodes are still marked.
+    :type max_annotations=: {None | int}
+    :param layout_cache=: if True, or a DendrogramLayoutCache, the
+        layout of the tree is taken from the cache, or computed 
+        and cached, and only drawn here. Redrawing the same tree
+        with different annotate_above, labels, fonts, or
+        orientation then skips the layout computation. Each 
+        max_d, which is the color threshold, has a layout of its
+        own. Trees drawn with show_contracted or link_color_func
+        are laid out anew.
+    :type layout_cache=: {None | bool | DendrogramLayoutCache}
+    :param fast_lastp=: if True, trees truncated with 
+        truncate_mode='lastp' are laid out by lastp_layout() 
+        from their top merges only, and drawn by 
+        plot_dendrogram_layout(), even without a cache.
+        Default: False
+    :type fast_lastp=: bool
     :param x_label=: label for x-axis. Default is 
         'Sample index or (cluster size)'
     :type x_label=: string    
@@ -50,27 +100,580 @@ def fancy_dendrogram(*args, **kwargs):
         kwargs['color_threshold'] = max_d
 
     annotate_above = kwargs.pop('annotate_above', 0)
+    max_annotations = kwargs.pop('max_annotations', None)
+    layout_cache = kwargs.pop('layout_cache', None)
+    fast_lastp = kwargs.pop('fast_lastp', False)
+    if layout_cache is True:
+        layout_cache = DEFAULT_LAYOUT_CACHE
 
     y_label = kwargs.pop('y_label', 'Distance')
     x_label = kwargs.pop('x_label', 'Sample index or (cluster size)')
     x_axis_font_size = kwargs.pop('x_axis_font_size', 9)
     y_axis_font_size = kwargs.pop('y_axis_font_size', 9)    
 
-    ddata = dendrogram(*args, **kwargs)
+    if not kwargs.get('no_plot', False) and kwargs.get('ax', None) is None:
+        kwargs['ax'] = plt.gca()
+    
+    if len(args) == 1 and is_cacheable(kwargs) and \
+       (layout_cache is not None or (fast_lastp and kwargs.get('truncate_mode', None) == 'lastp')):
+        ddata = cached_dendrogram(layout_cache, args[0], **kwargs)
+    else:
+        ddata = dendrogram(*args, **kwargs)
 
     if not kwargs.get('no_plot', False):
-        plt.title('Hierarchical Clustering Dendrogram (truncated)')
-        plt.xlabel(x_label, fontsize=x_axis_font_size)
-        plt.ylabel(y_label, fontsize=y_axis_font_size)
-        for i, d, c in zip(ddata['icoord'], ddata['dcoord'], ddata['color_list']):
-            x = 0.5 * sum(i[1:3])
-            y = d[1]
-            if y > annotate_above:
-                plt.plot(x, y, 'o', c=c)
-                plt.annotate("%.3g" % y, (x, y), xytext=(0, -5),
-                             textcoords='offset points',
-                             va='top', ha='center')
+        ax = kwargs['ax']
+        ax.set_title('Hierarchical Clustering Dendrogram (truncated)')
+        ax.set_xlabel(x_label, fontsize=x_axis_font_size)
+        ax.set_ylabel(y_label, fontsize=y_axis_font_size)
+        annotate_nodes(ax, ddata, annotate_above, max_annotations)
         if max_d:
-            plt.axhline(y=max_d, c='k')
-    return ddata   
-        
\ No newline at end of file
+            ax.axhline(y=max_d, c='k')
+    return ddata
+
+#-------------------------
+# annotate_nodes()
+#----------------- 
+
+def annotate_nodes(ax, ddata, annotate_above, max_annotations=None):
+    '''
+    Mark the interior nodes of a dendrogram drawn into
+    ax that lie above annotate_above, and write their 
+    distances below them. All markers are drawn as one 
+    scatter collection, rather than one plot per node. 
+    Likewise, all labels are drawn as one collection of
+    text outlines, rather than one Text per node; the 
+    label strings are kept in its texts attribute, 
+    highest node first. Only the max_annotations highest
+    nodes are labeled if given.
+    
+    :param ax: axes into which the dendrogram was drawn
+    :type ax: matplotlib.axes.Axes
+    :param ddata: dendrogram data as returned by dendrogram()
+    :type ddata: dict
+    :param annotate_above: lowest distance of annotated nodes
+    :type annotate_above: float
+    :param max_annotations: largest number of labels, or None for all
+    :type max_annotations: {None | int}
+    '''
+    if len(ddata['icoord']) == 0:
+        return
+    icoord = np.asarray(ddata['icoord'])
+    dcoord = np.asarray(ddata['dcoord'])
+    # Each node sits at the middle of its link's top:
+    xs = 0.5 * (icoord[:, 1] + icoord[:, 2])
+    ys = dcoord[:, 1]
+    above = np.flatnonzero(ys > annotate_above)
+    if len(above) == 0:
+        return
+    ax.scatter(xs[above], ys[above], c=[ddata['color_list'][node] for node in above], zorder=2)
+    
+    # Highest nodes first:
+    labeled = above[np.argsort(-ys[above], kind='mergesort')]
+    if max_annotations is not None:
+        labeled = labeled[:max_annotations]
+    texts = ["%.3g" % ys[node] for node in labeled]
+    font_size = plt.rcParams['font.size']
+    paths = []
+    for text in texts:
+        # Outline in points, centered, with its
+        # top 5 points below the node. The bounds of the
+        # vertices are used, since Path.get_extents() 
+        # solves for the extrema of every curve:
+        path = TextPath((0, 0), text, size=font_size)
+        (x_min, _y_min) = path.vertices.min(axis=0)
+        (x_max, y_max) = path.vertices.max(axis=0)
+        paths.append(path.transformed(Affine2D().translate(-0.5 * (x_min + x_max), -5 - y_max)))
+    # Outlines are scaled from points to pixels, at 
+    # whatever dpi the figure is drawn, and placed
+    # at the nodes in data coordinates:
+    collection_kwargs = {'offsets'    : np.column_stack((xs[labeled], ys[labeled])),
+                         'transform'  : Affine2D().scale(1. / 72) + ax.figure.dpi_scale_trans,
+                         'facecolors' : plt.rcParams['text.color'],
+                         'edgecolors' : 'none'}
+    try:
+        labels = PathCollection(paths, offset_transform=ax.transData, **collection_kwargs)
+    except (TypeError, AttributeError):
+        # Matplotlib before 3.6:
+        labels = PathCollection(paths, transOffset=ax.transData, **collection_kwargs)
+    labels.texts = texts
+    ax.add_collection(labels, autolim=False)
+
+#-------------------------
+# render_dendrograms()
+#----------------- 
+
+def render_dendrograms(linkages, 
+                       out_paths, 
+                       n_jobs=1, 
+                       figsize=(10, 6), 
+                       dpi=100, 
+                       options=None, 
+                       **kwargs):
+    '''
+    Draw one fancy_dendrogram() for each linkage matrix, 
+    and save it to the corresponding file. The file format,
+    such as PNG, SVG, or PDF, follows from the file name 
+    extension. 
+    
+    Each dendrogram is drawn into a Figure of its own, 
+    with an Agg canvas, without pyplot and its global 
+    current figure. Dendrograms can therefore be rendered
+    in parallel by a pool of n_jobs worker processes, and
+    without a display.
+    
+    Keyword arguments are passed to fancy_dendrogram()
+    for every dendrogram. Arguments for single dendrograms
+    may be given in options, a list of one dict per
+    linkage matrix, which take precedence.
+    
+        render_dendrograms([Z1, Z2], ['/tmp/z1.png', '/tmp/z2.svg'],
+                           n_jobs=2, truncate_mode='lastp', p=12)
+    
+    :param linkages: linkage matrices
+    :type linkages: [numpy.ndarray]
+    :param out_paths: one file path per linkage matrix
+    :type out_paths: [string]
+    :param n_jobs: number of processes. If less than 1, one per CPU. 
+    :type n_jobs: int
+    :param figsize: figure width and height in inches
+    :type figsize: (float, float)
+    :param dpi: resolution of raster formats
+    :type dpi: int
+    :param options: fancy_dendrogram() keyword arguments per dendrogram
+    :type options: {None | [dict]}
+    :return: the file paths
+    :rtype: [string]
+    '''
+    if len(linkages) != len(out_paths):
+        raise ValueError('Need one output path per linkage matrix (%s), but got %s' % (len(linkages), len(out_paths)))
+    if options is None:
+        options = [{}] * len(linkages)
+    elif len(options) != len(linkages):
+        raise ValueError('Need one options dict per linkage matrix (%s), but got %s' % (len(linkages), len(options)))
+    
+    jobs = []
+    for (Z, out_path, dendrogram_options) in zip(linkages, out_paths, options):
+        dendrogram_kwargs = dict(kwargs)
+        dendrogram_kwargs.update(dendrogram_options)
+        jobs.append((Z, out_path, figsize, dpi, dendrogram_kwargs))
+    
+    if n_jobs == 1:
+        return [render_dendrogram_job(job) for job in jobs]
+    pool = multiprocessing.Pool(n_jobs if n_jobs >= 1 else multiprocessing.cpu_count())
+    try:
+        return pool.map(render_dendrogram_job, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+#-------------------------
+# render_dendrogram_job()
+#----------------- 
+
+def render_dendrogram_job(job):
+    '''
+    Render one dendrogram of render_dendrograms() to
+    its file. A top-level function, so that worker 
+    processes can be handed it.
+    '''
+    (Z, out_path, figsize, dpi, dendrogram_kwargs) = job
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    fancy_dendrogram(Z, ax=ax, **dendrogram_kwargs)
+    fig.savefig(out_path)
+    return out_path
+
+#-------------------------
+# DendrogramLayoutCache
+#----------------- 
+
+class DendrogramLayoutCache(object):
+    '''
+    Least-recently-used cache of dendrogram layouts, as
+    computed by scipy.cluster.hierarchy.dendrogram() with
+    no_plot=True, link colors included. Layouts are keyed 
+    by a hash of the linkage matrix and of the keyword 
+    arguments that shape and color the tree (LAYOUT_KWARGS),
+    so each color threshold has a layout of its own.
+    
+    Colors below the threshold are those of the palette 
+    set by set_link_color_palette() when the layout was
+    computed. After changing the palette, clear() the 
+    cache, and use a new cache directory if any.
+    
+    If a cache directory is given, layouts are also stored
+    there as JSON files, and found again by later caches 
+    over the same directory, e.g. in later runs, or in 
+    other processes.
+    
+        cache = DendrogramLayoutCache(cache_dir='/tmp/layouts')
+        fancy_dendrogram(Z, max_d=10, layout_cache=cache)
+        fancy_dendrogram(Z, max_d=12, labels=names, layout_cache=cache)
+    '''
+    
+    DEFAULT_MAX_ENTRIES = 32
+    
+    #-------------------------
+    # __init__
+    #----------------- 
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, cache_dir=None):
+        '''
+        :param max_entries: number of layouts held in memory
+        :type max_entries: int
+        :param cache_dir: directory for the on-disk store, if any
+        :type cache_dir: {None | string}
+        '''
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.layouts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        
+    #-------------------------
+    # layout
+    #----------------- 
+
+    def layout(self, Z, **layout_kwargs):
+        '''
+        Return the dendrogram layout of linkage matrix Z
+        for the given LAYOUT_KWARGS, from the cache if 
+        possible, or else as computed by dendrogram_layout().
+        Leaves are labeled by their index, or by their 
+        cluster size if contracted. The returned lists are
+        the caller's own.
+        
+        :param Z: linkage matrix
+        :type Z: numpy.ndarray
+        :return dendrogram data as returned by dendrogram()
+        :rtype: dict
+        '''
+        key = self.key(Z, layout_kwargs)
+        try:
+            layout = self.layouts.pop(key)
+            self.hits += 1
+        except KeyError:
+            layout = self.load(key)
+            if layout is None:
+                self.misses += 1
+                layout = dendrogram_layout(Z, **layout_kwargs)
+                self.store(key, layout)
+            else:
+                self.hits += 1
+            # Held as tuples, which callers cannot modify:
+            layout = dict((name, tuple(tuple(value) if isinstance(value, list) else value 
+                                       for value in values))
+                          for (name, values) in layout.items())
+        # Most recently used layouts are last:
+        self.layouts[key] = layout
+        if len(self.layouts) > self.max_entries:
+            self.layouts.popitem(last=False)
+        return dict((name, [list(value) if isinstance(value, tuple) else value for value in values])
+                    for (name, values) in layout.items())
+    
+    #-------------------------
+    # key
+    #----------------- 
+
+    def key(self, Z, layout_kwargs):
+        '''
+        Return the hash of linkage matrix Z and the 
+        keyword arguments that shape and color the tree.
+        '''
+        Z = np.ascontiguousarray(Z, dtype=float)
+        digest = hashlib.sha1(Z.tobytes())
+        digest.update(repr(Z.shape).encode('utf-8'))
+        digest.update(repr(sorted(layout_kwargs.items())).encode('utf-8'))
+        return digest.hexdigest()
+    
+    #-------------------------
+    # load
+    #----------------- 
+
+    def load(self, key):
+        # Layout from the on-disk store, or None. Files 
+        # that cannot be read count as missing:
+        if self.cache_dir is None:
+            return None
+        path = os.path.join(self.cache_dir, key + '.json')
+        try:
+            with open(path, 'r') as fd:
+                layout = json.load(fd)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(layout, dict) or not all(name in layout for name in LAYOUT_KEYS):
+            return None
+        return layout
+    
+    #-------------------------
+    # store
+    #----------------- 
+
+    def store(self, key, layout):
+        # Add the layout to the on-disk store, if any.
+        # It is written to a temporary file, which is then
+        # renamed, so that readers in other processes never
+        # see a partly written file:
+        if self.cache_dir is None:
+            return
+        path = os.path.join(self.cache_dir, key + '.json')
+        (tmp_fd, tmp_path) = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(tmp_fd, 'w') as fd:
+                # Numpy numbers are written as Python numbers:
+                json.dump(layout, fd, default=lambda number: number.item())
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            # E.g. on Windows, if another process stored
+            # the same layout first:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    #-------------------------
+    # clear
+    #----------------- 
+
+    def clear(self):
+        '''
+        Empty the in-memory cache. The on-disk store is kept.
+        '''
+        self.layouts.clear()
+
+# Cache used by fancy_dendrogram(..., layout_cache=True):
+DEFAULT_LAYOUT_CACHE = DendrogramLayoutCache()
+
+#-------------------------
+# cached_dendrogram()
+#----------------- 
+
+def cached_dendrogram(layout_cache, Z, **kwargs):
+    '''
+    Like scipy.cluster.hierarchy.dendrogram(), but takes 
+    the layout from layout_cache, applies labels to it, 
+    and draws it with plot_dendrogram_layout() into ax, 
+    or pyplot's current axes, unless no_plot is True. 
+    Only LAYOUT_KWARGS and COSMETIC_KWARGS are accepted.
+    If layout_cache is None, the layout is computed by 
+    dendrogram_layout().
+    '''
+    layout_kwargs = dict((name, value) for (name, value) in kwargs.items() if name in LAYOUT_KWARGS)
+    if layout_cache is None:
+        ddata = dendrogram_layout(Z, **layout_kwargs)
+    else:
+        ddata = layout_cache.layout(Z, **layout_kwargs)
+    
+    labels = kwargs.get('labels', None)
+    if labels is not None and len(labels) != len(Z) + 1:
+        raise ValueError('Dimensions of Z and labels must be consistent: %s observations, but %s labels' % 
+                         (len(Z) + 1, len(labels)))
+    leaf_label_func = kwargs.get('leaf_label_func', None)
+    if leaf_label_func is not None:
+        ddata['ivl'] = [leaf_label_func(leaf) for leaf in ddata['leaves']]
+    elif labels is not None:
+        # Contracted clusters keep their size labels:
+        num_obs = len(Z) + 1
+        ddata['ivl'] = [labels[leaf] if leaf < num_obs else label 
+                        for (leaf, label) in zip(ddata['leaves'], ddata['ivl'])]
+    if not kwargs.get('get_leaves', True):
+        del ddata['leaves']
+    
+    if not kwargs.get('no_plot', False):
+        plot_dendrogram_layout(kwargs.get('ax', None) or plt.gca(), ddata,
+                               orientation=kwargs.get('orientation', 'top'),
+                               no_labels=kwargs.get('no_labels', False),
+                               leaf_font_size=kwargs.get('leaf_font_size', None),
+                               leaf_rotation=kwargs.get('leaf_rotation', None))
+    return ddata
+
+#-------------------------
+# dendrogram_layout()
+#----------------- 
+
+def dendrogram_layout(Z, **layout_kwargs):
+    '''
+    Return the layout that dendrogram(Z, no_plot=True)
+    computes for the given LAYOUT_KWARGS. Trees truncated
+    with truncate_mode='lastp', and neither count_sort
+    nor distance_sort, are laid out by lastp_layout().
+    '''
+    if layout_kwargs.get('truncate_mode', None) == 'lastp' and \
+       not layout_kwargs.get('count_sort', False) and \
+       not layout_kwargs.get('distance_sort', False):
+        lastp_kwargs = dict((name, value) for (name, value) in layout_kwargs.items()
+                            if name not in ['truncate_mode', 'count_sort', 'distance_sort'])
+        return lastp_layout(Z, **lastp_kwargs)
+    return dendrogram(Z, no_plot=True, get_leaves=True, **layout_kwargs)
+
+#-------------------------
+# lastp_layout()
+#----------------- 
+
+def lastp_layout(Z, 
+                 p=30, 
+                 color_threshold=None, 
+                 show_leaf_counts=True, 
+                 above_threshold_color=None):
+    '''
+    Compute the layout of the dendrogram of linkage
+    matrix Z, truncated to its top p clusters, as 
+    dendrogram(Z, truncate_mode='lastp', p=p, no_plot=True)
+    does. Only the last p-1 rows of Z, which are the
+    merges that are drawn, are read. They are renumbered
+    into the linkage matrix of a tree over p leaves, 
+    which dendrogram() lays out and colors. The rest of
+    the tree is neither validated nor traversed, so that 
+    the top of a tree over 100k+ respondents is laid 
+    out in time proportional to p.
+    
+    Leaves are labeled by their index, or by their 
+    cluster size if contracted. Labels may be applied
+    as in cached_dendrogram().
+    
+    :param Z: linkage matrix
+    :type Z: numpy.ndarray
+    :param p: number of leaves of the truncated tree
+    :type p: int
+    :param color_threshold: links below this distance are
+        colored by cluster. Default: 0.7 * max(Z[:,2])
+    :type color_threshold: {None | float}
+    :param show_leaf_counts: whether contracted leaves
+        are labeled with their cluster size
+    :type show_leaf_counts: bool
+    :param above_threshold_color: color of links above the
+        color threshold. Default: that of dendrogram()
+    :type above_threshold_color: {None | string}
+    :return dendrogram data as returned by dendrogram()
+    :rtype: dict
+    '''
+    Z = np.asarray(Z)
+    if Z.ndim != 2 or Z.shape[1] != 4 or len(Z) == 0:
+        raise ValueError('Linkage matrix must have shape (n-1, 4) with n > 1, but has shape %s' % (Z.shape,))
+    num_obs = len(Z) + 1
+    p = int(p)
+    if p < 0:
+        raise ValueError('Number of leaves p must not be negative, but is %s' % p)
+    if p > num_obs or p == 0:
+        p = num_obs
+    color_kwargs = {} if above_threshold_color is None else {'above_threshold_color' : above_threshold_color}
+    if p == 1:
+        # No merges are drawn:
+        return dendrogram(Z, truncate_mode='lastp', p=p, no_plot=True, color_threshold=color_threshold, 
+                          show_leaf_counts=show_leaf_counts, **color_kwargs)
+    # The threshold of the whole tree, whose highest 
+    # merge need not be drawn if Z is not monotonic:
+    if color_threshold is None or (isinstance(color_threshold, str) and color_threshold == 'default'):
+        color_threshold = 0.7 * Z[:, 2].max()
+    
+    # Clusters formed before this one are leaves. They
+    # become leaves 0 to p-1 of the small tree; the drawn
+    # merges follow, in the order of Z:
+    first_shown = 2 * num_obs - p
+    top_rows = np.array(Z[num_obs - p:], dtype=float)
+    children = top_rows[:, :2].astype(int)
+    is_leaf = children < first_shown
+    leaf_ids = children[is_leaf]
+    small_children = children - first_shown + p
+    small_children[is_leaf] = np.arange(p)
+    top_rows[:, :2] = small_children
+    
+    ddata = dendrogram(top_rows, no_plot=True, color_threshold=color_threshold, **color_kwargs)
+    leaves = [int(leaf_ids[leaf]) for leaf in ddata['leaves']]
+    ddata['ivl'] = [str(leaf) if leaf < num_obs else 
+                    ('(%d)' % int(Z[leaf - num_obs, 3]) if show_leaf_counts else '') 
+                    for leaf in leaves]
+    ddata['leaves'] = leaves
+    return ddata
+
+#-------------------------
+# plot_dendrogram_layout()
+#----------------- 
+
+def plot_dendrogram_layout(ax, 
+                           ddata, 
+                           orientation='top', 
+                           no_labels=False, 
+                           leaf_font_size=None, 
+                           leaf_rotation=None):
+    '''
+    Draw a dendrogram layout into ax, as dendrogram()
+    does: one line collection per link color, leaves
+    10 units apart, and the leaf labels as tick labels.
+    Links of the root's color, which are those above the 
+    color threshold, are drawn last.
+    
+    :param ax: axes to draw into
+    :type ax: matplotlib.axes.Axes
+    :param ddata: dendrogram data as returned by dendrogram()
+    :type ddata: dict
+    :param orientation: side of the root: 'top', 'bottom', 'left', or 'right'
+    :type orientation: string
+    :param no_labels: if True, leaves are not labeled
+    :type no_labels: bool
+    :param leaf_font_size: font size of leaf labels; default
+        depends on the number of leaves
+    :type leaf_font_size: {None | float}
+    :param leaf_rotation: rotation of leaf labels in degrees; 
+        default depends on the number of leaves
+    :type leaf_rotation: {None | float}
+    '''
+    ivl = ddata['ivl']
+    leaf_extent = len(ivl) * 10
+    height = max(max(dcoord) for dcoord in ddata['dcoord']) * 1.05 if len(ddata['dcoord']) > 0 else 1.
+    leaf_ticks = np.arange(5, leaf_extent + 5, 10)
+    if leaf_font_size is None:
+        leaf_font_size = float(next(size for (max_leaves, size) in LEAF_FONT_SIZES if len(ivl) <= max_leaves))
+    
+    if orientation in ('top', 'bottom'):
+        ax.set_xlim([0, leaf_extent])
+        ax.set_ylim([0, height] if orientation == 'top' else [height, 0])
+        (xlines, ylines) = (ddata['icoord'], ddata['dcoord'])
+        (leaf_axis, set_ticks, set_tick_labels) = (ax.xaxis, ax.set_xticks, ax.set_xticklabels)
+        ticks_position = 'bottom' if orientation == 'top' else 'top'
+        if leaf_rotation is None:
+            leaf_rotation = float(next(rotation for (max_leaves, rotation) in LEAF_ROTATIONS 
+                                       if len(ivl) <= max_leaves))
+    else:
+        ax.set_xlim([height, 0] if orientation == 'left' else [0, height])
+        ax.set_ylim([0, leaf_extent])
+        (xlines, ylines) = (ddata['dcoord'], ddata['icoord'])
+        (leaf_axis, set_ticks, set_tick_labels) = (ax.yaxis, ax.set_yticks, ax.set_yticklabels)
+        ticks_position = 'right' if orientation == 'left' else 'left'
+    
+    if no_labels:
+        set_ticks([])
+        set_tick_labels([])
+    else:
+        set_ticks(leaf_ticks)
+        leaf_axis.set_ticks_position(ticks_position)
+        # Tick marks would cover up the links:
+        for line in leaf_axis.get_ticklines():
+            line.set_visible(False)
+        if leaf_rotation is None:
+            set_tick_labels(ivl, size=leaf_font_size)
+        else:
+            set_tick_labels(ivl, rotation=leaf_rotation, size=leaf_font_size)
+    
+    lines_by_color = OrderedDict()
+    for (xline, yline, color) in zip(xlines, ylines, ddata['color_list']):
+        lines_by_color.setdefault(color, []).append(list(zip(xline, yline)))
+    if len(ddata['dcoord']) == 0:
+        return
+    root_color = ddata['color_list'][int(np.argmax([dcoord[1] for dcoord in ddata['dcoord']]))]
+    colors = [color for color in lines_by_color if color != root_color] + [root_color]
+    for color in colors:
+        ax.add_collection(LineCollection(lines_by_color[color], colors=(color,)))
+
+#-------------------------
+# is_cacheable()
+#----------------- 
+
+def is_cacheable(kwargs):
+    # Whether dendrogram() keyword arguments allow
+    # the layout to be cached and drawn separately:
+    if kwargs.get('show_contracted', False):
+        return False
+    return all(name in LAYOUT_KWARGS or name in COSMETIC_KWARGS or name == 'show_contracted'
+               for name in kwargs)
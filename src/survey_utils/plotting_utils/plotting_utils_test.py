@@ -4,14 +4,20 @@ Created on May 26, 2016
 @author: paepcke
 '''
 
+from io import BytesIO
+import os
+import shutil
+import tempfile
 from unittest import skipIf
 import unittest
 
 import numpy as np
 
 from matplotlib import pyplot as plt
-from scipy.cluster.hierarchy import linkage
-from survey_utils.plotting_utils.plotting_utils import fancy_dendrogram
+from matplotlib.collections import PathCollection
+from scipy.cluster.hierarchy import dendrogram, linkage, set_link_color_palette
+from survey_utils.plotting_utils.plotting_utils import DendrogramLayoutCache, cached_dendrogram
+from survey_utils.plotting_utils.plotting_utils import fancy_dendrogram, lastp_layout, render_dendrograms
 
 DO_DENDROGRAM = True
 
@@ -50,6 +56,205 @@ class TestPlotting(unittest.TestCase):
 
         plt.show()
         
+    @skipIf(DO_DENDROGRAM != True, 'skip this one.')    
+    def test_fancy_dendrogram_many_nodes(self):
+        np.random.seed(4711)
+        X = np.random.random((500, 3))
+        Z = linkage(X, 'ward')
+        
+        fig = plt.figure()
+        try:
+            fancy_dendrogram(Z, max_d=1.0, max_annotations=20)
+            ax = plt.gca()
+            # One marker collection for all 499 interior nodes,
+            # and one label collection, instead of Text objects:
+            (markers, labels) = [collection for collection in ax.collections 
+                                 if isinstance(collection, PathCollection)]
+            self.assertEqual(499, len(markers.get_offsets()))
+            self.assertEqual(0, len(ax.texts))
+            # Labels for the highest nodes only:
+            self.assertEqual(20, len(labels.get_paths()))
+            self.assertEqual(20, len(labels.texts))
+            self.assertEqual("%.3g" % Z[-1, 2], labels.texts[0])
+            self.assertEqual(Z[-1, 2], labels.get_offsets()[0][1])
+            
+            # All nodes are labeled by default:
+            ax.clear()
+            fancy_dendrogram(Z)
+            self.assertEqual(499, len(ax.collections[-1].texts))
+            
+            ax.clear()
+            fancy_dendrogram(Z, annotate_above=Z[-3, 2])
+            self.assertEqual(['%.3g' % Z[-1, 2], '%.3g' % Z[-2, 2]], ax.collections[-1].texts)
+            # Rendered at any dpi:
+            fig.savefig(BytesIO(), format='png', dpi=50)
+        finally:
+            plt.close(fig)
+        
+
+    @skipIf(DO_DENDROGRAM != True, 'skip this one.')    
+    def test_layout_cache(self):
+        np.random.seed(4711)
+        Z = linkage(np.random.random((60, 3)), 'ward')
+        labels = ['r%s' % obs for obs in range(60)]
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            cache = DendrogramLayoutCache(cache_dir=tmp_dir)
+            for kwargs in [{}, 
+                           {'labels' : labels, 'color_threshold' : 1.},
+                           {'truncate_mode' : 'lastp', 'p' : 12, 'leaf_rotation' : 90.},
+                           {'truncate_mode' : 'lastp', 'p' : 12, 'labels' : labels, 'orientation' : 'left'},
+                           {'leaf_label_func' : lambda leaf: 'leaf%s' % leaf, 'no_labels' : True, 
+                            'orientation' : 'bottom'}]:
+                (expected_ax, expected) = self.draw(lambda: dendrogram(Z, **kwargs))
+                for _repeat in range(2):
+                    (ax, ddata) = self.draw(lambda: cached_dendrogram(cache, Z, **kwargs))
+                    self.assertEqual(expected, ddata)
+                    self.assertEqual(expected_ax, ax)
+            # Labels, fonts, and orientation do not need new layouts:
+            self.assertEqual(3, cache.misses)
+            self.assertEqual(7, cache.hits)
+            
+            # Each color threshold has a layout of its own:
+            for kwargs in [{'truncate_mode' : 'lastp', 'p' : 20}, {}]:
+                for color_threshold in [0, 0.5, 1.5, 10.]:
+                    for color_kwargs in [{'color_threshold' : color_threshold}, 
+                                         {'color_threshold' : color_threshold, 'above_threshold_color' : 'k'}]:
+                        color_kwargs.update(kwargs)
+                        expected = dendrogram(Z, no_plot=True, **color_kwargs)
+                        misses = cache.misses
+                        self.assertEqual(expected, cache.layout(Z, **color_kwargs))
+                        self.assertEqual(expected, cache.layout(Z, **color_kwargs))
+                        self.assertEqual(misses + 1, cache.misses)
+            # Layouts computed with a palette of one's own
+            # keep its colors:
+            set_link_color_palette(['m', 'c', 'y'])
+            try:
+                palette_cache = DendrogramLayoutCache()
+                expected = dendrogram(Z, no_plot=True, color_threshold=1.)
+                self.assertEqual(expected, palette_cache.layout(Z, color_threshold=1.))
+            finally:
+                set_link_color_palette(None)
+            self.assertEqual(expected, palette_cache.layout(Z, color_threshold=1.))
+            
+            # Returned lists are the caller's own:
+            ddata['icoord'][0][0] = -999.
+            ddata['ivl'][0] = 'changed'
+            self.assertEqual(dendrogram(Z, no_plot=True), cache.layout(Z))
+            
+            # Unreadable files on disk count as missing:
+            for file_name in os.listdir(tmp_dir):
+                with open(os.path.join(tmp_dir, file_name), 'w') as fd:
+                    fd.write('{"icoord" : [[5.0, 5.0, ')
+            disk_cache = DendrogramLayoutCache(cache_dir=tmp_dir)
+            self.assertEqual(dendrogram(Z, no_plot=True), disk_cache.layout(Z))
+            self.assertEqual((0, 1), (disk_cache.hits, disk_cache.misses))
+            self.assertEqual(['.json'], list(set(os.path.splitext(file_name)[1] for file_name in os.listdir(tmp_dir))))
+            
+            # Layouts are found on disk:
+            disk_cache = DendrogramLayoutCache(cache_dir=tmp_dir)
+            ddata = disk_cache.layout(Z)
+            self.assertEqual(dendrogram(Z, no_plot=True), ddata)
+            self.assertEqual((1, 0), (disk_cache.hits, disk_cache.misses))
+        finally:
+            shutil.rmtree(tmp_dir)
+        
+        # Through fancy_dendrogram(), with different max_d:
+        fig = plt.figure()
+        try:
+            cache = DendrogramLayoutCache()
+            for _repeat in range(2):
+                for max_d in [0.5, 1., 1.5, 2.]:
+                    ddata = fancy_dendrogram(Z, max_d=max_d, annotate_above=1., layout_cache=cache)
+                    self.assertEqual(dendrogram(Z, color_threshold=max_d, no_plot=True), ddata)
+            self.assertEqual((4, 4), (cache.hits, cache.misses))
+        finally:
+            plt.close(fig)
+        
+    @skipIf(DO_DENDROGRAM != True, 'skip this one.')    
+    def test_lastp_layout(self):
+        np.random.seed(4711)
+        for (X, method) in [(np.random.random((60, 3)), 'ward'),
+                            # Ties among distances:
+                            (np.random.randint(0, 3, (40, 2)).astype(float), 'single'),
+                            (np.random.random((7, 2)), 'centroid')]:
+            Z = linkage(X, method)
+            for p in [0, 1, 2, 5, 12, len(X), len(X) + 3]:
+                for kwargs in [{}, 
+                               {'color_threshold' : 0},
+                               {'color_threshold' : Z[-1, 2] / 3., 'above_threshold_color' : 'k'},
+                               {'show_leaf_counts' : False}]:
+                    expected = dendrogram(Z, truncate_mode='lastp', p=p, no_plot=True, **kwargs)
+                    self.assertEqual(expected, lastp_layout(Z, p=p, **kwargs))
+        with self.assertRaises(ValueError):
+            lastp_layout(np.zeros((0, 4)))
+        # Palettes of one's own are followed:
+        set_link_color_palette(['m', 'c', 'y'])
+        try:
+            self.assertEqual(dendrogram(Z, truncate_mode='lastp', p=5, no_plot=True), lastp_layout(Z, p=5))
+        finally:
+            set_link_color_palette(None)
+        
+        # Through fancy_dendrogram(), drawn as dendrogram() draws:
+        kwargs = {'truncate_mode' : 'lastp', 'p' : 12, 'color_threshold' : Z[-1, 2] / 2.}
+        (expected_ax, expected) = self.draw(lambda: dendrogram(Z, **kwargs))
+        (ax, ddata) = self.draw(lambda: fancy_dendrogram(Z, annotate_above=Z[-1, 2], fast_lastp=True, **kwargs))
+        self.assertEqual(expected, ddata)
+        self.assertEqual(expected_ax['lines'], ax['lines'])
+        self.assertEqual(expected_ax['labels'], ax['labels'])
+        with self.assertRaises(ValueError):
+            fancy_dendrogram(Z, labels=['a', 'b'], no_plot=True, fast_lastp=True, **kwargs)
+        
+    @skipIf(DO_DENDROGRAM != True, 'skip this one.')    
+    def test_render_dendrograms(self):
+        np.random.seed(4711)
+        linkages = [linkage(np.random.random((num_obs, 2)), 'ward') for num_obs in [20, 40, 80]]
+        fig_nums = plt.get_fignums()
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            out_paths = [os.path.join(tmp_dir, name) for name in ['z20.png', 'z40.svg', 'z80.png']]
+            res = render_dendrograms(linkages, out_paths, n_jobs=2, 
+                                     options=[{}, {}, {'truncate_mode' : 'lastp', 'p' : 10}],
+                                     max_d=0.5, annotate_above=0.5)
+            self.assertEqual(out_paths, res)
+            for out_path in out_paths:
+                self.assertTrue(os.path.getsize(out_path) > 0)
+            with open(out_paths[0], 'rb') as fd:
+                self.assertEqual(b'\x89PNG', fd.read(4))
+            with open(out_paths[1], 'r') as fd:
+                self.assertTrue('<svg' in fd.read())
+            
+            # In this process:
+            res = render_dendrograms(linkages[:1], [os.path.join(tmp_dir, 'z.pdf')])
+            self.assertTrue(os.path.getsize(res[0]) > 0)
+            # No pyplot figures were made:
+            self.assertEqual(fig_nums, plt.get_fignums())
+            
+            with self.assertRaises(ValueError):
+                render_dendrograms(linkages, out_paths[:2])
+        finally:
+            shutil.rmtree(tmp_dir)
+        
+    def draw(self, draw_func):
+        # Return a summary of what draw_func() drew into
+        # a new figure, and what it returned:
+        fig = plt.figure()
+        try:
+            ddata = draw_func()
+            ax = plt.gca()
+            summary = {'xlim'     : ax.get_xlim(),
+                       'ylim'     : ax.get_ylim(),
+                       'xticks'   : list(ax.get_xticks()),
+                       'yticks'   : list(ax.get_yticks()),
+                       'labels'   : [(label.get_text(), label.get_rotation(), label.get_size()) 
+                                     for label in ax.get_xticklabels() + ax.get_yticklabels()],
+                       'lines'    : [(tuple(collection.get_colors()[0]), 
+                                      [segment.tolist() for segment in collection.get_segments()])
+                                     for collection in ax.collections]
+                       }
+            return (summary, ddata)
+        finally:
+            plt.close(fig)
 
 
 if __name__ == "__main__":
@@ -4,13 +4,43 @@ Created on May 20, 2016
 @author: paepcke
 '''
 import argparse
-from collections import OrderedDict
+from array import array
+from collections import OrderedDict, namedtuple
 import csv
+import numbers
 import os
 import sys
+import threading
 
 from ordered_set import OrderedSet
 
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+# Number of output rows handed to the csv writer's
+# writerows() at a time:
+DEFAULT_WRITE_CHUNK_SIZE = 1000
+
+# Size in bytes of the write buffer of output files:
+DEFAULT_WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Number of constant-column conflicts after which
+# TableShaper.validate() stops looking:
+DEFAULT_MAX_CONFLICTS = 1000
+
+# One inconsistency found by TableShaper.validate(): in row 
+# 'row', constant column 'column' has 'value' for unfold value 
+# 'key', though earlier row 'first_row' had 'first_value':
+ConstantColConflict = namedtuple('ConstantColConflict', 
+                                 ['key', 'column', 'first_value', 'first_row', 'value', 'row'])
+
+# Largest number of distinct values a question with
+# non-numeric answers may have to be inferred as
+# categorical, rather than as free string:
+DEFAULT_MAX_CATEGORIES = 20
+
 class OutMethod():
     '''
     Enumeration-like entity used as parameter
@@ -46,7 +76,14 @@ class TableShaper(object):
                col_name_unfold_values, 
                out_method=OutMethod.STDOUT, 
                constant_cols=None, 
-               new_col_names_col=None):
+               new_col_names_col=None,
+               write_chunk_size=DEFAULT_WRITE_CHUNK_SIZE,
+               write_buffer_size=DEFAULT_WRITE_BUFFER_SIZE,
+               background_write=False,
+               infer_types=False,
+               max_categories=DEFAULT_MAX_CATEGORIES,
+               duplicate_policy=None,
+               respondent_col=None):
         '''
         Unfold (reshape) data frame like the following example:
         
@@ -143,6 +180,38 @@ class TableShaper(object):
         :type constant_cols: {None | [string]}
         :param new_col_names_col: name of column to use for column names of new columns
         :type new_col_names_col: {None | string}
+        :param write_chunk_size: number of output rows collected before
+             they are written out in one writerows() call. Ignored
+             for OutMethod.ITERATOR.
+        :type write_chunk_size: int
+        :param write_buffer_size: size in bytes of the write buffer
+             used when output goes to a file.
+        :type write_buffer_size: int
+        :param background_write: if True, chunks of rows are formatted
+             and written by a separate thread while the next chunk
+             is assembled.
+        :type background_write: bool
+        :param infer_types: if True, the type of each question's answers
+             is inferred while the table is read: 'int', 'float',
+             'categorical', or 'string'. Answers are converted to
+             int or float accordingly as rows are output, and padding
+             is of the question's type. Empty answers to numeric
+             questions become float('nan'). The result is available
+             in self.inferred_schema, an OrderedDict mapping each
+             unfold value (e.g. 'DOB') to its type name.
+        :type infer_types: bool
+        :param max_categories: largest number of distinct non-numeric
+             answers for which a question is considered 'categorical'
+             rather than 'string'.
+        :type max_categories: int
+        :param duplicate_policy: what to do when one respondent answered
+             the same question more than once: DuplicateIndex.KEEP_FIRST, 
+             DuplicateIndex.KEEP_LAST, or DuplicateIndex.ERROR, which raises 
+             ValueError. If None, all answers are kept.
+        :type duplicate_policy: {None | string}
+        :param respondent_col: name of column that identifies respondents
+             for duplicate detection. Defaults to new_col_names_col.
+        :type respondent_col: {None | string}
         '''
         
         # Error checking and initializations:
@@ -170,9 +239,35 @@ class TableShaper(object):
             # constant_cols is None:
             self.constant_cols = []
         
+        if type(write_chunk_size) != int or write_chunk_size < 1:
+            raise ValueError('Write chunk size must be a positive integer, was %s' % write_chunk_size)
+        if type(write_buffer_size) != int or write_buffer_size < 1:
+            raise ValueError('Write buffer size must be a positive integer, was %s' % write_buffer_size)
+        self.write_chunk_size  = write_chunk_size
+        self.write_buffer_size = write_buffer_size
+        self.background_write  = background_write
+        
         self.out_method = out_method
         self.col_name_unfold_values = col_name_unfold_values
         
+        # Type inference of answers, if requested:
+        if infer_types:
+            self.type_inferrer = TypeInferrer(max_categories=max_categories)
+        else:
+            self.type_inferrer = None
+        self.inferred_schema = None
+        
+        # Detection of repeated answers by one respondent, if requested:
+        if duplicate_policy is not None:
+            if respondent_col is None:
+                respondent_col = new_col_names_col
+            if type(respondent_col) != str:
+                raise ValueError('Duplicate detection needs respondent_col or new_col_names_col to name the respondent column.')
+            self.duplicate_index = DuplicateIndex(duplicate_policy)
+        else:
+            self.duplicate_index = None
+        self.respondent_col = respondent_col
+        
         # Place to accumulated the unfolded values:
         self.unfolded_values_dict = OrderedDict()
         
@@ -182,24 +277,17 @@ class TableShaper(object):
         # Place to hold names for new columns:
         self.new_col_names = OrderedSet()
         
+        (in_fd, reader) = self.make_reader(in_path_or_2d_array)
         try:
-            if type(in_path_or_2d_array) == str:
-                # Get in-table from a file:
-                in_fd = open(in_path_or_2d_array, 'r')
-                reader = csv.reader(in_fd, delimiter=',') 
-            else:
-                # Get in-table from a 2d array:
-                reader = iter(in_path_or_2d_array)
-                in_fd = None
-    
             # Look at in-table's header line and get various
             # constants initialized:
                     
             self.header = self.process_in_header_line(reader) 
             
             # Read the rows and create in-memory representation
-            # of transformed structure:
-            for row in reader:
+            # of transformed structure. Row numbers count the
+            # header as row 1:
+            for (row_num, row) in enumerate(reader, 2):
                 
                 # Field value of the unfold-column that is key of rows in new tbl
                 # e.g. 'DOB' or 'gender':
@@ -213,8 +301,25 @@ class TableShaper(object):
                 
                 # Value of this unfold-key in this row (e.g. '1983' or 'M'):
                 unfold_value = row[self.col_indx_of_values]
-                collected_values.append(unfold_value)
+                
+                # Did this row's respondent answer this question before?
+                if self.duplicate_index is None:
+                    earlier_position = None
+                else:
+                    earlier_position = self.duplicate_index.record(row[self.respondent_col_indx],
+                                                                   unfold_col_value, 
+                                                                   len(collected_values))
+                if earlier_position is None:
+                    collected_values.append(unfold_value)
+                elif self.duplicate_index.policy == DuplicateIndex.KEEP_LAST:
+                    collected_values[earlier_position] = unfold_value
+                elif self.duplicate_index.policy == DuplicateIndex.ERROR:
+                    raise ValueError("Row %s: respondent %s answered question %s more than once." %\
+                                     (row_num, row[self.respondent_col_indx], unfold_col_value))
                 self.unfolded_values_dict[unfold_col_value] = collected_values
+                if self.type_inferrer is not None and (earlier_position is None or \
+                                                       self.duplicate_index.policy == DuplicateIndex.KEEP_LAST):
+                    self.type_inferrer.observe(unfold_col_value, unfold_value)
                 
                 # Now take care of constant columns.
                 # For each unique value of the column that
@@ -237,48 +342,140 @@ class TableShaper(object):
                 #    subject2   gender     M      radio
                 # 
     
-                for col_num in range(len(row)):
-                    try:
-                        col_name = self.header[col_num]
-                    except IndexError:
-                        raise ValueError('Row %s has more columns than header (%s)' % (col_num, self.header))
+                if len(row) > len(self.header):
+                    raise ValueError('Row %s has more columns than header (%s)' % (row_num, self.header))
+                
+                # Only visit the constant columns, whose indexes
+                # were found once, from the header:
+                for (col_num, col_name) in self.const_col_indexes:
+                    # Short rows lack their last columns:
+                    if col_num >= len(row):
+                        continue
                     col_value = row[col_num]
-                    
-                    # Is this column constant for a given pivot column value?
-                    if col_name in self.constant_cols:
                         
-                        # Dict: 
-                        #    {(<unfold-col-value, constant_col_name) : constant_col_value}
-                        # I.e. for each of the values in the column to be unfolded,
-                        # each constant column has the same value, else something is wrong.
-                        # Check whether we already encountered the value in the current
-                        # row's unfold-value; if not init, if yes, ensure that this 
-                        # constant-col's value in the current row is the same as in 
-                        # other rows in which the unfold-value is the same as in this row:
-                        
-                        const_values_dict_key = (unfold_col_value,col_name)
-                        col_constant = self.const_col_dict.get(const_values_dict_key, None)
-                        
-                        if col_constant is None:
-                            self.const_col_dict[const_values_dict_key] = col_value
-                        else:
-                            # Saw value for this column and pivot value earlier:
-                            if col_value != col_constant:
-                                raise ValueError("Column that is supposedly constant for a given pivot value is not: %s != %s" %\
-                                                 (col_value, col_constant))
-                                
-                    # Are we to use an existing column as source for
-                    # names of new columns?
+                    # Dict: 
+                    #    {(<unfold-col-value, constant_col_name) : constant_col_value}
+                    # I.e. for each of the values in the column to be unfolded,
+                    # each constant column has the same value, else something is wrong.
+                    # Check whether we already encountered the value in the current
+                    # row's unfold-value; if not init, if yes, ensure that this 
+                    # constant-col's value in the current row is the same as in 
+                    # other rows in which the unfold-value is the same as in this row:
                     
-                    if self.new_col_names_col is not None:
-                        self.new_col_names.add(row[self.new_cols_col_indx])
+                    const_values_dict_key = (unfold_col_value,col_name)
+                    col_constant = self.const_col_dict.get(const_values_dict_key, None)
+                    
+                    if col_constant is None:
+                        self.const_col_dict[const_values_dict_key] = col_value
+                    else:
+                        # Saw value for this column and pivot value earlier:
+                        if col_value != col_constant:
+                            raise ValueError("Column that is supposedly constant for a given pivot value is not: %s != %s" %\
+                                             (col_value, col_constant))
+                                
+                # Are we to use an existing column as source for
+                # names of new columns?
+                
+                if self.new_col_names_col is not None:
+                    self.new_col_names.add(row[self.new_cols_col_indx])
                      
         finally:
-            if type(in_path_or_2d_array) == str:
+            if in_fd is not None:
                 in_fd.close()
+        
+        if self.type_inferrer is not None:
+            self.inferred_schema = self.type_inferrer.schema()
                                     
         return(self.output_result())
 
+    #-------------------------
+    # validate
+    #----------------- 
+
+    def validate(self,
+                 in_path_or_2d_array,
+                 col_name_to_unfold,
+                 constant_cols,
+                 max_conflicts=DEFAULT_MAX_CONFLICTS):
+        '''
+        Check a table for inconsistent constant columns without
+        unfolding it. Where unfold() raises ValueError at the first
+        constant-column value that differs from the value in an 
+        earlier row with the same unfold value, this method
+        collects all such conflicts in one pass. Answers are 
+        not accumulated, so memory only grows with the number 
+        of distinct unfold values.
+        
+        Example: with constant_cols=['questionType'], the table
+        
+           ======   ========   ============   ======
+           userId   question   questionType   answer 
+           ======   ========   ============   ======
+            10      DOB          pullDown      1983     
+            20      DOB          radio         1980
+            
+        yields:
+        
+           [ConstantColConflict(key='DOB', column='questionType',
+                                first_value='pullDown', first_row=2,
+                                value='radio', row=3)]
+                                
+        Row numbers count the header as row 1.
+        
+        :param in_path_or_2d_array: location of input CSV file, or
+            an array of arrays. First row must be column names.
+        :type in_path_or_2d_array: {string | [[]]}
+        :param col_name_to_unfold: name of the column to unfold into columns
+        :type col_name_to_unfold: string
+        :param constant_cols: names of columns that are to be retained 
+        :type constant_cols: [string]
+        :param max_conflicts: number of conflicts after which the
+            scan stops. If None, the whole table is scanned.
+        :type max_conflicts: {None | int}
+        :return: list of conflicts, in the order in which they occur in the table
+        :rtype: [ConstantColConflict]
+        '''
+        if type(col_name_to_unfold) != str:
+            raise ValueError('Must name column that is to be unfolded')
+        if type(constant_cols) != list:
+            raise ValueError('Parameter constant_cols must be a list of column names.')
+        self.col_name_to_unfold = col_name_to_unfold
+        self.col_name_unfold_values = None
+        self.new_col_names_col = None
+        self.respondent_col = None
+        self.constant_cols = constant_cols
+        
+        # Map from (unfold-col-value, constant_col_name) to 
+        # (constant_col_value, row number of first occurrence):
+        first_occurrences = {}
+        conflicts = []
+        
+        (in_fd, reader) = self.make_reader(in_path_or_2d_array)
+        try:
+            self.header = self.process_in_header_line(reader)
+            for (row_num, row) in enumerate(reader, 2):
+                if len(row) > len(self.header):
+                    raise ValueError('Row %s has more columns than header (%s)' % (row_num, self.header))
+                unfold_col_value = row[self.col_indx_to_unfold]
+                for (col_num, col_name) in self.const_col_indexes:
+                    if col_num >= len(row):
+                        continue
+                    col_value = row[col_num]
+                    const_values_dict_key = (unfold_col_value, col_name)
+                    first_occurrence = first_occurrences.get(const_values_dict_key, None)
+                    if first_occurrence is None:
+                        first_occurrences[const_values_dict_key] = (col_value, row_num)
+                    elif col_value != first_occurrence[0]:
+                        conflicts.append(ConstantColConflict(unfold_col_value, col_name,
+                                                             first_occurrence[0], first_occurrence[1],
+                                                             col_value, row_num))
+                        if max_conflicts is not None and len(conflicts) >= max_conflicts:
+                            return conflicts
+        finally:
+            if in_fd is not None:
+                in_fd.close()
+        return conflicts
+
     # ---------------------------------- Private Methods ---------------------
 
     
@@ -343,18 +540,31 @@ class TableShaper(object):
                 raise ValueError('Specified column %s as source of col names for unfolded columns, but no such column exists' % self.new_col_names_col)
         else:
             self.new_cols_col_indx = None
+        if self.respondent_col is not None:
+            try:
+                self.respondent_col_indx = header.index(self.respondent_col)
+            except ValueError:
+                raise ValueError('Specified column %s as respondent identifier, but no such column exists' % self.respondent_col)
+        else:
+            self.respondent_col_indx = None
         try:
             # Does the column to be unfolded exist?
             # in the running example: 'question':
             self.col_indx_to_unfold = header.index(self.col_name_to_unfold)
         except IndexError:
             raise ValueError('The column to unfold (%s) does not appear in the table header (%s)' % (self.col_name_to_unfold, header))
-        try:
-            # Does the column with the unfold-values
-            # exist? In the running example: 'answer':
-            self.col_indx_of_values = header.index(self.col_name_unfold_values)
-        except IndexError:
-            raise ValueError('The column of unfold values (%s) does not appear in the table header (%s)' % (self.col_name_unfold_values, header))
+        if self.col_name_unfold_values is not None:
+            try:
+                # Does the column with the unfold-values
+                # exist? In the running example: 'answer':
+                self.col_indx_of_values = header.index(self.col_name_unfold_values)
+            except IndexError:
+                raise ValueError('The column of unfold values (%s) does not appear in the table header (%s)' % (self.col_name_unfold_values, header))
+            
+        # Indexes of the constant columns, so that rows
+        # need not be searched for them:
+        self.const_col_indexes = [(col_num, col_name) for (col_num, col_name) in enumerate(header) 
+                                  if col_name in self.constant_cols]
         return header
         
     #-------------------------
@@ -375,6 +585,14 @@ class TableShaper(object):
                 result = [header]
             else:
                 writer.writerow(header)
+                # Rows go out in chunks, rather than one
+                # writerow() call per row:
+                chunk_writer = ChunkedRowWriter(writer, 
+                                                chunk_size=self.write_chunk_size, 
+                                                background=self.background_write)
+                # Either the list that collects the iterator's
+                # rows, or the chunk writer: both have an append():
+                result = chunk_writer
             # Each new row is about one of the unfolded values,
             # like 'DOB' or 'gender' in the example:
             for unfold_key in self.unfolded_values_dict.keys():
@@ -390,13 +608,21 @@ class TableShaper(object):
                     new_row.append(col_constant)
                 
                 unfolded_values = self.unfolded_values_dict[unfold_key]
+                if self.type_inferrer is None:
+                    padding = 0
+                else:
+                    # Convert answers and padding to the 
+                    # question's inferred type:
+                    unfolded_values = self.type_inferrer.coerce(unfold_key, unfolded_values)
+                    padding = self.type_inferrer.coerce(unfold_key, [0])[0]
                 # Fill short-row vectors with zeros:
-                unfolded_values = unfolded_values + (unfolded_max_len - len(unfolded_values))*[0]
+                unfolded_values = unfolded_values + (unfolded_max_len - len(unfolded_values))*[padding]
                 new_row.extend(unfolded_values)
-                if self.out_method == OutMethod.ITERATOR:
-                    result.append(new_row)
-                else:
-                    writer.writerow(new_row)
+                result.append(new_row)
+            if self.out_method != OutMethod.ITERATOR:
+                # Write the last, partial chunk, and wait
+                # for a background writer to finish:
+                chunk_writer.close()
         finally:
             if self.out_method == OutMethod.ITERATOR:
                 return(iter(result))
@@ -405,6 +631,24 @@ class TableShaper(object):
 
     # ---------------------------------- Support Methods ---------------------
                     
+    #-------------------------
+    # make_reader
+    #----------------- 
+
+    def make_reader(self, in_path_or_2d_array):
+        # Return a file descriptor and a row iterator 
+        # for a CSV file, or just an iterator for a 2d 
+        # array, in which case the descriptor is None:
+        if type(in_path_or_2d_array) == str:
+            # Get in-table from a file:
+            in_fd = open(in_path_or_2d_array, 'r')
+            reader = csv.reader(in_fd, delimiter=',') 
+        else:
+            # Get in-table from a 2d array:
+            reader = iter(in_path_or_2d_array)
+            in_fd = None
+        return (in_fd, reader)
+    
     #-------------------------
     # make_writer
     #----------------- 
@@ -413,7 +657,7 @@ class TableShaper(object):
     # Obtain a csv writer object if function is
     # not called as a generator:
         if out_method != OutMethod.ITERATOR and out_method != OutMethod.STDOUT:
-            fd = open(out_method.FILE, 'w')
+            fd = open(out_method.FILE, 'w', self.write_buffer_size)
         elif out_method == OutMethod.STDOUT:
             fd = sys.stdout
         else:
@@ -421,7 +665,339 @@ class TableShaper(object):
         if fd is not None:
             writer = csv.writer(fd)
         return (fd,writer)
+
+class DuplicateIndex(object):
+    '''
+    Remembers which respondents answered which questions,
+    so that repeated answers can be found while a table 
+    is read. Each respondent ID is given a small integer
+    code once. For each question, an array indexed by 
+    those codes holds the position of each respondent's
+    answer among the question's answers, or -1. 
+    
+    Respondents are compared by their IDs themselves, not
+    by hashes, so that distinct respondents are never 
+    taken for one. The IDs are kept once per respondent,
+    and each answer costs one machine word in its 
+    question's array, rather than a dict entry. Questions
+    that few respondents answered still take one word
+    per respondent seen so far.
+    '''
+    
+    KEEP_FIRST = 'keep_first'
+    KEEP_LAST  = 'keep_last'
+    ERROR      = 'error'
+    
+    #-------------------------
+    # __init__
+    #----------------- 
+
+    def __init__(self, policy=KEEP_FIRST):
+        if policy not in [DuplicateIndex.KEEP_FIRST, DuplicateIndex.KEEP_LAST, DuplicateIndex.ERROR]:
+            raise ValueError("Duplicate policy must be one of '%s', '%s', or '%s'; was %s" %\
+                             (DuplicateIndex.KEEP_FIRST, DuplicateIndex.KEEP_LAST, DuplicateIndex.ERROR, policy))
+        self.policy = policy
+        # Respondent ID to code:
+        self.respondent_codes = {}
+        # Question to array of answer positions by code:
+        self.positions = {}
+        self.num_answers = 0
+        
+    #-------------------------
+    # record
+    #----------------- 
+
+    def record(self, respondent, question, position):
+        '''
+        Record that respondent answered question, and that the
+        answer is at the given position among the answers to
+        the question. If the respondent answered the question 
+        before, nothing is recorded, and the position of the 
+        earlier answer is returned. Else returns None.
+        
+        :param respondent: respondent identifier
+        :type respondent: ANY
+        :param question: the question, i.e. the unfold value
+        :type question: ANY
+        :param position: index of the answer in the question's answer list
+        :type position: int
+        '''
+        code = self.respondent_codes.get(respondent, None)
+        if code is None:
+            code = self.respondent_codes[respondent] = len(self.respondent_codes)
+        question_positions = self.positions.get(question, None)
+        if question_positions is None:
+            question_positions = self.positions[question] = array('l')
+        if code >= len(question_positions):
+            question_positions.extend(array('l', [-1]) * (code + 1 - len(question_positions)))
+        earlier_position = question_positions[code]
+        if earlier_position < 0:
+            question_positions[code] = position
+            self.num_answers += 1
+            return None
+        return earlier_position
+    
+    #-------------------------
+    # __len__
+    #----------------- 
+
+    def __len__(self):
+        return self.num_answers
+
+class TypeInferrer(object):
+    '''
+    Infers the type of the answers to each question 
+    from the answers' string values as they are seen
+    one at a time. Types form a progression:
+    
+         int --> float --> string
+         
+    Each question starts as 'int', and is widened when
+    an answer is found that does not fit. Questions with 
+    non-numeric answers are reported as 'categorical' if
+    they have at most max_categories distinct answers.
+    Empty answers are disregarded.
+    '''
+    
+    INT    = 0
+    FLOAT  = 1
+    STRING = 2
+    
+    #-------------------------
+    # __init__
+    #----------------- 
+
+    def __init__(self, max_categories=DEFAULT_MAX_CATEGORIES):
+        self.max_categories = max_categories
+        # Map from question to one of INT/FLOAT/STRING:
+        self.types = OrderedDict()
+        # Map from question to set of distinct non-numeric
+        # answers. Set to None once there are more than
+        # max_categories of them:
+        self.categories = {}
+        
+    #-------------------------
+    # observe
+    #----------------- 
+
+    def observe(self, key, value):
+        '''
+        Account for one answer to question key.
+        
+        :param key: the question, i.e. the unfold value
+        :type key: string
+        :param value: one answer to the question
+        :type value: {string | int | float}
+        '''
+        cur_type = self.types.get(key, TypeInferrer.INT)
+        if cur_type != TypeInferrer.STRING:
+            value_type = self.value_type(value)
+            if value_type is None:
+                # Missing value:
+                self.types.setdefault(key, cur_type)
+                return
+            cur_type = max(cur_type, value_type)
+        self.types[key] = cur_type
+        if cur_type == TypeInferrer.STRING:
+            categories = self.categories.get(key, set())
+            if categories is not None:
+                categories.add(value)
+                if len(categories) > self.max_categories:
+                    categories = None
+                self.categories[key] = categories
+                
+    #-------------------------
+    # schema
+    #----------------- 
+
+    def schema(self):
+        '''
+        Return an OrderedDict mapping each question seen
+        so far to one of 'int', 'float', 'categorical',
+        or 'string'.
+        '''
+        schema = OrderedDict()
+        for key in self.types.keys():
+            schema[key] = self.type_name(key)
+        return schema
+    
+    #-------------------------
+    # type_name
+    #----------------- 
+
+    def type_name(self, key):
+        cur_type = self.types[key]
+        if cur_type == TypeInferrer.INT:
+            return 'int'
+        elif cur_type == TypeInferrer.FLOAT:
+            return 'float'
+        elif self.categories.get(key, None) is not None:
+            return 'categorical'
+        else:
+            return 'string'
+    
+    #-------------------------
+    # coerce
+    #----------------- 
+
+    def coerce(self, key, values):
+        '''
+        Return a new list with the given answers to question
+        key converted to the question's inferred type. Empty
+        answers to numeric questions become float('nan').
+        
+        :param key: the question, i.e. the unfold value
+        :type key: string
+        :param values: answers to the question
+        :type values: [{string | int | float}]
+        '''
+        cur_type = self.types[key]
+        if cur_type == TypeInferrer.STRING:
+            return [value if isinstance(value, str) else str(value) for value in values]
+        convert = int if cur_type == TypeInferrer.INT else float
+        return [float('nan') if self.is_missing(value) else convert(value) for value in values]
+    
+    # ---------------------------------- Private Methods ---------------------
+    
+    #-------------------------
+    # value_type
+    #----------------- 
+
+    def value_type(self, value):
+        '''
+        Return the narrowest of INT, FLOAT, STRING that
+        can hold the value, or None if value is empty.
+        '''
+        if self.is_missing(value):
+            return None
+        if isinstance(value, bool):
+            return TypeInferrer.STRING
+        if isinstance(value, numbers.Integral):
+            return TypeInferrer.INT
+        if isinstance(value, numbers.Real):
+            return TypeInferrer.FLOAT
+        try:
+            int(value)
+            return TypeInferrer.INT
+        except (ValueError, TypeError):
+            pass
+        try:
+            float(value)
+            return TypeInferrer.FLOAT
+        except (ValueError, TypeError):
+            return TypeInferrer.STRING
+        
+    #-------------------------
+    # is_missing
+    #----------------- 
+    
+    def is_missing(self, value):
+        return isinstance(value, str) and len(value.strip()) == 0
+
+class ChunkedRowWriter(object):
+    '''
+    Collects rows destined for a csv writer, and
+    hands them to the writer's writerows() in chunks
+    of chunk_size rows. This saves the per-row call
+    overhead of writerow() for tables with many rows.
+    
+    If background is True, full chunks are passed to
+    a separate thread, which formats and writes them
+    while the caller assembles the next chunk. At most
+    two chunks are waiting at any time, so memory stays
+    bounded by the chunk size.
+    
+    Callers must call close() after the last row, which
+    writes any partial chunk, and waits for the background
+    thread to finish.
+    '''
+    
+    #-------------------------
+    # __init__
+    #----------------- 
+
+    def __init__(self, writer, chunk_size=DEFAULT_WRITE_CHUNK_SIZE, background=False):
+        self.writer = writer
+        self.chunk_size = chunk_size
+        self.chunk = []
+        self.write_error = None
+        if background:
+            self.chunk_queue = Queue(maxsize=2)
+            self.write_thread = threading.Thread(target=self.write_chunks_from_queue)
+            self.write_thread.daemon = True
+            self.write_thread.start()
+        else:
+            self.chunk_queue = None
+
+    #-------------------------
+    # append
+    #----------------- 
     
+    def append(self, row):
+        self.chunk.append(row)
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    #-------------------------
+    # flush
+    #----------------- 
+
+    def flush(self):
+        '''
+        Write the rows collected so far, or hand them
+        to the background thread.
+        '''
+        if len(self.chunk) == 0:
+            return
+        if self.chunk_queue is None:
+            self.writer.writerows(self.chunk)
+        else:
+            self.check_write_error()
+            self.chunk_queue.put(self.chunk)
+        self.chunk = []
+
+    #-------------------------
+    # close
+    #----------------- 
+
+    def close(self):
+        self.flush()
+        if self.chunk_queue is not None:
+            # None tells the background thread to quit:
+            self.chunk_queue.put(None)
+            self.write_thread.join()
+            self.check_write_error()
+
+    # ---------------------------------- Private Methods ---------------------
+    
+    #-------------------------
+    # write_chunks_from_queue
+    #----------------- 
+    
+    def write_chunks_from_queue(self):
+        # Runs in the background thread:
+        while True:
+            chunk = self.chunk_queue.get()
+            if chunk is None:
+                return
+            if self.write_error is not None:
+                # Keep draining the queue, so that
+                # the main thread does not block:
+                continue
+            try:
+                self.writer.writerows(chunk)
+            except Exception as e:
+                self.write_error = e
+
+    #-------------------------
+    # check_write_error
+    #----------------- 
+
+    def check_write_error(self):
+        # Surface an error from the background thread
+        # in the main thread:
+        if self.write_error is not None:
+            raise self.write_error
         
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), formatter_class=argparse.RawTextHelpFormatter)
@@ -436,6 +1012,34 @@ if __name__ == '__main__':
                         help="Column that will supply names for new columns \n"+\
                              "(e.g. 'userId'); if not provided, the new cols \n"+\
                              "will be 'v1','v2',...")
+    parser.add_argument('-k', '--chunkSize',
+                        type=int,
+                        default=DEFAULT_WRITE_CHUNK_SIZE,
+                        help='Number of output rows written at a time; default: %s' % DEFAULT_WRITE_CHUNK_SIZE)
+    parser.add_argument('-b', '--backgroundWrite',
+                        action='store_true',
+                        default=False,
+                        help='Format and write output chunks in a separate thread.')
+    parser.add_argument('-d', '--duplicates',
+                        choices=[DuplicateIndex.KEEP_FIRST, DuplicateIndex.KEEP_LAST, DuplicateIndex.ERROR],
+                        default=None,
+                        help='What to do when a respondent answered a question more than once;\n'+\
+                             'default: keep all answers.')
+    parser.add_argument('-r', '--respondentCol',
+                        action='store',
+                        default=None,
+                        help='Column that identifies respondents for duplicate detection;\n'+\
+                             'default: the --newColNameCol column.')
+    parser.add_argument('-v', '--validate',
+                        action='store_true',
+                        default=False,
+                        help='Only check the constant columns for inconsistencies,\n'+\
+                             'and list them on stdout, rather than unfolding.')
+    parser.add_argument('-m', '--maxConflicts',
+                        type=int,
+                        default=DEFAULT_MAX_CONFLICTS,
+                        help='Number of inconsistencies after which --validate stops;\n'+\
+                             'default: %s' % DEFAULT_MAX_CONFLICTS)
     parser.add_argument('table_path',
                         help='Path to .csv file'
                         )
@@ -447,11 +1051,27 @@ if __name__ == '__main__':
     args = parser.parse_args();
     
     shaper = TableShaper()
+    if args.validate:
+        if args.constantCol is None:
+            print('Validation needs at least one --constantCol.')
+            sys.exit(1)
+        conflicts = shaper.validate(args.table_path, 
+                                    args.col_to_unfold, 
+                                    args.constantCol, 
+                                    max_conflicts=args.maxConflicts)
+        writer = csv.writer(sys.stdout)
+        writer.writerow(ConstantColConflict._fields)
+        writer.writerows(conflicts)
+        sys.exit(1 if len(conflicts) > 0 else 0)
     shaper.unfold(args.table_path, 
                   args.col_to_unfold, 
                   args.col_of_values, 
                   out_method=OutMethod.STDOUT, 
                   constant_cols=args.constantCol, 
-                  new_col_names_col=args.newColNameCol)
+                  new_col_names_col=args.newColNameCol,
+                  write_chunk_size=args.chunkSize,
+                  background_write=args.backgroundWrite,
+                  duplicate_policy=args.duplicates,
+                  respondent_col=args.respondentCol)
 
         
\ No newline at end of file
@@ -0,0 +1,411 @@
+'''
+Created on Oct 19, 2026
+
+@author: paepcke
+
+Throughput benchmarks for TableShaper.unfold(). Input
+tables are long-format surveys (one row per respondent
+and question) made by a deterministic generator, so
+that results from different versions of TableShaper
+can be compared. For each OutMethod the benchmark
+records input rows per second, output bytes per second,
+and peak memory, and writes the results as JSON.
+
+From the command line:
+
+   python unfolding_benchmark.py --respondents 10000 --questions 50 \
+                                 --label v0.0.5 --out /tmp/bench.json
+'''
+import argparse
+import gc
+import json
+import os
+import pickle
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from survey_utils.table_utils.unfolding import OutMethod
+from survey_utils.table_utils.unfolding import TableShaper
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2: fall back to the peak resident
+    # set size of a child process per measurement:
+    tracemalloc = None
+    import resource
+
+# Run in a child process by measure_unfold_in_child(); reads
+# the pickled arguments of measure_unfold() from stdin, and
+# prints the measurement as JSON:
+CHILD_MEASUREMENT = '''
+import json
+import pickle
+import sys
+from survey_utils.table_utils import unfolding_benchmark
+(in_path, constant_cols, method_name, out_path, unfold_kwargs) = \\
+    pickle.loads(getattr(sys.stdin, 'buffer', sys.stdin).read())
+out_method = unfolding_benchmark.out_method_for(method_name, out_path)
+print(json.dumps(unfolding_benchmark.measure_unfold(in_path, constant_cols, out_method, out_path, unfold_kwargs)))
+'''
+
+#-------------------------
+# generate_survey
+#-----------------
+
+def generate_survey(num_respondents,
+                    num_questions,
+                    num_constant_cols=1,
+                    answer_cardinality=5,
+                    missing_rate=0.0,
+                    seed=4711):
+    '''
+    Create a long-format survey table: one header row,
+    followed by one row per respondent and question.
+    Columns are:
+
+       userId, question, const0, const1, ..., answer
+
+    Constant columns depend only on the question, as
+    unfold() requires. Answers are drawn from
+    answer_cardinality distinct values. With probability
+    missing_rate a respondent skipped a question, and
+    the corresponding row is absent. The same arguments
+    always produce the same table.
+
+    :param num_respondents: number of respondents
+    :type num_respondents: int
+    :param num_questions: number of questions
+    :type num_questions: int
+    :param num_constant_cols: number of columns that are
+        constant for each question
+    :type num_constant_cols: int
+    :param answer_cardinality: number of distinct answers
+    :type answer_cardinality: int
+    :param missing_rate: probability of a question being skipped
+    :type missing_rate: float
+    :param seed: seed of the random number generator
+    :type seed: int
+    :return: table as a list of rows, header first
+    :rtype: [[string]]
+    '''
+    rand = random.Random(seed)
+    const_col_names = ['const%s' % col_num for col_num in range(num_constant_cols)]
+    table = [['userId', 'question'] + const_col_names + ['answer']]
+
+    question_names = ['q%s' % question_num for question_num in range(num_questions)]
+    const_values = [['c%s_%s' % (question_num, col_num) for col_num in range(num_constant_cols)]
+                    for question_num in range(num_questions)]
+    answers = ['a%s' % answer_num for answer_num in range(answer_cardinality)]
+
+    for respondent_num in range(num_respondents):
+        user_id = str(respondent_num)
+        for question_num in range(num_questions):
+            if missing_rate > 0 and rand.random() < missing_rate:
+                continue
+            table.append([user_id, question_names[question_num]] +\
+                         const_values[question_num] +\
+                         [answers[rand.randrange(answer_cardinality)]])
+    return table
+
+#-------------------------
+# write_survey_csv
+#-----------------
+
+def write_survey_csv(path, table):
+    '''
+    Write a table made by generate_survey() to a
+    CSV file, and return the file's size in bytes.
+    '''
+    with open(path, 'w') as fd:
+        for row in table:
+            fd.write(','.join(row))
+            fd.write('\n')
+    return os.path.getsize(path)
+
+#-------------------------
+# run_benchmark
+#-----------------
+
+def run_benchmark(num_respondents=1000,
+                  num_questions=20,
+                  num_constant_cols=1,
+                  answer_cardinality=5,
+                  missing_rate=0.0,
+                  seed=4711,
+                  repeats=3,
+                  label=None,
+                  **unfold_kwargs):
+    '''
+    Generate a survey, write it to a temporary CSV file,
+    and unfold it once per OutMethod (ITERATOR, STDOUT, and
+    FILE) for each of the given number of repeats. The
+    fastest of the repeats is reported. STDOUT output is
+    counted, but discarded. For ITERATOR, the timing covers
+    unfold()'s scan of the input and the draining of the
+    returned rows; their size as CSV is computed afterwards,
+    in an untimed run.
+    
+    Peak memory is measured with tracemalloc. Without it
+    (Python 2), each run happens in a child process, whose
+    peak resident set size is reported; the peak of this
+    process would cover all earlier runs.
+
+    Keyword arguments beyond the ones below are passed to
+    unfold(), e.g. write_chunk_size or background_write.
+
+    :param label: name of the version under test, recorded
+        in the results
+    :type label: {None | string}
+    :param repeats: number of times each measurement is made
+    :type repeats: int
+    :return: dict with entries 'label', 'params', 'environment',
+        and 'results'; the latter maps each OutMethod name to a
+        dict with keys 'seconds', 'rows_per_sec', 'out_bytes',
+        'out_bytes_per_sec', and 'peak_mem_bytes'
+    :rtype: dict
+    '''
+    params = {'num_respondents'    : num_respondents,
+              'num_questions'      : num_questions,
+              'num_constant_cols'  : num_constant_cols,
+              'answer_cardinality' : answer_cardinality,
+              'missing_rate'       : missing_rate,
+              'seed'               : seed,
+              'repeats'            : repeats,
+              'unfold_kwargs'      : unfold_kwargs
+              }
+    table = generate_survey(num_respondents, num_questions, num_constant_cols,
+                            answer_cardinality, missing_rate, seed)
+    num_rows = len(table) - 1
+    constant_cols = table[0][2:-1]
+
+    (in_fd, in_path) = tempfile.mkstemp(suffix='.csv')
+    os.close(in_fd)
+    (out_fd, out_path) = tempfile.mkstemp(suffix='.csv')
+    os.close(out_fd)
+    # Memory of the generated table should not
+    # count against unfold():
+    params['in_bytes'] = write_survey_csv(in_path, table)
+    params['in_rows'] = num_rows
+    del table
+
+    results = {}
+    try:
+        for method_name in ['ITERATOR', 'STDOUT', 'FILE']:
+            best = None
+            for _repeat in range(repeats):
+                if tracemalloc is not None:
+                    measurement = measure_unfold(in_path, constant_cols, out_method_for(method_name, out_path), 
+                                                 out_path, unfold_kwargs)
+                else:
+                    measurement = measure_unfold_in_child(in_path, constant_cols, method_name, 
+                                                          out_path, unfold_kwargs)
+                if best is None or measurement['seconds'] < best['seconds']:
+                    best = measurement
+            if method_name == 'ITERATOR':
+                best['out_bytes'] = iterator_out_bytes(in_path, constant_cols, unfold_kwargs)
+            best['rows_per_sec'] = num_rows / best['seconds'] if best['seconds'] > 0 else None
+            best['out_bytes_per_sec'] = best['out_bytes'] / best['seconds'] if best['seconds'] > 0 else None
+            results[method_name] = best
+    finally:
+        os.remove(in_path)
+        os.remove(out_path)
+
+    return {'label'       : label,
+            'timestamp'   : time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'params'      : params,
+            'environment' : {'python'   : platform.python_version(),
+                             'platform' : platform.platform(),
+                             'peak_mem_method' : 'tracemalloc' if tracemalloc is not None else 'child_peak_rss'
+                             },
+            'results'     : results
+            }
+
+# ----------------------------- Private Utility Functions -------------
+
+#-------------------------
+# measure_unfold
+#-----------------
+
+def measure_unfold(in_path, constant_cols, out_method, out_path, unfold_kwargs):
+    '''
+    Run one unfold(), and return a dict with its
+    elapsed time, output bytes, and peak memory.
+    For ITERATOR, output bytes are None; see
+    iterator_out_bytes().
+    '''
+    shaper = TableShaper()
+    gc.collect()
+    stdout_saved = sys.stdout
+    if out_method == OutMethod.STDOUT:
+        sys.stdout = ByteCounter()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    try:
+        start_time = time.time()
+        result = shaper.unfold(in_path, 'question', 'answer',
+                               out_method=out_method,
+                               constant_cols=constant_cols,
+                               new_col_names_col='userId',
+                               **unfold_kwargs)
+        if out_method == OutMethod.ITERATOR:
+            # unfold() scans the whole input before the
+            # first row is yielded; the timing covers that
+            # scan and draining all rows, but not sizing them:
+            out_bytes = None
+            for _row in result:
+                pass
+        elapsed = time.time() - start_time
+        if tracemalloc is not None:
+            peak_mem = tracemalloc.get_traced_memory()[1]
+        else:
+            peak_mem = peak_rss()
+    finally:
+        if tracemalloc is not None:
+            tracemalloc.stop()
+        if out_method == OutMethod.STDOUT:
+            out_bytes = sys.stdout.num_bytes
+        sys.stdout = stdout_saved
+    if out_method not in [OutMethod.ITERATOR, OutMethod.STDOUT]:
+        out_bytes = os.path.getsize(out_path)
+    return {'seconds'        : elapsed,
+            'out_bytes'      : out_bytes,
+            'peak_mem_bytes' : peak_mem
+            }
+
+#-------------------------
+# measure_unfold_in_child
+#-----------------
+
+def measure_unfold_in_child(in_path, constant_cols, method_name, out_path, unfold_kwargs):
+    '''
+    Like measure_unfold(), but run in a fresh Python 
+    process, so that its peak memory covers this one
+    unfold() only. The OutMethod is given by name.
+    '''
+    # The child imports this module from the same tree:
+    src_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([src_dir, os.environ.get('PYTHONPATH', '')]))
+    child = subprocess.Popen([sys.executable, '-c', CHILD_MEASUREMENT], 
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+    (child_out, _child_err) = child.communicate(pickle.dumps((in_path, constant_cols, method_name, 
+                                                             out_path, unfold_kwargs), 2))
+    if child.returncode != 0:
+        raise RuntimeError('Measurement of %s in child process failed.' % method_name)
+    return json.loads(child_out.decode('utf-8').strip().splitlines()[-1])
+
+#-------------------------
+# out_method_for
+#-----------------
+
+def out_method_for(method_name, out_path):
+    '''
+    Return the OutMethod called method_name; FILE
+    writes to out_path.
+    '''
+    if method_name == 'ITERATOR':
+        return OutMethod.ITERATOR
+    elif method_name == 'STDOUT':
+        return OutMethod.STDOUT
+    else:
+        return OutMethod(out_path)
+
+#-------------------------
+# iterator_out_bytes
+#-----------------
+
+def iterator_out_bytes(in_path, constant_cols, unfold_kwargs):
+    '''
+    Return the size of the rows that unfold() yields
+    with OutMethod.ITERATOR, as if written as CSV.
+    Computed apart from the timed runs.
+    '''
+    result = TableShaper().unfold(in_path, 'question', 'answer',
+                                  out_method=OutMethod.ITERATOR,
+                                  constant_cols=constant_cols,
+                                  new_col_names_col='userId',
+                                  **unfold_kwargs)
+    out_bytes = 0
+    for row in result:
+        out_bytes += sum(len(str(value)) for value in row) + len(row) + 1
+    return out_bytes
+
+#-------------------------
+# peak_rss
+#-----------------
+
+def peak_rss():
+    '''
+    Return the peak resident set size of this process
+    in bytes. On Linux, from VmHWM in /proc, which unlike
+    ru_maxrss does not include the peak of the parent 
+    process this one was started from.
+    '''
+    try:
+        with open('/proc/self/status') as fd:
+            for line in fd:
+                if line.startswith('VmHWM:'):
+                    # In kB:
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    # Kilobytes on Linux, bytes on Mac OS:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+class ByteCounter(object):
+    '''
+    File-like stand-in for stdout that only
+    counts the bytes written to it.
+    '''
+    def __init__(self):
+        self.num_bytes = 0
+
+    def write(self, text):
+        self.num_bytes += len(text)
+
+    def flush(self):
+        pass
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--respondents', type=int, default=1000,
+                        help='Number of respondents; default: 1000')
+    parser.add_argument('--questions', type=int, default=20,
+                        help='Number of questions; default: 20')
+    parser.add_argument('--constantCols', type=int, default=1,
+                        help='Number of constant columns; default: 1')
+    parser.add_argument('--cardinality', type=int, default=5,
+                        help='Number of distinct answers; default: 5')
+    parser.add_argument('--missingRate', type=float, default=0.0,
+                        help='Probability of a skipped question; default: 0.0')
+    parser.add_argument('--seed', type=int, default=4711,
+                        help='Random seed; default: 4711')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Number of runs per measurement, of which the fastest\n'+\
+                             'is reported; default: 3')
+    parser.add_argument('--label', default=None,
+                        help='Name of the version under test, recorded in the results.')
+    parser.add_argument('--out', default=None,
+                        help='File to which the JSON results are written;\n'+\
+                             'default: stdout.')
+
+    args = parser.parse_args();
+
+    results = run_benchmark(num_respondents=args.respondents,
+                            num_questions=args.questions,
+                            num_constant_cols=args.constantCols,
+                            answer_cardinality=args.cardinality,
+                            missing_rate=args.missingRate,
+                            seed=args.seed,
+                            repeats=args.repeats,
+                            label=args.label)
+    if args.out is None:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        with open(args.out, 'w') as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
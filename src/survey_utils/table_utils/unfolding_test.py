@@ -8,8 +8,11 @@ import tempfile
 from unittest import skipIf
 import unittest
 
+from survey_utils.table_utils.unfolding import ConstantColConflict
+from survey_utils.table_utils.unfolding import DuplicateIndex
 from survey_utils.table_utils.unfolding import OutMethod
 from survey_utils.table_utils.unfolding import TableShaper
+from survey_utils.table_utils.unfolding_benchmark import generate_survey, run_benchmark
 from cStringIO import StringIO
 
 
@@ -75,6 +78,152 @@ class TestUnfolding(unittest.TestCase):
             self.assertEqual('DOB,1983,1980', fd.readline().strip())
             self.assertEqual('gender,F,M', fd.readline().strip())
                 
+    @skipIf(DO_ALL == False, "Skipping for now") 
+    def test_unfold_to_file_chunked(self):
+        # Chunks smaller than the number of rows, so
+        # that several writerows() calls happen:
+        outfile_name = tempfile.NamedTemporaryFile().name
+        self.shaper.unfold(self.survey, 'question', 'answer', 
+                           out_method=OutMethod(outfile_name),
+                           write_chunk_size=1,
+                           write_buffer_size=16)
+        with open(outfile_name, 'r') as fd:
+            self.assertEqual('question,v0,v1', fd.readline().strip())
+            self.assertEqual('DOB,1983,1980', fd.readline().strip())
+            self.assertEqual('gender,F,M', fd.readline().strip())
+            
+    @skipIf(DO_ALL == False, "Skipping for now") 
+    def test_unfold_background_write(self):
+        # Many questions, so that many chunks pass
+        # through the background thread:
+        survey = [['userId','question','answer']]
+        for user_id in [10,20]:
+            for question_num in range(250):
+                survey.append([user_id, 'q%s' % question_num, str(user_id + question_num)])
+        outfile_name = tempfile.NamedTemporaryFile().name
+        self.shaper.unfold(survey, 'question', 'answer', 
+                           out_method=OutMethod(outfile_name),
+                           write_chunk_size=7,
+                           background_write=True)
+        with open(outfile_name, 'r') as fd:
+            lines = [line.strip() for line in fd.readlines()]
+        self.assertEqual(251, len(lines))
+        self.assertEqual('question,v0,v1', lines[0])
+        self.assertEqual('q0,10,20', lines[1])
+        self.assertEqual('q249,259,269', lines[-1])
+        
+    @skipIf(DO_ALL == False, "Skipping for now") 
+    def test_unfold_bad_chunk_size(self):
+        with self.assertRaises(ValueError):
+            self.shaper.unfold(self.survey, 'question', 'answer', write_chunk_size=0)
+                
+    @skipIf(DO_ALL == False, "Skipping for now") 
+    def test_unfold_infer_types(self):
+        survey = [['userId','question','answer'],
+                  [10,'DOB','1983'],
+                  [10,'height','1.75'],
+                  [10,'gender','F'],
+                  [10,'comment','Great'],
+                  [20,'DOB','1980'],
+                  [20,'height','1.8'],
+                  [20,'gender','M'],
+                  [20,'comment','Too long'],
+                  [30,'DOB',''],
+                  [30,'height','2'],
+                  [30,'comment','Ok'],
+                  ]
+        it = self.shaper.unfold(survey, 'question', 'answer', 
+                                out_method=OutMethod.ITERATOR,
+                                infer_types=True,
+                                max_categories=2)
+        self.assertEqual(['question','v0','v1','v2'], next(it))
+        dob_row = next(it)
+        self.assertEqual(['DOB', 1983, 1980], dob_row[:3])
+        self.assertTrue(isinstance(dob_row[1], int))
+        # Empty answer to a numeric question:
+        self.assertTrue(dob_row[3] != dob_row[3])
+        height_row = next(it)
+        self.assertEqual(['height', 1.75, 1.8, 2.0], height_row)
+        self.assertTrue(isinstance(height_row[3], float))
+        # Padding is of the question's type:
+        self.assertEqual(['gender','F','M','0'], next(it))
+        self.assertEqual(['comment','Great','Too long','Ok'], next(it))
+        
+        self.assertEqual(['DOB','height','gender','comment'], list(self.shaper.inferred_schema.keys()))
+        self.assertEqual(['int','float','categorical','string'], list(self.shaper.inferred_schema.values()))
+        
+    @skipIf(DO_ALL == False, "Skipping for now") 
+    def test_unfold_infer_types_csv_unchanged(self):
+        self.shaper.unfold(self.survey, 'question', 'answer', infer_types=True)
+        output = sys.stdout.getvalue().strip()
+        expected = "question,v0,v1\r\n" +\
+                    "DOB,1983,1980\r\n" +\
+                    "gender,F,M"
+        self.assertEquals(expected, output)
+        self.assertEqual('int', self.shaper.inferred_schema['DOB'])
+        
+    @skipIf(DO_ALL == False, "Skipping for now") 
+    def test_unfold_duplicates(self):
+        # Respondent 10 answers DOB twice:
+        self.survey.insert(3, [10,'DOB','pullDown','Jun2010','1984'])
+        
+        # Without duplicate detection, the second answer
+        # shifts respondent 20's DOB answer:
+        it = self.shaper.unfold(self.survey, 'question', 'answer', out_method=OutMethod.ITERATOR)
+        next(it)
+        self.assertEqual(['DOB','1983','1984','1980'], next(it))
+        
+        it = self.shaper.unfold(self.survey, 'question', 'answer', 
+                                out_method=OutMethod.ITERATOR,
+                                new_col_names_col='userId',
+                                duplicate_policy=DuplicateIndex.KEEP_FIRST)
+        self.assertEqual(['question',10,20], next(it))
+        self.assertEqual(['DOB','1983','1980'], next(it))
+        self.assertEqual(['gender','F','M'], next(it))
+        
+        it = self.shaper.unfold(self.survey, 'question', 'answer', 
+                                out_method=OutMethod.ITERATOR,
+                                respondent_col='userId',
+                                duplicate_policy=DuplicateIndex.KEEP_LAST)
+        self.assertEqual(['question','v0','v1'], next(it))
+        self.assertEqual(['DOB','1984','1980'], next(it))
+        
+        with self.assertRaises(ValueError):
+            self.shaper.unfold(self.survey, 'question', 'answer', 
+                               respondent_col='userId',
+                               duplicate_policy=DuplicateIndex.ERROR)
+            
+    @skipIf(DO_ALL == False, "Skipping for now") 
+    def test_duplicate_index(self):
+        index = DuplicateIndex()
+        self.assertEqual(None, index.record(10, 'DOB', 0))
+        self.assertEqual(None, index.record(10, 'gender', 0))
+        self.assertEqual(0, index.record(10, 'DOB', 1))
+        # Pairs with equal hashes are still told apart:
+        self.assertEqual(hash((-1, 'DOB')), hash((-2, 'DOB')))
+        self.assertEqual(None, index.record(-1, 'DOB', 1))
+        self.assertEqual(None, index.record(-2, 'DOB', 2))
+        self.assertEqual(4, len(index))
+        # Question first answered by a later respondent:
+        self.assertEqual(None, index.record(-2, 'gender', 1))
+        self.assertEqual(1, index.record(-2, 'gender', 2))
+        self.assertEqual(None, index.record(-1, 'gender', 2))
+        self.assertEqual(6, len(index))
+            
+    @skipIf(DO_ALL == False, "Skipping for now") 
+    def test_unfold_duplicates_bad_spec(self):
+        # No column to identify respondents:
+        with self.assertRaises(ValueError):
+            self.shaper.unfold(self.survey, 'question', 'answer', duplicate_policy=DuplicateIndex.KEEP_FIRST)
+        # Unknown policy:
+        with self.assertRaises(ValueError):
+            self.shaper.unfold(self.survey, 'question', 'answer', 
+                               respondent_col='userId', duplicate_policy='keep_all')
+        # Non-existent respondent column:
+        with self.assertRaises(ValueError):
+            self.shaper.unfold(self.survey, 'question', 'answer', 
+                               respondent_col='Foo', duplicate_policy=DuplicateIndex.KEEP_FIRST)
+            
     @skipIf(DO_ALL == False, "Skipping for now") 
     def test_unfold_bad_unfold_col_spec(self):
 
@@ -127,6 +276,50 @@ class TestUnfolding(unittest.TestCase):
             # Good! Got exception:
             pass
 
+    @skipIf(DO_ALL == False, "Skipping for now") 
+    def test_validate(self):
+        # Consistent table:
+        self.assertEqual([], self.shaper.validate(self.survey, 'question', ['questionType', 'timeAdded']))
+        
+        self.survey[1][2] = 'radio'
+        self.survey[4][3] = 'Jun2011'
+        conflicts = self.shaper.validate(self.survey, 'question', ['questionType', 'timeAdded'])
+        self.assertEqual([ConstantColConflict('DOB', 'questionType', 'radio', 2, 'pullDown', 4),
+                          ConstantColConflict('gender', 'timeAdded', 'May2011', 3, 'Jun2011', 5)],
+                         conflicts)
+        # Answers were not accumulated:
+        self.assertFalse(hasattr(self.shaper, 'unfolded_values_dict'))
+        
+        # Stop after first conflict:
+        conflicts = self.shaper.validate(self.survey, 'question', ['questionType', 'timeAdded'], max_conflicts=1)
+        self.assertEqual(1, len(conflicts))
+        
+    @skipIf(DO_ALL == False, "Skipping for now") 
+    def test_short_rows(self):
+        # Second row lacks its trailing constant column:
+        survey = [['userId','question','answer','questionType'],
+                  [10,'DOB','1983','pullDown'],
+                  [20,'DOB','1980'],
+                  [30,'DOB','1981','pullDown']]
+        it = self.shaper.unfold(survey, 'question', 'answer', out_method=OutMethod.ITERATOR,
+                                constant_cols=['questionType'])
+        self.assertEqual(['question','questionType','v0','v1','v2'], next(it))
+        self.assertEqual(['DOB','pullDown','1983','1980','1981'], next(it))
+        self.assertEqual([], self.shaper.validate(survey, 'question', ['questionType']))
+        
+    @skipIf(DO_ALL == False, "Skipping for now") 
+    def test_validate_from_file(self):
+        in_file = tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False)
+        in_file.write('userId,question,questionType,answer\n' +\
+                      '10,DOB,pullDown,1983\n' +\
+                      '20,DOB,radio,1980\n' +\
+                      '30,DOB,text,1981\n')
+        in_file.close()
+        conflicts = self.shaper.validate(in_file.name, 'question', ['questionType'])
+        self.assertEqual([('DOB', 'questionType', 'pullDown', 2, 'radio', 3),
+                          ('DOB', 'questionType', 'pullDown', 2, 'text', 4)],
+                         conflicts)
+        
     @skipIf(DO_ALL == False, "Skipping for now") 
     def test_unfold_no_error_new_cols_named(self):
         # Have the user-id column provide new columns' header:
@@ -164,6 +357,32 @@ class TestUnfolding(unittest.TestCase):
             # Good: exception:
             pass
             
+    #---------------------------- Benchmark Support ----------------
+
+    @skipIf(DO_ALL == False, "Skipping for now") 
+    def test_generate_survey(self):
+        survey = generate_survey(3, 4, num_constant_cols=2, answer_cardinality=2)
+        self.assertEqual(['userId','question','const0','const1','answer'], survey[0])
+        self.assertEqual(13, len(survey))
+        self.assertEqual(['0','q1','c1_0','c1_1'], survey[2][:4])
+        self.assertTrue(survey[2][4] in ['a0','a1'])
+        # Deterministic:
+        self.assertEqual(survey, generate_survey(3, 4, num_constant_cols=2, answer_cardinality=2))
+        # Skipped questions:
+        survey = generate_survey(100, 10, missing_rate=0.5)
+        self.assertTrue(200 < len(survey) - 1 < 800)
+        
+    @skipIf(DO_ALL == False, "Skipping for now") 
+    def test_run_benchmark(self):
+        stats = run_benchmark(num_respondents=5, num_questions=3, repeats=1, label='test')
+        self.assertEqual('test', stats['label'])
+        self.assertEqual(15, stats['params']['in_rows'])
+        self.assertEqual(['FILE','ITERATOR','STDOUT'], sorted(stats['results'].keys()))
+        for method_stats in stats['results'].values():
+            self.assertTrue(method_stats['out_bytes'] > 0)
+            self.assertTrue(method_stats['peak_mem_bytes'] > 0)
+        # Benchmark output must not leak to stdout:
+        self.assertEqual('', sys.stdout.getvalue())
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']